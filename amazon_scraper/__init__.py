@@ -1,4 +1,22 @@
 #__init__.py file
 
 from .scraper import *
-from .product import *
\ No newline at end of file
+from .product import *
+from .pipeline import *
+from .async_scraper import *
+from .detail_parser import *
+from .output import *
+from .cache import *
+from .dedup import *
+from .batch import *
+from .ratelimit import *
+from .checkpoint import *
+from .metrics import *
+from .parse_pool import *
+from .history import *
+from .enrich import *
+from .transport import *
+from .download import *
+from .distributed import *
+from .rules import *
+from .fingerprint import *
\ No newline at end of file
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio based alternative to Scraper, all requests share one connection pooled
+aiohttp client so hundreds of pages can be in flight without a thread per request
+"""
+
+import zlib
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .scraper import Scraper, throttle_statuses
+from .cache import get_asin
+from .pipeline import RetryLater
+from .download import BodyReader, accept_encoding, chunk_size
+
+
+class AsyncScraper(Scraper):
+    """Does the requests with the Amazon servers from a single event loop
+    """
+
+    def __init__(self, word, max_concurrency=200, **kwargs):
+        """ Init of the async scraper
+
+        Args:
+            word (str): word searched on amazon.com, also used to name the output file
+            max_concurrency (int): maximum number of requests in flight at the same time
+            **kwargs: passed on to Scraper
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncScraper requires aiohttp, install it with: pip install aiohttp")
+        if kwargs.get('checkpoint') is not None:
+            raise ValueError("AsyncScraper does not support checkpoints, use Scraper to resume crawls")
+        if kwargs.get('transport') is not None:
+            raise ValueError("AsyncScraper sends every request through api_url, use Scraper for a transport pool")
+        super().__init__(word, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.client = None
+        self.semaphore = None
+        self.loop = None
+        # tasks of the search pages scheduled while parsing the pages before them
+        self.page_tasks = []
+
+    async def open(self):
+        """Creates the shared client, must be called from inside the event loop that does the requests
+        """
+
+        if self.client is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            # bodies are decompressed by BodyReader, so the bytes on the wire can be counted
+            self.client = aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                                headers={'Accept-Encoding': accept_encoding})
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.loop = asyncio.get_running_loop()
+
+    async def close(self):
+        """Closes the shared client and all of its connections
+        """
+
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            self.semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def async_get_request(self, url):
+        """ Places GET request through the shared client, paced by the rate limiter
+
+        Args:
+            url (str): Url where the get request will be placed
+
+        Returns:
+            status, body, charset or None: returns the status, the decompressed body sent back by the server and its charset,
+            body and charset are None for a throttled request (429 or 503). Returns None if the connection fails
+            or status code is any other than 200. The body of a block page is cut after validity_window bytes
+        """
+
+        payload = {"api_key": self.api_key, "url": url}
+        await self.rate_limiter.async_acquire()
+        try:
+            async with self.semaphore:
+                with self.metrics.timer('request_seconds'):
+                    async with self.client.get(self.api_url, params=payload) as response:
+                        if response.status in throttle_statuses:
+                            self.metrics.inc('requests')
+                            return response.status, None, None
+                        if response.status != 200:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history, status=response.status,
+                                message=f"Error occured, status code: {response.status}")
+                        reader = BodyReader(response.headers.get('Content-Encoding'), self.validity_window,
+                                            self.is_blocked_page)
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            if not reader.feed(chunk):
+                                self.metrics.inc('downloads_aborted')
+                                break
+                        body = reader.finish()
+                self.metrics.inc('requests')
+                self.metrics.inc('bytes_transferred', reader.transferred)
+                self.metrics.inc('bytes_fetched', reader.size)
+                return response.status, body, response.charset
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, zlib.error) as e:
+            self.metrics.inc('request_errors')
+            print(str(e) + " while connecting to " + url)
+            return None
+
+        finally:
+            self.rate_limiter.release()
+
+    async def async_get_page_content(self, search_url):
+        """Retrieve the html content at search_url, same cache lookup and retries as get_page_content
+        but waiting for the backoff between them does not hold a thread. Stale cached pages are downloaded again
+
+        Args:
+            search_url (str): Url where the get request will be placed
+
+        Returns:
+            page content or None: returns html response encoded in unicode or returns None if the request failed or the page is not valid even after retries
+        """
+
+        entry = self.cache.get(search_url) if self.cache is not None else None
+        if entry is not None and entry.fresh:
+            return entry.body
+
+        while True:
+            received = await self.async_get_request(search_url)
+
+            if (not received):
+                return None
+
+            status, body, charset = received
+            try:
+                if status in throttle_statuses:
+                    # throttled, backs off like a blocked page
+                    print(f"Amazon: status {status}")
+                    self.rate_limiter.record(True)
+                    self.metrics.inc('pages_blocked')
+                    return self.retry_page(search_url)
+                # checked before it is decoded
+                return self.accept_page(search_url, body, encoding=charset)
+            except RetryLater as retry:
+                await asyncio.sleep(retry.delay)
+
+    def get_listing_products(self, page_content, page_url=None):
+        """Parses a search page and returns the search page information of every product on it,
+        the search pages found in its pagination are scheduled on the way
+
+        Args:
+            page_content (str or BeautifulSoup): unicode encoded response or its already parsed soup
+            page_url (str): url of the search page, its pagination is only read if given
+
+        Returns:
+            products: list of Product filled by get_listing_info
+        """
+
+        return list(self.parse_search_page((page_url, page_content)))
+
+    def schedule_page(self, page_url):
+        """Starts fetching a search page on the event loop, called from the thread parsing the page before it
+
+        Args:
+            page_url (str): url of the search page
+        """
+
+        print('processing page ', page_url)
+        self.loop.call_soon_threadsafe(self.start_page, page_url)
+
+    def start_page(self, page_url):
+        """Creates the task of a search page, runs on the event loop
+
+        Args:
+            page_url (str): url of the search page
+        """
+
+        self.page_tasks.append(asyncio.create_task(self.async_get_products(page_url=page_url)))
+
+    async def wait_pages(self):
+        """Waits for the search pages scheduled so far and for the pages they schedule in turn
+        """
+
+        while self.page_tasks:
+            tasks, self.page_tasks = self.page_tasks, []
+            await self.gather(tasks, 'search page')
+
+    async def gather(self, tasks, what):
+        """Waits for tasks, a task that raised is logged and does not cancel the others
+
+        Args:
+            tasks (iterable): coroutines or tasks
+            what (str): what the tasks work on, used in the log line
+        """
+
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"{type(result).__name__}: {result} in a {what} task")
+                self.metrics.inc('task_errors')
+
+    async def async_get_product(self, product_obj):
+        """Fetches the detail page of a product and fills its brand and description,
+        once per asin if deduplication is on
+
+        Args:
+            product_obj (Product): product filled by get_listing_info
+        """
+
+        url = product_obj.url
+        asin = product_obj.asin or get_asin(url)
+        if self.asin_index is not None and asin:
+            status, details = self.asin_index.claim(asin, product_obj)
+            if status == 'done':
+                product_obj.brand, product_obj.description = details
+                self.collect_product(product_obj)
+            if status != 'fetch':
+                # waiting products are collected by the task fetching their asin
+                return
+            url = self.prepare_product_url(asin)
+
+        details = None
+        try:
+            page_content = await self.async_get_page_content(url)
+            if page_content:
+                # parsing is CPU bound, keep it off the event loop so other requests go on meanwhile
+                details = await asyncio.to_thread(self.parse_brand_and_description, page_content, asin)
+                product_obj.brand, product_obj.description = details
+            self.collect_product(product_obj)
+        finally:
+            # resolved even if fetching or parsing raised, the waiting products then get empty details
+            for follower in self.release_asin(asin, product_obj, details):
+                self.collect_product(follower)
+
+    async def async_get_products(self, page_url=None, page_content=None):
+        """Gets products of one search page, detail pages are all requested at once.
+        The search pages scheduled from this one start as soon as its pagination is read
+
+        Args:
+            page_url (str): url of one of search pages, fetched when page_content is not given
+            page_content (str or BeautifulSoup): already fetched search page
+        """
+
+        if page_content is None:
+            if self.stopped:
+                return
+            page_content = await self.async_get_page_content(page_url)
+            if (not page_content):
+                return
+
+        # parsing is CPU bound, keep it off the event loop
+        products = await asyncio.to_thread(self.get_listing_products, page_content, page_url)
+        if self.listing_only:
+            for product_obj in products:
+                self.collect_product(product_obj)
+            return
+        await self.gather([self.async_get_product(product_obj) for product_obj in products], 'product')
+
+    async def search(self, search_word):
+        """Initializies that search and puts together the whole class, every page and product
+        is a task on the current event loop
+
+        Args:
+            search_word (str): user given word to be searched
+        """
+
+        async with self:
+            search_url = self.prepare_url(search_word)
+            page_content = await self.async_get_page_content(search_url)
+            if (not page_content):
+                return
+
+            self.begin_search(search_url)
+            self.open_output()
+            # the first page is not fetched again, the other pages are scheduled from its pagination
+            await self.async_get_products(page_url=search_url, page_content=page_content)
+            await self.wait_pages()
+
+        # products were written while scraping, only the compaction to a json file is left
+        self.close_output()
+        self.print_summary()
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Crawls many keywords on one shared pipeline, so the worker pools stay busy across keywords
+instead of draining at the end of every search
+"""
+
+import threading
+from functools import partial
+
+from .scraper import Scraper
+from .pipeline import Pipeline, RetryLater
+
+
+def read_keywords(path):
+    """Reads a keyword file, one keyword per line, blank lines and lines starting with # are skipped
+
+    Args:
+        path (str): keyword file
+
+    Returns:
+        keywords: list of keywords
+    """
+
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class BatchScraper():
+    """Searches a list of keywords. Search pages and detail pages of all keywords go through the same
+    pipeline, the same connection pool and the same asin index, every keyword gets its own output file
+    """
+
+    def __init__(self, keywords, **kwargs):
+        """ Init of the batch scraper
+
+        Args:
+            keywords (list): words to search amazon.com for
+            **kwargs: passed on to every Scraper, worker counts size the shared pipeline
+        """
+        kwargs.setdefault('keep_products', False)
+        self.keywords = keywords
+        self.kwargs = kwargs
+        # holds the pieces shared by all keywords: session, asin index, cache and worker counts
+        self.scraper = Scraper('batch', **kwargs)
+        self.pipeline = None
+        self.finished = []
+        self._pending = {}
+        self._keyword_of = {}
+        self._lock = threading.Lock()
+
+    def make_scraper(self, word):
+        """Creates the scraper of one keyword, sharing session and asin index with the batch
+
+        Args:
+            word (str): keyword
+
+        Returns:
+            scraper: Scraper for the keyword
+        """
+
+        scraper = self.scraper.keyword_scraper(word, **self.kwargs)
+        scraper.schedule_page = partial(self.schedule_page, scraper)
+        return scraper
+
+    def _add_pending(self, scraper, count=1):
+        with self._lock:
+            self._pending[scraper] += count
+
+    def _task_done(self, scraper):
+        with self._lock:
+            self._pending[scraper] -= 1
+            finished = self._pending[scraper] == 0
+            if finished:
+                del self._pending[scraper]
+        if finished:
+            # nothing of this keyword is left in the pipeline
+            scraper.close_output()
+            self.finished.append(scraper.word)
+            print(f"Finished keyword '{scraper.word}' ({len(self.finished)}/{len(self.keywords)})")
+
+    def schedule_page(self, scraper, page_url):
+        """Hands a search page of a keyword to the search stage, called by the scraper of the keyword
+        while it parses a search page
+
+        Args:
+            scraper (Scraper): scraper of the keyword
+            page_url (str): url of the search page
+        """
+
+        self._add_pending(scraper)
+        self.pipeline.submit_later('search', (scraper, page_url), 0)
+
+    def fetch_first_page(self, scraper):
+        """pipeline stage: fetches the first search page of a keyword and hands it to the listing stage,
+        which schedules the other search pages of the keyword
+
+        Args:
+            scraper (Scraper): scraper of the keyword
+        """
+
+        try:
+            if scraper.resume and scraper.checkpoint is not None and scraper.checkpoint.has_word(scraper.word):
+                self.resume_keyword(scraper)
+                return
+
+            scraper.open_output()
+            search_url = scraper.prepare_url(scraper.word)
+            page_content = scraper.try_page_content(search_url)
+            if (not page_content):
+                return
+
+            scraper.begin_search(search_url)
+            # the search stage is fed by schedule_page, nothing goes through the output of this stage
+            self._add_pending(scraper)
+            self.pipeline.submit('listing', (scraper, (search_url, page_content)))
+        except RetryLater:
+            self._add_pending(scraper)
+            raise
+        finally:
+            self._task_done(scraper)
+
+    def resume_keyword(self, scraper):
+        """Puts what an interrupted crawl of a keyword left over back into the pipeline
+
+        Args:
+            scraper (Scraper): scraper of the keyword
+        """
+
+        pages, products = scraper.unfinished_work()
+        if not pages and not products:
+            print(f"Nothing left to resume for '{scraper.word}'")
+            return
+
+        print(f"Resuming '{scraper.word}': {len(pages)} search pages and {len(products)} products left")
+        scraper.resuming = True
+        scraper.search_url = scraper.prepare_url(scraper.word)
+        scraper.open_output(append=True)
+        with self._lock:
+            self._pending[scraper] += len(pages) + len(products)
+            for product_obj in products:
+                self._keyword_of[id(product_obj)] = scraper
+        for page in pages:
+            self.pipeline.submit('search', (scraper, page))
+        for product_obj in products:
+            if scraper.listing_only:
+                self.collect_product(product_obj)
+            else:
+                self.pipeline.submit('detail', product_obj)
+
+    def fetch_search_page(self, item):
+        """pipeline stage: fetches one search page of a keyword
+
+        Args:
+            item (tuple): scraper of the keyword and url of the search page
+        """
+
+        scraper, page_url = item
+        try:
+            for page in scraper.fetch_search_page(page_url):
+                self._add_pending(scraper)
+                yield scraper, page
+        except RetryLater:
+            # the page comes back to this stage later, the keyword is not done with it
+            self._add_pending(scraper)
+            raise
+        finally:
+            self._task_done(scraper)
+
+    def parse_search_page(self, item):
+        """pipeline stage: extracts the products of one search page of a keyword
+
+        Args:
+            item (tuple): scraper of the keyword and the url and content of the search page
+        """
+
+        scraper, page = item
+        try:
+            for product_obj in scraper.parse_search_page(page):
+                with self._lock:
+                    self._pending[scraper] += 1
+                    self._keyword_of[id(product_obj)] = scraper
+                yield product_obj
+        finally:
+            self._task_done(scraper)
+
+    def fetch_detail_page(self, product_obj):
+        """pipeline stage: fetches the detail page of a product with the scraper of its keyword
+
+        Args:
+            product_obj (Product): product filled by get_listing_info
+        """
+
+        with self._lock:
+            scraper = self._keyword_of[id(product_obj)]
+        return scraper.fetch_detail_page(product_obj)
+
+    def parse_detail_page(self, item):
+        """pipeline stage: fills brand and description of a product with the scraper of its keyword,
+        products of other keywords waiting for the same asin come out of it too
+
+        Args:
+            item (tuple): product and the unicode encoded detail page
+        """
+
+        with self._lock:
+            scraper = self._keyword_of[id(item[0])]
+        return scraper.parse_detail_page(item)
+
+    def collect_product(self, product_obj):
+        """pipeline sink: hands a finished product to the scraper of its keyword
+
+        Args:
+            product_obj (Product): fully scraped product
+        """
+
+        with self._lock:
+            scraper = self._keyword_of.pop(id(product_obj))
+        try:
+            scraper.collect_product(product_obj)
+        finally:
+            self._task_done(scraper)
+
+    def drop_product(self, stage, item, error):
+        """pipeline error handler: a product the detail stages failed on never reaches collect_product,
+        its keyword stops waiting for it. The search stages count their items down themselves
+
+        Args:
+            stage (str): name of the stage that failed
+            item: item the stage failed on
+            error (Exception): exception raised by the stage
+        """
+
+        if stage not in ('detail', 'parse'):
+            return
+        product_obj = item[0] if stage == 'parse' else item
+        with self._lock:
+            scraper = self._keyword_of.pop(id(product_obj), None)
+        if scraper is not None:
+            self._task_done(scraper)
+
+    def build_pipeline(self):
+        """Builds the first page -> search page -> listing -> detail page -> detail parse pipeline,
+        without the detail stages in listing-only mode
+
+        Returns:
+            pipeline: Pipeline which is not started yet
+        """
+
+        scraper = self.scraper
+        pipeline = Pipeline(sink=self.collect_product, on_error=self.drop_product)
+        pipeline.add_stage('first', self.fetch_first_page, scraper.search_workers, scraper.queue_size)
+        pipeline.add_stage('search', self.fetch_search_page, scraper.search_workers, scraper.queue_size)
+        pipeline.add_stage('listing', self.parse_search_page, scraper.listing_workers, scraper.queue_size)
+        if not scraper.listing_only:
+            pipeline.add_stage('detail', self.fetch_detail_page, scraper.detail_workers, scraper.queue_size)
+            pipeline.add_stage('parse', self.parse_detail_page, scraper.parse_workers, scraper.queue_size)
+        scraper.watch_pipeline(pipeline)
+        return pipeline
+
+    def search(self):
+        """Searches every keyword, each keyword's output file is written as soon as that keyword is done
+        """
+
+        self.pipeline = self.build_pipeline()
+        with self.pipeline:
+            for word in self.keywords:
+                scraper = self.make_scraper(word)
+                with self._lock:
+                    self._pending[scraper] = 1
+                self.pipeline.submit('first', scraper)
+        with self._lock:
+            unfinished, self._pending = list(self._pending), {}
+        for scraper in unfinished:
+            # items of the keyword were dropped by a cancelled pipeline, what was written is kept
+            scraper.close_output()
+            print(f"Keyword '{scraper.word}' did not finish")
+        self.scraper.print_summary()
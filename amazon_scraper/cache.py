@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent response cache, pages are stored zlib compressed in a SQLite file so
+overlapping searches don't download the same pages again
+"""
+
+import re
+import time
+import zlib
+import sqlite3
+import threading
+from urllib.parse import urlparse, parse_qsl, urlencode, unquote
+
+
+asin_regexp = re.compile(r'/(?:dp|gp/product)/([A-Z0-9]{10})')
+# query parameters amazon changes on every request without changing the page
+volatile_params = {'qid', 'ref', 'ref_', 'sr', 'crid', 'sprefix', 'dib', 'dib_tag', 'content-id', 'pd_rd_r', 'pf_rd_r'}
+# seconds a stored page is used without asking the server again
+default_ttl = {
+    'search': 60 * 60,
+    'detail': 24 * 60 * 60,
+    'other': 60 * 60,
+}
+
+
+def get_asin(url):
+    """Finds the asin of a product url, also inside the encoded target of slredirect urls
+
+    Args:
+        url (str): product url
+
+    Returns:
+        asin or None: Amazon Standard Identification Number of the product or None if the url has none
+    """
+
+    match = asin_regexp.search(unquote(url))
+    return match.group(1) if match else None
+
+
+def cache_key(url):
+    """Key a page is stored under, "dp:<asin>" for product pages and the normalized url for every other page
+
+    Args:
+        url (str): url of the page
+
+    Returns:
+        key, page type: key of the page and one of "detail", "search", "other"
+    """
+
+    asin = get_asin(url)
+    if asin:
+        return 'dp:' + asin, 'detail'
+
+    parsed = urlparse(url)
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query) if k not in volatile_params)
+    key = f"{parsed.netloc.lower()}{parsed.path.rstrip('/')}?{urlencode(query)}"
+    page_type = 'search' if parsed.path == '/s' else 'other'
+    return key, page_type
+
+
+class CacheEntry():
+    """ Hold a page read from the cache
+    """
+
+    def __init__(self, body, stored_at, ttl, etag=None, last_modified=None):
+        self.body = body
+        self.stored_at = stored_at
+        self.ttl = ttl
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def fresh(self):
+        """True while the page is younger than its ttl
+        """
+        return time.time() - self.stored_at < self.ttl
+
+    def validators(self):
+        """Headers for a conditional request, empty if the server sent no validators
+
+        Returns:
+            headers: dict with If-None-Match and/or If-Modified-Since
+        """
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache():
+    """Size bounded on-disk cache of pages, least recently used pages are evicted first
+    """
+
+    def __init__(self, path='amazon_cache.sqlite', max_size=512 * 1024 * 1024, ttl=None):
+        """ Init of the cache
+
+        Args:
+            path (str): SQLite file the pages are stored in
+            max_size (int): maximum size in bytes of the compressed pages
+            ttl (dict): seconds a page stays fresh per page type ("search", "detail", "other")
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = dict(default_ttl, **(ttl or {}))
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'key TEXT PRIMARY KEY, page_type TEXT, stored_at REAL, accessed_at REAL, '
+            'etag TEXT, last_modified TEXT, size INTEGER, body BLOB)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)')
+        self._db.commit()
+        self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+    def get(self, url):
+        """Looks a page up, stale pages are returned too so they can be revalidated
+
+        Args:
+            url (str): url of the page
+
+        Returns:
+            entry or None: CacheEntry of the page or None if it isn't stored
+        """
+
+        key, page_type = cache_key(url)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT stored_at, etag, last_modified, body FROM pages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE pages SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+
+        stored_at, etag, last_modified, body = row
+        entry = CacheEntry(zlib.decompress(body).decode('utf-8'), stored_at, self.ttl[page_type], etag, last_modified)
+        with self._lock:
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def put(self, url, page_content, headers=None):
+        """Stores a page, evicts least recently used pages while the cache is over max_size
+
+        Args:
+            url (str): url of the page
+            page_content (str): unicode encoded page
+            headers (dict): response headers, ETag and Last-Modified are kept for revalidation
+        """
+
+        key, page_type = cache_key(url)
+        headers = headers or {}
+        body = zlib.compress(page_content.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            old = self._db.execute('SELECT size FROM pages WHERE key = ?', (key,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, page_type, now, now, headers.get('ETag'), headers.get('Last-Modified'), len(body), body))
+            self.size += len(body) - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def refresh(self, url):
+        """Marks a stored page as fresh again, used when the server answered 304 Not Modified
+
+        Args:
+            url (str): url of the page
+        """
+
+        key, page_type = cache_key(url)
+        now = time.time()
+        with self._lock:
+            self._db.execute('UPDATE pages SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            self._db.commit()
+            self.revalidations += 1
+
+    def _evict(self):
+        # evict down to 90% so a full cache doesn't evict on every put
+        target = self.max_size * 0.9
+        if self.size <= self.max_size:
+            return
+        rows = self._db.execute('SELECT key, size FROM pages ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if self.size <= target:
+                break
+            self._db.execute('DELETE FROM pages WHERE key = ?', (key,))
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Returns hit/miss statistics of the cache
+
+        Returns:
+            stats: dict with hits, misses, revalidations, evictions, hit_rate and size in bytes
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': self.size,
+            }
+
+    def close(self):
+        """Closes the SQLite file
+        """
+
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent crawl frontier, every search page and product detail page of a search is
+recorded with its state so an interrupted crawl can be resumed
+"""
+
+import time
+import sqlite3
+import threading
+
+
+pending = 'pending'
+in_flight = 'in_flight'
+done = 'done'
+failed = 'failed'
+# states of the items a resumed crawl queues again
+unfinished_states = (pending, in_flight)
+
+
+class CheckpointStore():
+    """SQLite backed frontier of search pages ("search" items keyed by url) and product
+    detail pages ("detail" items keyed by listing url, carrying the product as json)
+    """
+
+    def __init__(self, path='amazon_checkpoint.sqlite'):
+        """ Init of the store
+
+        Args:
+            path (str): SQLite file the frontier is kept in
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS frontier ('
+            'word TEXT, kind TEXT, key TEXT, state TEXT, payload TEXT, updated_at REAL, '
+            'PRIMARY KEY (word, kind, key))')
+        self._db.commit()
+
+    def add(self, word, kind, items, state=pending):
+        """Records new items, items already recorded keep their state
+
+        Args:
+            word (str): searched word the items belong to
+            kind (str): "search" or "detail"
+            items (iterable): (key, payload) tuples, payload may be None
+            state (str): state of the new items
+
+        Returns:
+            added: set of the keys which weren't recorded before
+        """
+
+        now = time.time()
+        added = set()
+        with self._lock:
+            for key, payload in items:
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO frontier VALUES (?, ?, ?, ?, ?, ?)', (word, kind, key, state, payload, now))
+                if cursor.rowcount:
+                    added.add(key)
+            self._db.commit()
+        return added
+
+    def mark(self, word, kind, key, state):
+        """Changes the state of an item
+
+        Args:
+            word (str): searched word the item belongs to
+            kind (str): "search" or "detail"
+            key (str): key of the item
+            state (str): one of pending, in_flight, done, failed
+        """
+
+        with self._lock:
+            self._db.execute(
+                'UPDATE frontier SET state = ?, updated_at = ? WHERE word = ? AND kind = ? AND key = ?',
+                (state, time.time(), word, kind, key))
+            self._db.commit()
+
+    def mark_many(self, word, kind, keys, state, current=None):
+        """Changes the state of many items in one transaction
+
+        Args:
+            word (str): searched word the items belong to
+            kind (str): "search" or "detail"
+            keys (iterable): keys of the items
+            state (str): one of pending, in_flight, done, failed
+            current (str): only items in this state are changed, None to change every item
+        """
+
+        now = time.time()
+        query = 'UPDATE frontier SET state = ?, updated_at = ? WHERE word = ? AND kind = ? AND key = ?'
+        if current is not None:
+            query += ' AND state = ?'
+        with self._lock:
+            self._db.executemany(
+                query, [(state, now, word, kind, key) + ((current,) if current is not None else ()) for key in keys])
+            self._db.commit()
+
+    def unfinished(self, word, kind):
+        """Returns the items which were pending or in flight when the crawl stopped
+
+        Args:
+            word (str): searched word
+            kind (str): "search" or "detail"
+
+        Returns:
+            items: list of (key, payload) tuples
+        """
+
+        with self._lock:
+            return self._db.execute(
+                'SELECT key, payload FROM frontier WHERE word = ? AND kind = ? AND state IN (?, ?) ORDER BY rowid',
+                (word, kind) + unfinished_states).fetchall()
+
+    def has_word(self, word):
+        """Returns True if a crawl of word was recorded
+        """
+
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM frontier WHERE word = ? LIMIT 1', (word,)).fetchone() is not None
+
+    def counts(self, word):
+        """Returns the number of items per kind and state
+
+        Args:
+            word (str): searched word
+
+        Returns:
+            counts: dict like {("detail", "done"): 42}
+        """
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT kind, state, COUNT(*) FROM frontier WHERE word = ? GROUP BY kind, state', (word,)).fetchall()
+        return {(kind, state): count for kind, state, count in rows}
+
+    def clear(self, word):
+        """Forgets everything recorded for word, done before a fresh crawl of it
+        """
+
+        with self._lock:
+            self._db.execute('DELETE FROM frontier WHERE word = ?', (word,))
+            self._db.commit()
+
+    def close(self):
+        """Closes the SQLite file
+        """
+
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+ASIN level deduplication of product detail pages, every asin is fetched once per crawl
+"""
+
+import threading
+
+
+class AsinFlight():
+    """ Hold the state of one asin, the product whose detail page is being fetched
+    and the products waiting for it
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.followers = []
+        self.details = None
+        self.done = False
+
+
+class AsinIndex():
+    """Thread-safe index of the asins seen in a crawl. The first product of an asin fetches its
+    detail page, products coming while that fetch is in flight wait for it (single-flight),
+    products coming after it reuse its result
+    """
+
+    def __init__(self):
+        """ Init of the index
+        """
+        self.fetches = 0
+        self.saved = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def claim(self, asin, product):
+        """Registers a product that needs the detail page of asin
+
+        Args:
+            asin (str): asin of the product
+            product (Product): product needing brand and description
+
+        Returns:
+            status, details: ("fetch", None) if the caller has to fetch the page,
+            ("waiting", None) if the product is handed back by resolve once the page in flight is parsed,
+            ("done", details) with the (brand, description) of an earlier fetch
+        """
+
+        with self._lock:
+            flight = self._flights.get(asin)
+            if flight is None:
+                self._flights[asin] = AsinFlight(product)
+                self.fetches += 1
+                return 'fetch', None
+            if flight.owner is product:
+                # the owner is back after its fetch was scheduled for a retry
+                return 'fetch', None
+
+            self.saved += 1
+            if flight.done:
+                return 'done', flight.details
+            flight.followers.append(product)
+            return 'waiting', None
+
+    def resolve(self, asin, product, details):
+        """Stores the result of a fetch started by claim, does nothing for products that didn't fetch
+
+        Args:
+            asin (str): asin of the product
+            product (Product): product passed to claim
+            details (tuple): (brand, description), None if the fetch failed so the asin is fetched again next time
+
+        Returns:
+            followers: products that waited for this fetch
+        """
+
+        with self._lock:
+            flight = self._flights.get(asin)
+            if flight is None or flight.owner is not product:
+                return []
+            if details is None:
+                del self._flights[asin]
+            else:
+                flight.details = details
+                flight.done = True
+                flight.owner = None
+            followers, flight.followers = flight.followers, []
+            return followers
+
+    def stats(self):
+        """Returns how many detail pages were fetched and how many fetches were saved
+
+        Returns:
+            stats: dict with fetches and saved
+        """
+
+        with self._lock:
+            return {'fetches': self.fetches, 'saved': self.saved}
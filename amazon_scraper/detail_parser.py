@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming extraction of the few regions of a product detail page the scraper uses,
+the page is tokenized chunk by chunk and tokenizing stops once every wanted field is found
+"""
+
+import re
+from html.parser import HTMLParser
+
+
+detail_fields = ('brand', 'description')
+# places every field can be read from, in the order they are preferred in
+detail_sources = {'brand': ('po-brand', 'byline'), 'description': ('about-this-item', 'feature-bullets')}
+about_regexp = re.compile(r"About\s+this\s+item")
+heading_tags = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+# end tags that close a list item left open, like html5lib does
+li_containers = ('ul', 'ol', 'div')
+# amount of html tokenized between two checks for early stop
+chunk_size = 16384
+
+
+class Region():
+    """An element being read, ends with the end tag that balances its start tag
+    """
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.depth = 1
+
+    def start(self, tag):
+        if tag == self.tag:
+            self.depth += 1
+
+    def end(self, tag):
+        """Returns True once the region is closed
+        """
+        if tag == self.tag:
+            self.depth -= 1
+        return self.depth == 0
+
+
+class DetailPageParser(HTMLParser):
+    """Reads brand and description out of a product detail page, looks at the same elements
+    as the BeautifulSoup based extraction:
+
+    brand: second cell of the tr.po-brand row ("po-brand"), or the text of a#bylineInfo ("byline")
+    description: list items next to an "About this item" heading ("about-this-item"),
+    or the list items of div#feature-bullets ("feature-bullets")
+
+    The order the sources are preferred in comes from detail_sources, or from the rules spec
+    """
+
+    def __init__(self, fields=detail_fields, sources=None):
+        """ Init of the parser
+
+        Args:
+            fields (iterable): fields to extract, any of "brand" and "description"
+            sources (dict): field to the names of its sources in order of preference, detail_sources by default
+        """
+        super().__init__(convert_charrefs=True)
+        self.fields = set(fields)
+        self.sources = dict(detail_sources, **(sources or {}))
+        self.po_brand = None
+        self.byline = None
+        self.about_items = None
+        self.bullet_items = None
+
+        self._po_brand_row = None
+        self._po_brand_cells = 0
+        self._po_brand_span = None
+        self._po_brand_text = []
+        self._byline = None
+        self._byline_text = []
+        # number of list items read before each open div started, the div holding the
+        # "About this item" heading owns the ones read since, even those above the heading
+        self._divs = []
+        self._items = []
+        self._heading = None
+        self._heading_text = []
+        self._about_div = None
+        self._bullets = None
+        self._li = None
+        self._li_text = []
+        self._li_containers = 0
+
+    def read(self, source):
+        """Returns True once a source was read, what comes later in the page can't change it
+        """
+
+        if source == 'po-brand':
+            return self.po_brand is not None
+        if source == 'byline':
+            return self.byline is not None
+        if source == 'about-this-item':
+            # the list is complete once the div holding the heading is closed
+            return self.about_items is not None and self._about_div is None
+        return self.bullet_items is not None and self._bullets is None
+
+    @property
+    def done(self):
+        """True once the preferred source of every wanted field was read, nothing later in the page can change the result
+        """
+
+        return all(self.read(self.sources[field][0]) for field in self.fields)
+
+    def value(self, source):
+        """Returns what a source gave, None if it wasn't found
+        """
+
+        if source == 'po-brand':
+            return self.po_brand
+        if source == 'byline':
+            if self.byline is None:
+                return None
+            # Split the text to get the brand name
+            return (self.byline.split(': ')[1] if ': ' in self.byline else self.byline).strip()
+        if source == 'about-this-item':
+            return self.about_items or None
+        return self.bullet_items or None
+
+    def pick(self, field):
+        """Returns the value of the first source of a field that was found
+
+        Args:
+            field (str): "brand" or "description"
+
+        Returns:
+            value, source: value of the field and the name of its source, None and "miss" if no source was found
+        """
+
+        for source in self.sources[field]:
+            value = self.value(source)
+            if value is not None:
+                return value, source
+        return None, 'miss'
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        element_id = attrs.get('id')
+
+        if 'brand' in self.fields:
+            if self._po_brand_row is not None:
+                self._po_brand_row.start(tag)
+                if tag == 'td':
+                    self._po_brand_cells += 1
+                elif tag == 'span' and self._po_brand_cells == 2 and self.po_brand is None:
+                    if self._po_brand_span is None:
+                        self._po_brand_span = Region(tag)
+                    else:
+                        self._po_brand_span.start(tag)
+            elif self.po_brand is None and tag == 'tr' and 'po-brand' in classes:
+                self._po_brand_row = Region(tag)
+                self._po_brand_cells = 0
+
+            if self._byline is not None:
+                self._byline.start(tag)
+            elif self.byline is None and tag == 'a' and element_id == 'bylineInfo':
+                self._byline = Region(tag)
+
+        if 'description' in self.fields:
+            if self._li is not None and tag in li_containers:
+                self._li_containers += 1
+            if tag == 'li' and self._li is not None and self._li_containers == 0:
+                # a list item starting next to an open one closes it
+                self._end_li()
+
+            if tag == 'div':
+                self._divs.append(len(self._items))
+                if self._about_div is not None:
+                    self._about_div.start(tag)
+                if self._bullets is not None:
+                    self._bullets.start(tag)
+                elif self.bullet_items is None and element_id == 'feature-bullets':
+                    self._bullets = Region(tag)
+                    self.bullet_items = []
+
+            if tag in heading_tags and self.about_items is None and self._heading is None:
+                self._heading = Region(tag)
+                self._heading_text = []
+            elif self._heading is not None:
+                self._heading.start(tag)
+
+            if tag == 'li' and (self._divs or self._bullets is not None):
+                if self._li is None:
+                    self._li = Region(tag)
+                    self._li_text = []
+                else:
+                    self._li.start(tag)
+
+    def _end_li(self):
+        text = ''.join(self._li_text)
+        if self._about_div is not None:
+            self.about_items.append(text)
+        elif self.about_items is None:
+            self._items.append(text)
+        if self._bullets is not None:
+            self.bullet_items.append(text)
+        self._li = None
+        self._li_containers = 0
+
+    def handle_endtag(self, tag):
+        if self._po_brand_span is not None and self._po_brand_span.end(tag):
+            self.po_brand = ''.join(self._po_brand_text).strip()
+            self._po_brand_span = None
+        if self._po_brand_row is not None and self._po_brand_row.end(tag):
+            if self.po_brand is None and self._po_brand_cells >= 2:
+                self.po_brand = ''.join(self._po_brand_text).strip()
+            self._po_brand_row = None
+
+        if self._byline is not None and self._byline.end(tag):
+            self.byline = ''.join(self._byline_text)
+            self._byline = None
+
+        if self._heading is not None and self._heading.end(tag):
+            self._heading = None
+            if about_regexp.search(''.join(self._heading_text)) and self._divs:
+                # the list items of the div holding the heading are the description
+                self._about_div = Region('div')
+                self.about_items = self._items[self._divs[-1]:]
+                self._items = []
+
+        if self._li is not None and tag in li_containers:
+            if self._li_containers == 0:
+                # the list or div holding an unclosed list item ended
+                self._end_li()
+            else:
+                self._li_containers -= 1
+                if self._li_containers == 0:
+                    # list items nested in the item are closed with their list
+                    self._li.depth = 1
+        if self._li is not None and self._li.end(tag):
+            self._end_li()
+
+        if tag == 'div' and self._divs:
+            self._divs.pop()
+            if not self._divs:
+                self._items = []
+            if self._about_div is not None and self._about_div.end(tag):
+                self._about_div = None
+            if self._bullets is not None and self._bullets.end(tag):
+                self._bullets = None
+
+    def handle_data(self, data):
+        if self._po_brand_span is not None:
+            self._po_brand_text.append(data)
+        if self._byline is not None:
+            self._byline_text.append(data)
+        if self._heading is not None:
+            self._heading_text.append(data)
+        if self._li is not None:
+            stripped = data.strip()
+            if stripped:
+                self._li_text.append(stripped)
+
+    def brand(self):
+        """Returns brand, or empty string if it wasn't found
+        """
+
+        return self.pick('brand')[0] or ''
+
+    def description(self):
+        """Returns list of the description bullet points, or empty list if there are none
+        """
+
+        return self.pick('description')[0] or []
+
+
+def extract_details(page_content, fields=detail_fields, rules=None):
+    """Tokenizes a product detail page until the wanted fields are found
+
+    Args:
+        page_content (str): unicode encoded response of the product detail page
+        fields (iterable): fields to extract, any of "brand" and "description"
+        rules (RuleSet): gives the order of the sources and counts which source every field came from, None for detail_sources
+
+    Returns:
+        details: dict with the wanted fields, brand is a string and description a list of bullet points
+    """
+
+    parser = DetailPageParser(fields, rules.detail_sources if rules is not None else None)
+    for start in range(0, len(page_content), chunk_size):
+        parser.feed(page_content[start:start + chunk_size])
+        if parser.done:
+            break
+    else:
+        parser.close()
+
+    details = {}
+    hits = []
+    for field in ('brand', 'description'):
+        if field in parser.fields:
+            value, source = parser.pick(field)
+            details[field] = value or ('' if field == 'brand' else [])
+            hits.append((field, source))
+    if rules is not None:
+        rules.record(hits)
+    return details
@@ -0,0 +1,686 @@
+# -*- coding: utf-8 -*-
+"""
+Crawl spread over several processes or machines: a coordinator puts the first search page of every
+keyword on a shared task queue, workers lease search page and detail page tasks from it, report their
+results back and the coordinator writes one deduplicated output file per keyword once the queue is drained
+"""
+
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from functools import partial
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from .scraper import Scraper
+from .product import Product
+from .cache import get_asin
+from .checkpoint import pending, in_flight, done, failed
+
+
+class Task():
+    """One search page ("search" task keyed by url) or product detail page ("detail" task keyed by asin,
+    carrying the product as json) leased by a worker
+    """
+
+    def __init__(self, id, word, kind, key, payload=None, attempts=0):
+        """ Init of the task
+
+        Args:
+            id (int): id of the task in the queue
+            word (str): keyword the task belongs to
+            kind (str): "search" or "detail"
+            key (str): url of the search page or asin of the product
+            payload (str): product as json for detail tasks
+            attempts (int): number of times the task was leased, this lease included
+        """
+        self.id = id
+        self.word = word
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+
+
+class TaskQueue():
+    """SQLite backed queue shared by the coordinator and every worker. A leased task belongs to its worker
+    until lease_timeout seconds pass without the lease being extended, then any worker may lease it again.
+    Results are kept once per keyword and asin, whichever worker reports them first. A product whose asin is
+    a detail task of another keyword already is not fetched again, it gets the brand and description of that task
+    """
+
+    def __init__(self, path='amazon_queue.sqlite', lease_timeout=120.0, max_attempts=5):
+        """ Init of the queue
+
+        Args:
+            path (str): SQLite file of the queue, on a disk every process using it can lock
+            lease_timeout (float): seconds a worker owns a task without extending its lease
+            max_attempts (int): leases after which a task that never completed is failed
+        """
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # transactions are opened explicitly, BEGIN IMMEDIATE keeps two processes from leasing the same task
+        self._db = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'id INTEGER PRIMARY KEY, word TEXT, kind TEXT, key TEXT, payload TEXT, state TEXT, '
+            'worker TEXT, lease_until REAL, attempts INTEGER, UNIQUE (word, kind, key))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, kind)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'word TEXT, key TEXT, payload TEXT, worker TEXT, PRIMARY KEY (word, key))')
+        # products of other keywords waiting for the detail task of their asin
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS followers ('
+            'word TEXT, key TEXT, payload TEXT, PRIMARY KEY (word, key))')
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def put(self, word, kind, items):
+        """Adds tasks, tasks already in the queue are left as they are. A detail task whose asin another keyword
+        has a task for already is not added, the product follows that task
+
+        Args:
+            word (str): keyword the tasks belong to
+            kind (str): "search" or "detail"
+            items (iterable): (key, payload) pairs, payload may be None
+
+        Returns:
+            added: number of new tasks
+        """
+
+        added = 0
+        with self._transaction() as db:
+            for key, payload in items:
+                if kind == 'detail':
+                    owner = db.execute('SELECT word FROM tasks WHERE kind = ? AND key = ? AND word != ?',
+                                       (kind, key, word)).fetchone()
+                    if owner is not None:
+                        db.execute('INSERT OR IGNORE INTO followers VALUES (?, ?, ?)', (word, key, payload))
+                        # the task may be finished already
+                        self._resolve_followers(db, [key])
+                        continue
+                added += db.execute(
+                    'INSERT OR IGNORE INTO tasks (word, kind, key, payload, state, attempts) VALUES (?, ?, ?, ?, ?, 0)',
+                    (word, kind, key, payload, pending)).rowcount
+        return added
+
+    def _resolve_followers(self, db, keys):
+        # products following a detail task get its brand and description once the task has a result
+        for key in keys:
+            row = db.execute('SELECT r.payload FROM results r JOIN tasks t ON r.word = t.word AND r.key = t.key '
+                             'WHERE t.kind = ? AND t.key = ?', ('detail', key)).fetchone()
+            if row is None:
+                continue
+            details = json.loads(row[0])
+            followers = db.execute('SELECT word, payload FROM followers WHERE key = ?', (key,)).fetchall()
+            for word, payload in followers:
+                product = dict(json.loads(payload), brand=details['brand'], description=details['description'])
+                db.execute('INSERT OR IGNORE INTO results VALUES (?, ?, ?, NULL)', (word, key, json.dumps(product)))
+
+    def lease(self, worker, count=1):
+        """Leases pending tasks and tasks whose lease ran out, search pages first so the frontier grows early
+
+        Args:
+            worker (str): name of the worker
+            count (int): tasks leased at most
+
+        Returns:
+            tasks: list of Task, empty if there is nothing to do right now
+        """
+
+        now = time.time()
+        with self._transaction() as db:
+            # leases that ran out too often are not handed out again, their products go out without details
+            expired = [row[0] for row in db.execute(
+                'SELECT key FROM tasks WHERE kind = ? AND state = ? AND lease_until < ? AND attempts >= ?',
+                ('detail', in_flight, now, self.max_attempts))]
+            db.execute('INSERT OR IGNORE INTO results SELECT word, key, payload, NULL FROM tasks '
+                       'WHERE kind = ? AND state = ? AND lease_until < ? AND attempts >= ?',
+                       ('detail', in_flight, now, self.max_attempts))
+            self._resolve_followers(db, expired)
+            db.execute('UPDATE tasks SET state = ? WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                       (failed, in_flight, now, self.max_attempts))
+            rows = db.execute(
+                'SELECT id, word, kind, key, payload, attempts FROM tasks '
+                'WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY kind = ?, id LIMIT ?',
+                (pending, in_flight, now, 'detail', count)).fetchall()
+            db.executemany(
+                'UPDATE tasks SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?',
+                [(in_flight, worker, now + self.lease_timeout, row[0]) for row in rows])
+        return [Task(id, word, kind, key, payload, attempts + 1) for id, word, kind, key, payload, attempts in rows]
+
+    def extend(self, task_ids, worker):
+        """Extends the leases a worker still holds
+
+        Args:
+            task_ids (iterable): ids of the tasks
+            worker (str): name of the worker
+        """
+
+        lease_until = time.time() + self.lease_timeout
+        with self._transaction() as db:
+            db.executemany('UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = ?',
+                           [(lease_until, task_id, worker, in_flight) for task_id in task_ids])
+
+    def complete(self, task_id, worker):
+        """Marks a task done
+
+        Args:
+            task_id (int): id of the task
+            worker (str): name of the worker
+
+        Returns:
+            completed: False if the lease had run out and another worker took the task over
+        """
+
+        with self._transaction() as db:
+            return bool(db.execute('UPDATE tasks SET state = ? WHERE id = ? AND worker = ? AND state = ?',
+                                   (done, task_id, worker, in_flight)).rowcount)
+
+    def fail(self, task_id, worker):
+        """Gives a task back after it failed, it is leased again until it failed max_attempts times.
+        The product of a detail task failed for good is stored as a result without brand and description,
+        like the local pipeline emits it
+
+        Args:
+            task_id (int): id of the task
+            worker (str): name of the worker
+        """
+
+        with self._transaction() as db:
+            given_up = db.execute('INSERT OR IGNORE INTO results SELECT word, key, payload, worker FROM tasks '
+                                  'WHERE id = ? AND worker = ? AND state = ? AND kind = ? AND attempts >= ?',
+                                  (task_id, worker, in_flight, 'detail', self.max_attempts)).rowcount
+            if given_up:
+                self._resolve_followers(db, [row[0] for row in db.execute('SELECT key FROM tasks WHERE id = ?',
+                                                                         (task_id,))])
+            db.execute('UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_until = NULL '
+                       'WHERE id = ? AND worker = ? AND state = ?',
+                       (self.max_attempts, failed, pending, task_id, worker, in_flight))
+
+    def add_results(self, word, items, worker=None):
+        """Stores finished products, a product already reported for the keyword is kept as it was.
+        The products of other keywords following the detail tasks of these asins are stored too
+
+        Args:
+            word (str): keyword the products belong to
+            items (iterable): (key, payload) pairs, the asin (or url) and the product as json
+            worker (str): name of the worker reporting them
+
+        Returns:
+            added: number of products not reported before
+        """
+
+        added = 0
+        with self._transaction() as db:
+            keys = []
+            for key, payload in items:
+                added += db.execute('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)',
+                                    (word, key, payload, worker)).rowcount
+                keys.append(key)
+            self._resolve_followers(db, keys)
+        return added
+
+    def finished(self):
+        """Returns True once tasks were put on the queue and none of them is pending or leased anymore
+        """
+
+        with self._lock:
+            total, unfinished = self._db.execute('SELECT COUNT(*), SUM(state IN (?, ?)) FROM tasks',
+                                                 (pending, in_flight)).fetchone()
+        return total > 0 and not unfinished
+
+    def counts(self):
+        """Returns the number of tasks per kind and state, and the number of results
+
+        Returns:
+            counts: dict like {"detail done": 42, "results": 40}
+        """
+
+        with self._lock:
+            rows = self._db.execute('SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state').fetchall()
+            results = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        counts = {f"{kind} {state}": count for kind, state, count in rows}
+        counts['results'] = results
+        return counts
+
+    def words(self):
+        """Returns every keyword that has tasks in the queue
+        """
+
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT DISTINCT word FROM tasks ORDER BY word')]
+
+    def export(self, word, path):
+        """Writes the products of a keyword, a json array if path ends with .json and NDJSON otherwise
+
+        Args:
+            word (str): keyword
+            path (str): file to write
+
+        Returns:
+            count: number of products written
+        """
+
+        with self._lock:
+            payloads = [row[0] for row in self._db.execute(
+                'SELECT payload FROM results WHERE word = ? ORDER BY rowid', (word,))]
+        with open(path, mode='w', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                f.write('[' + ','.join(payloads) + ']')
+            else:
+                f.write(''.join(payload + '\n' for payload in payloads))
+        return len(payloads)
+
+    def close(self):
+        """Closes the SQLite file
+        """
+
+        with self._lock:
+            self._db.close()
+
+
+# methods of TaskQueue workers on other machines may call through QueueServer
+remote_methods = ('put', 'lease', 'extend', 'complete', 'fail', 'add_results', 'finished')
+
+
+class QueueServer():
+    """Serves a TaskQueue over http so workers on other machines can use it through RemoteQueue,
+    every method is a POST of its json arguments to /<method>
+    """
+
+    def __init__(self, queue, host='127.0.0.1', port=8765):
+        """ Init of the server
+
+        Args:
+            queue (TaskQueue): queue to serve
+            host (str): address to listen on, only this machine can reach the queue by default.
+                The queue has no authentication, pass the address of a private network explicitly
+            port (int): port to listen on, 0 picks a free one
+        """
+        self.queue = queue
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """url to pass to RemoteQueue
+        """
+        host, port = self.httpd.server_address[:2]
+        if host == '0.0.0.0':
+            host = socket.gethostname()
+        return f"http://{host}:{port}/"
+
+    def _make_handler(self):
+        queue = self.queue
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                method = self.path.strip('/')
+                if method not in remote_methods:
+                    self.send_error(404)
+                    return
+                kwargs = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                result = getattr(queue, method)(**kwargs)
+                if method == 'lease':
+                    result = [vars(task) for task in result]
+                body = json.dumps(result).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Starts serving on a background thread
+        """
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='queue-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving and closes the socket
+        """
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class RemoteQueue():
+    """TaskQueue of a coordinator on another machine, reached through its QueueServer
+    """
+
+    def __init__(self, url, timeout=60.0, lease_timeout=120.0):
+        """ Init of the remote queue
+
+        Args:
+            url (str): url of the QueueServer
+            timeout (float): seconds to wait for an answer of the coordinator
+            lease_timeout (float): lease timeout of the coordinator's queue, workers extend their leases well before it
+        """
+        self.url = url.rstrip('/') + '/'
+        self.timeout = timeout
+        self.lease_timeout = lease_timeout
+        self.session = requests.Session()
+
+    def _call(self, method, **kwargs):
+        response = self.session.post(self.url + method, data=json.dumps(kwargs), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def put(self, word, kind, items):
+        return self._call('put', word=word, kind=kind, items=list(items))
+
+    def lease(self, worker, count=1):
+        return [Task(**task) for task in self._call('lease', worker=worker, count=count)]
+
+    def extend(self, task_ids, worker):
+        return self._call('extend', task_ids=list(task_ids), worker=worker)
+
+    def complete(self, task_id, worker):
+        return self._call('complete', task_id=task_id, worker=worker)
+
+    def fail(self, task_id, worker):
+        return self._call('fail', task_id=task_id, worker=worker)
+
+    def add_results(self, word, items, worker=None):
+        return self._call('add_results', word=word, items=list(items), worker=worker)
+
+    def finished(self):
+        return self._call('finished')
+
+
+def open_queue(location, **kwargs):
+    """Opens the queue of a distributed crawl
+
+    Args:
+        location (str): SQLite file of the queue, or url of the QueueServer of the coordinator
+        **kwargs: passed on to TaskQueue or RemoteQueue
+
+    Returns:
+        queue: TaskQueue or RemoteQueue
+    """
+
+    if location.startswith(('http://', 'https://')):
+        return RemoteQueue(location, **kwargs)
+    return TaskQueue(location, **kwargs)
+
+
+class Coordinator():
+    """Puts the keywords of a distributed crawl on the queue, waits for the workers to drain it
+    and writes one output file per keyword
+    """
+
+    def __init__(self, queue, output_format='json', poll_interval=5.0):
+        """ Init of the coordinator
+
+        Args:
+            queue (TaskQueue): queue shared with the workers
+            output_format (str): "json" writes <word>.json arrays, "ndjson" writes <word>.ndjson files
+            poll_interval (float): seconds between two looks at the queue while waiting
+        """
+        self.queue = queue
+        self.output_format = output_format
+        self.poll_interval = poll_interval
+        # only builds the search urls, never requests anything
+        self.scraper = Scraper('coordinator', dedup=False)
+
+    def submit(self, words):
+        """Puts the first search page of every keyword on the queue, keywords already there are left as they are
+
+        Args:
+            words (list): keywords to crawl
+        """
+
+        for word in words:
+            self.queue.put(word, 'search', [(self.scraper.prepare_url(word), None)])
+
+    def wait(self):
+        """Blocks until every task is done or failed, printing the progress
+        """
+
+        while not self.queue.finished():
+            print(f"Queue: {self.queue.counts()}")
+            time.sleep(self.poll_interval)
+        print(f"Queue drained: {self.queue.counts()}")
+
+    def export(self, words=None):
+        """Writes the merged products of every keyword
+
+        Args:
+            words (list): keywords to write, every keyword of the queue if None
+
+        Returns:
+            counts: dict of keyword to number of products written
+        """
+
+        counts = {}
+        for word in words or self.queue.words():
+            counts[word] = self.queue.export(word, './' + word + '.' + self.output_format)
+            print(f"Wrote {counts[word]} products of '{word}'")
+        return counts
+
+    def run(self, words):
+        """Submits the keywords, waits for the workers and writes the output files
+
+        Args:
+            words (list): keywords to crawl
+
+        Returns:
+            counts: dict of keyword to number of products written
+        """
+
+        self.submit(words)
+        self.wait()
+        return self.export(words)
+
+
+class Worker():
+    """Leases tasks from the queue and runs them on a pool of threads with the scraper of their keyword,
+    new search pages and products go back on the queue and finished products are reported as results
+    """
+
+    def __init__(self, queue, name=None, threads=10, poll_interval=2.0, exit_when_done=True,
+                 retry_delay=1.0, max_retry_delay=60.0, **kwargs):
+        """ Init of the worker
+
+        Args:
+            queue (TaskQueue or RemoteQueue): queue shared with the coordinator
+            name (str): name of the worker in the queue, host name and a random suffix by default
+            threads (int): tasks run at the same time
+            poll_interval (float): seconds to wait when the queue has nothing to lease
+            exit_when_done (bool): stop once no task is pending or leased, keep waiting for new keywords if False
+            retry_delay (float): seconds before a call to a queue that could not be reached is tried again,
+                doubled on every failed try
+            max_retry_delay (float): longest wait before a call to the queue is tried again
+            **kwargs: passed on to every Scraper, the ones of all keywords share session, transport and rate limiter
+        """
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.exit_when_done = exit_when_done
+        self.kwargs = kwargs
+        self.scraper = Scraper('worker', **kwargs)
+        self.scrapers = {}
+        self.leased = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def scraper_for(self, word):
+        """Returns the scraper of a keyword, created on its first task
+
+        Args:
+            word (str): keyword
+
+        Returns:
+            scraper: Scraper for the keyword
+        """
+
+        with self._lock:
+            scraper = self.scrapers.get(word)
+            if scraper is None:
+                scraper = self.scraper.keyword_scraper(word, **self.kwargs)
+                scraper.search_url = scraper.prepare_url(word)
+                scraper.schedule_page = partial(self.schedule_page, word)
+                self.scrapers[word] = scraper
+            return scraper
+
+    def call_queue(self, method, *args):
+        """Calls a method of the queue, tried again with a growing delay while the queue can't be reached
+
+        Args:
+            method (str): name of the TaskQueue method
+            *args: arguments of the method
+
+        Returns:
+            result: what the method returned, None if the worker was stopped before the call went through
+        """
+
+        delay = self.retry_delay
+        while True:
+            try:
+                return getattr(self.queue, method)(*args)
+            except (requests.exceptions.RequestException, sqlite3.OperationalError) as e:
+                print(f"{type(e).__name__}: {e} while calling {method} on the queue, retrying in {delay:.0f} seconds...")
+            if self._stopped.wait(delay):
+                return None
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def schedule_page(self, word, page_url):
+        """Puts a search page found while parsing a search page on the queue
+
+        Args:
+            word (str): keyword
+            page_url (str): url of the search page
+        """
+
+        self.call_queue('put', word, 'search', [(page_url, None)])
+
+    def run_task(self, task):
+        """Fetches and parses the page of a task
+
+        Args:
+            task (Task): leased task
+
+        Returns:
+            done: False if no valid page was received
+        """
+
+        scraper = self.scraper_for(task.word)
+        if task.kind == 'search':
+            page_content = scraper.get_page_content(task.key)
+            if not page_content:
+                return False
+            products = list(scraper.parse_search_page((task.key, page_content)))
+            # keyed by asin, a product listed on several pages is fetched once
+            items = [(p.asin or get_asin(p.url) or p.url, p.to_json()) for p in products]
+            if scraper.listing_only:
+                self.call_queue('add_results', task.word, items, self.name)
+            else:
+                self.call_queue('put', task.word, 'detail', items)
+            return True
+
+        product_obj = Product(**json.loads(task.payload))
+        asin = product_obj.asin or get_asin(product_obj.url)
+        url = scraper.prepare_product_url(asin) if asin else product_obj.url
+        page_content = scraper.get_page_content(url)
+        if not page_content:
+            return False
+        product_obj.brand, product_obj.description = scraper.parse_brand_and_description(page_content, asin=asin)
+        scraper.metrics.inc('products')
+        print(f"scraped product {task.key} of '{task.word}'")
+        self.call_queue('add_results', task.word, [(task.key, product_obj.to_json())], self.name)
+        return True
+
+    def _work(self):
+        while not self._stopped.is_set():
+            tasks = self.call_queue('lease', self.name, 1)
+            if not tasks:
+                if self.exit_when_done and self.call_queue('finished'):
+                    return
+                self._stopped.wait(self.poll_interval)
+                continue
+            task = tasks[0]
+            with self._lock:
+                self.leased.add(task.id)
+            try:
+                ok = self.run_task(task)
+            except Exception as e:
+                # one bad task must not take the whole worker down
+                print(f"{type(e).__name__}: {e} in {task.kind} task {task.key}")
+                ok = False
+            finally:
+                with self._lock:
+                    self.leased.discard(task.id)
+            if ok:
+                self.call_queue('complete', task.id, self.name)
+            else:
+                # given back, the queue emits the product without details once the task failed for good
+                self.call_queue('fail', task.id, self.name)
+
+    def _heartbeat(self, interval):
+        while not self._stopped.wait(interval):
+            with self._lock:
+                task_ids = list(self.leased)
+            if task_ids:
+                self.call_queue('extend', task_ids, self.name)
+
+    def run(self):
+        """Works until the queue is drained (or stop is called), leases of the running tasks are
+        extended in the background so slow retries don't lose them
+        """
+
+        print(f"Worker {self.name} started with {self.threads} threads")
+        lease_timeout = self.queue.lease_timeout
+        heartbeat = threading.Thread(target=self._heartbeat, args=(lease_timeout / 3,), name='lease-heartbeat', daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self._work, name=f"worker-{i}", daemon=True) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._stopped.set()
+        heartbeat.join()
+        self.scraper.print_summary()
+
+    def stop(self):
+        """Makes the worker threads exit after their current task
+        """
+
+        self._stopped.set()
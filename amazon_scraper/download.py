@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed page downloads: the encodings asked for, their decompression, and a reader
+counting the bytes on the wire and after decompression which can stop reading a body
+as soon as its beginning shows a block page
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+
+# only encodings that can be decompressed here are asked for
+accept_encoding = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+# size of the chunks read from the network
+chunk_size = 64 * 1024
+
+
+class _BrotliDecoder():
+
+    def __init__(self):
+        self._decoder = brotli.Decompressor()
+
+    def decompress(self, data):
+        if hasattr(self._decoder, 'process'):
+            return self._decoder.process(data)
+        return self._decoder.decompress(data)
+
+    def flush(self):
+        return b''
+
+
+def decompressor(content_encoding):
+    """Creates the decompressor of a Content-Encoding header
+
+    Args:
+        content_encoding (str): value of the header, None or "identity" for uncompressed bodies
+
+    Raises:
+        ValueError: raised for an encoding that was not asked for
+
+    Returns:
+        decompressor or None: object with decompress(data) and flush(), None if the body is not compressed
+    """
+
+    encoding = (content_encoding or 'identity').split(',')[-1].strip().lower()
+    if encoding == 'identity':
+        return None
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.decompressobj()
+    if encoding == 'br' and brotli is not None:
+        return _BrotliDecoder()
+    raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+
+
+class BodyReader():
+    """Decompresses a response body chunk by chunk, once window bytes are read the beginning of the
+    body is handed to abort and reading stops if it returns True
+    """
+
+    def __init__(self, content_encoding=None, window=None, abort=None):
+        """ Init of the reader
+
+        Args:
+            content_encoding (str): Content-Encoding header of the response
+            window (int): decompressed bytes looked at by abort, the body is never checked if None
+            abort (callable): takes the first window bytes of the body, returns True to stop reading
+        """
+        self.decoder = decompressor(content_encoding)
+        self.window = window
+        self.abort = abort
+        self.chunks = []
+        self.transferred = 0
+        self.size = 0
+        self.aborted = False
+        self._checked = abort is None or not window
+
+    def feed(self, chunk):
+        """Takes the next chunk of the body as it came over the network
+
+        Args:
+            chunk (bytes): compressed chunk
+
+        Returns:
+            more: False once the rest of the body is not wanted
+        """
+
+        self.transferred += len(chunk)
+        data = self.decoder.decompress(chunk) if self.decoder is not None else chunk
+        self.chunks.append(data)
+        self.size += len(data)
+        if not self._checked and self.size >= self.window:
+            self._checked = True
+            if self.abort(b''.join(self.chunks)[:self.window]):
+                self.aborted = True
+                return False
+        return True
+
+    def finish(self):
+        """Returns the decompressed body, only its beginning if reading was aborted
+
+        Returns:
+            body: bytes
+        """
+
+        if self.decoder is not None and not self.aborted:
+            tail = self.decoder.flush()
+            self.chunks.append(tail)
+            self.size += len(tail)
+        return b''.join(self.chunks)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Predicates picking the products whose detail pages are fetched by an enrichment pass,
+after a listing-only crawl emitted them from search page information alone
+"""
+
+
+def price_between(low=None, high=None):
+    """Selects products with a known price inside a range
+
+    Args:
+        low (float): lowest price, no lower bound if None
+        high (float): highest price, no upper bound if None
+
+    Returns:
+        predicate: callable taking a Product and returning True if it is selected
+    """
+
+    def predicate(product):
+        if product.price is None:
+            return False
+        return (low is None or product.price >= low) and (high is None or product.price <= high)
+    return predicate
+
+
+def rating_at_least(stars):
+    """Selects products rated at least stars
+
+    Args:
+        stars (float): lowest rating out of 5
+
+    Returns:
+        predicate: callable taking a Product and returning True if it is selected
+    """
+
+    def predicate(product):
+        return bool(product.rating_stars) and product.rating_stars >= stars
+    return predicate
+
+
+def new_asins(known):
+    """Selects products whose asin is not in known, like the asins of a history store taken before the crawl
+
+    Args:
+        known (container): asins seen before, anything supporting "in"
+
+    Returns:
+        predicate: callable taking a Product and returning True if it is selected
+    """
+
+    def predicate(product):
+        return product.asin not in known
+    return predicate
+
+
+def all_of(*predicates):
+    """Selects products every predicate selects, every product if no predicate is given
+
+    Returns:
+        predicate: callable taking a Product and returning True if it is selected
+    """
+
+    def predicate(product):
+        return all(p(product) for p in predicates)
+    return predicate
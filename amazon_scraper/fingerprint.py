@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprints of the part of a page products are read from, with the tokens amazon changes on every
+request stripped, and a SQLite store of what was extracted from every fingerprint. A re-crawl
+finding a page unchanged takes its products from the store instead of parsing the page again
+"""
+
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from .cache import volatile_params
+
+
+# version of the code reading fields out of pages (tokenizer, pagination, converters), part of every fingerprint.
+# Bump it when that code changes, so what older code extracted is not reused
+extractor_version = 1
+# the part of a page a fingerprint is taken of starts at the first of these markers, the whole page if none is found.
+# Search pages start at the first product, the header above it holds the cart and the session of the visitor
+region_starts = {
+    'search': ('data-component-type="s-search-result"',),
+    'detail': ('id="dp-container"', 'id="dp"', 'id="centerCol"'),
+}
+# scripts, styles and comments carry request ids, timers and csrf tokens but no product information
+hidden_regexp = re.compile(r'<script\b.*?</script>|<style\b.*?</style>|<!--.*?-->', re.S | re.I)
+# tracking parameters of links, ad ids and the identifiers amazon gives the widgets of every response.
+# Case sensitive and without a leading space, both make the page scan several times slower
+volatile_regexp = re.compile(
+    r'[?&;](?:%s|spc|adId|ad_id|aaxitk|hsa_cr_id|lp_query|smid)=[^&"\'\s>]*' % '|'.join(
+        re.escape(param) for param in sorted(volatile_params)) +
+    r'|/ref=[^/?"\'\s>]*'
+    r'|(?:data-(?:csa-c-[\w-]+|component-id|uuid|ad-id|ad-details|cel-widget|csrf|request-id|impression-id|qid)'
+    r'|csrf[\w-]*)="[^"]*"')
+
+
+def page_region(page_content, kind):
+    """Returns the part of a page its fingerprint is taken of, with hidden markup and volatile tokens stripped
+
+    Args:
+        page_content (str): unicode encoded page
+        kind (str): "search" or "detail"
+
+    Returns:
+        region: text the fingerprint is taken of
+    """
+
+    start = 0
+    for marker in region_starts.get(kind, ()):
+        index = page_content.find(marker)
+        if index != -1:
+            # from the start of the tag holding the marker
+            start = max(page_content.rfind('<', 0, index), 0)
+            break
+    region = hidden_regexp.sub('', page_content[start:])
+    return volatile_regexp.sub('', region)
+
+
+def page_fingerprint(page_content, kind, salt=''):
+    """Fingerprints the region of a page products are read from, pages differing only in volatile tokens
+    get the same fingerprint. Pages extracted by another extractor_version never do
+
+    Args:
+        page_content (str): unicode encoded page
+        kind (str): "search" or "detail"
+        salt (str): identifies how fields are extracted, pages extracted differently never share a fingerprint
+
+    Returns:
+        fingerprint: hex digest
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{kind}\0{extractor_version}\0{salt}\0".encode('utf-8'))
+    digest.update(page_region(page_content, kind).encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+class FingerprintStore():
+    """SQLite store of the fields extracted from pages, keyed by page fingerprint.
+    Fingerprints not seen for max_age seconds are dropped
+    """
+
+    def __init__(self, path='amazon_fingerprints.sqlite', max_age=7 * 24 * 60 * 60):
+        """ Init of the store
+
+        Args:
+            path (str): SQLite file the extracted fields are kept in
+            max_age (float): seconds a fingerprint is kept after it was last seen, forever if None
+        """
+        self.path = path
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'fingerprint TEXT PRIMARY KEY, kind TEXT, fields TEXT, stored_at REAL, seen_at REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_seen_at ON pages (seen_at)')
+        if max_age is not None:
+            self._db.execute('DELETE FROM pages WHERE seen_at < ?', (time.time() - max_age,))
+        self._db.commit()
+
+    def get(self, fingerprint):
+        """Looks up what was extracted from a page
+
+        Args:
+            fingerprint (str): fingerprint of the page
+
+        Returns:
+            fields or None: the fields put for the fingerprint, None if the page was not seen before
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT fields FROM pages WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE pages SET seen_at = ? WHERE fingerprint = ?', (time.time(), fingerprint))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, fingerprint, kind, fields):
+        """Stores what was extracted from a page
+
+        Args:
+            fingerprint (str): fingerprint of the page
+            kind (str): "search" or "detail"
+            fields (dict): json serializable fields extracted from the page
+        """
+
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                             (fingerprint, kind, json.dumps(fields), now, now))
+            self._db.commit()
+            self.stored += 1
+
+    def stats(self):
+        """Returns how many pages were found unchanged
+
+        Returns:
+            stats: dict with hits, misses, stored, hit_rate and the number of fingerprints kept
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            kept = self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stored': self.stored,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'fingerprints': kept,
+            }
+
+    def close(self):
+        """Closes the SQLite file
+        """
+
+        with self._lock:
+            self._db.close()
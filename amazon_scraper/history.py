@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Price and rating history of products keyed by asin, every crawl updates the latest state of its
+products and a history row is only added when a tracked field changed
+"""
+
+import time
+import sqlite3
+import threading
+
+from .cache import get_asin
+
+
+# fields whose changes are kept in the history
+tracked_fields = ('price', 'rating_stars', 'review_count', 'bestseller', 'prime')
+
+
+class PriceHistory():
+    """SQLite store of the latest state of every product seen and of the changes of its tracked fields
+    """
+
+    def __init__(self, path='amazon_history.sqlite'):
+        """ Init of the store
+
+        Args:
+            path (str): SQLite file the products and their history are kept in
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS products ('
+            'asin TEXT PRIMARY KEY, keyword TEXT, url TEXT, title TEXT, brand TEXT, '
+            'price REAL, rating_stars REAL, review_count INTEGER, bestseller INTEGER, prime INTEGER, '
+            'first_seen REAL, last_seen REAL, last_changed REAL)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS history ('
+            'asin TEXT, seen_at REAL, price REAL, rating_stars REAL, review_count INTEGER, '
+            'bestseller INTEGER, prime INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS history_asin_seen_at ON history (asin, seen_at)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS history_seen_at ON history (seen_at)')
+        self._db.commit()
+
+    def record(self, products, keyword=None, seen_at=None):
+        """Upserts products, a history row is added for new products and for products whose tracked fields changed
+
+        Args:
+            products (iterable): Product objects, products without an asin are skipped
+            keyword (str): searched word the products were found with
+            seen_at (float): unix time of the crawl, now by default
+
+        Returns:
+            changed: number of history rows added
+        """
+
+        seen_at = time.time() if seen_at is None else seen_at
+        changed = 0
+        with self._lock:
+            for product in products:
+                asin = product.asin or get_asin(product.url or '')
+                if not asin:
+                    continue
+                # products built by hand leave rating_stars as an empty string
+                values = (product.price, product.rating_stars or None, product.review_count,
+                          int(bool(product.bestseller)), int(bool(product.prime)))
+                row = self._db.execute(
+                    'SELECT price, rating_stars, review_count, bestseller, prime FROM products WHERE asin = ?',
+                    (asin,)).fetchone()
+                if row is None:
+                    self._db.execute(
+                        'INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (asin, keyword, product.url, product.title, product.brand) + values + (seen_at, seen_at, seen_at))
+                elif tuple(row) != values:
+                    self._db.execute(
+                        'UPDATE products SET keyword = COALESCE(?, keyword), url = ?, title = ?, '
+                        "brand = COALESCE(NULLIF(?, ''), brand), price = ?, rating_stars = ?, review_count = ?, "
+                        'bestseller = ?, prime = ?, last_seen = ?, last_changed = ? WHERE asin = ?',
+                        (keyword, product.url, product.title, product.brand) + values + (seen_at, seen_at, asin))
+                else:
+                    # listing-only crawls have no brand, an enrichment pass brings it later
+                    self._db.execute("UPDATE products SET brand = COALESCE(NULLIF(?, ''), brand), last_seen = ? "
+                                     'WHERE asin = ?', (product.brand, seen_at, asin))
+                    continue
+                self._db.execute('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?)', (asin, seen_at) + values)
+                changed += 1
+            self._db.commit()
+        return changed
+
+    def asins(self):
+        """Returns every asin in the store
+
+        Returns:
+            asins: set of asins
+        """
+
+        with self._lock:
+            return {row[0] for row in self._db.execute('SELECT asin FROM products')}
+
+    def latest(self, asin):
+        """Returns the latest state of a product
+
+        Args:
+            asin (str): asin of the product
+
+        Returns:
+            product or None: dict of the stored fields, None if the asin was never seen
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT * FROM products WHERE asin = ?', (asin,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def history(self, asin, since=None):
+        """Returns the changes of a product, oldest first
+
+        Args:
+            asin (str): asin of the product
+            since (float): unix time, only changes after it are returned, every change if None
+
+        Returns:
+            changes: list of dicts with seen_at and the tracked fields
+        """
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT * FROM history WHERE asin = ? AND seen_at > ? ORDER BY seen_at',
+                (asin, since if since is not None else float('-inf'))).fetchall()
+        return [dict(row) for row in rows]
+
+    def changes_since(self, since):
+        """Returns every change of every product after a point in time, new products included
+
+        Args:
+            since (float): unix time
+
+        Returns:
+            changes: list of dicts with asin, seen_at and the tracked fields, oldest first
+        """
+
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM history WHERE seen_at > ? ORDER BY seen_at', (since,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def price_drops(self, since, min_drop=0.0):
+        """Finds the products which are cheaper now than they were at a point in time
+
+        Args:
+            since (float): unix time the current prices are compared with, products first seen after it are left out
+            min_drop (float): smallest drop reported, as a share of the old price (0.1 means at least 10% cheaper)
+
+        Returns:
+            drops: list of dicts with asin, title, keyword, old_price, price, drop (share of the old price)
+            and last_changed, biggest drop first
+        """
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT p.asin, p.title, p.keyword, h.price AS old_price, p.price, p.last_changed '
+                'FROM products p JOIN history h ON h.rowid = ('
+                '    SELECT rowid FROM history WHERE asin = p.asin AND seen_at <= ? ORDER BY seen_at DESC LIMIT 1) '
+                'WHERE p.price IS NOT NULL AND h.price IS NOT NULL AND p.price < h.price', (since,)).fetchall()
+        drops = []
+        for row in rows:
+            drop = dict(row)
+            drop['drop'] = (drop['old_price'] - drop['price']) / drop['old_price']
+            if drop['drop'] >= min_drop:
+                drops.append(drop)
+        return sorted(drops, key=lambda d: d['drop'], reverse=True)
+
+    def close(self):
+        """Closes the SQLite file
+        """
+
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of a crawl: counters, latency histograms and gauges recorded by every thread,
+readable as a snapshot, as Prometheus text on a local endpoint or as a periodic summary line
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# upper bounds in seconds of the latency histogram buckets
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+metric_prefix = 'amazon_scraper_'
+
+
+def metric_key(name, labels):
+    """Renders a metric name with its labels the way Prometheus does, like queue_depth{stage="detail"}
+
+    Args:
+        name (str): name of the metric
+        labels (tuple): sorted (label, value) tuples
+
+    Returns:
+        key: name followed by the labels in braces, just the name without labels
+    """
+
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+def merge_counts(first, second):
+    """Adds up two shards of counters
+
+    Args:
+        first (dict): counters keyed by anything
+        second (dict): counters keyed the same way
+
+    Returns:
+        counts: new dict holding the sum of both
+    """
+
+    merged = dict(first)
+    for key, value in second.items():
+        merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def merge_histograms(first, second):
+    """Adds up two shards of histograms
+
+    Args:
+        first (dict): Histogram objects keyed by anything
+        second (dict): Histogram objects keyed the same way
+
+    Returns:
+        histograms: new dict of new Histogram objects holding the observations of both
+    """
+
+    merged = {}
+    for histograms in (first, second):
+        for key, histogram in histograms.items():
+            if key not in merged:
+                merged[key] = Histogram(histogram.buckets)
+            merged[key].merge(histogram)
+    return merged
+
+
+class ThreadShards():
+    """Values written by many threads without a lock: every thread writes a shard of its own,
+    readers merge the shards of all threads. Shards of threads that exited are folded into one totals shard,
+    so crawls starting threads over and over keep a shard per running thread only
+    """
+
+    def __init__(self, factory=dict, merge=merge_counts):
+        """ Init of the shards
+
+        Args:
+            factory (callable): creates the shard of a thread the first time it writes
+            merge (callable): returns a new shard holding what is in the two shards it is called with
+        """
+        self.factory = factory
+        self.merge = merge
+        self._local = threading.local()
+        # (thread, shard) of every thread that wrote and had not exited when last looked at
+        self._shards = []
+        self._totals = factory()
+        self._lock = threading.Lock()
+
+    def local(self):
+        """Returns the shard of the calling thread, only the registration of a new thread takes the lock
+
+        Returns:
+            shard: object created by factory, to be written by the calling thread only
+        """
+
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self.factory()
+            with self._lock:
+                self._fold()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold(self):
+        # a thread that exited never writes its shard again. The totals are replaced, not changed,
+        # so a reader still holding the old totals and the folded shard doesn't count anything twice
+        running = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                running.append((thread, shard))
+            else:
+                self._totals = self.merge(self._totals, shard)
+        self._shards = running
+
+    def shards(self):
+        """Returns the totals of the threads that exited and the shard of every running thread that wrote
+
+        Returns:
+            shards: list of shards, the totals first
+        """
+
+        with self._lock:
+            self._fold()
+            return [self._totals] + [shard for _, shard in self._shards]
+
+
+class Histogram():
+    """ Hold the distribution of one timed operation in fixed buckets
+    """
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def merge(self, other):
+        """Adds the observations of another histogram with the same buckets
+
+        Args:
+            other (Histogram): histogram to add
+        """
+
+        self.count += other.count
+        self.sum += other.sum
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of the bucket it falls in
+
+        Args:
+            q (float): quantile between 0 and 1
+
+        Returns:
+            value or None: estimated quantile, None if nothing was observed
+        """
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics():
+    """Thread-safe registry of the measurements of a crawl, shared by every stage and worker.
+    Counters and histograms are kept per thread so recording a value never waits on another thread
+    """
+
+    def __init__(self, buckets=latency_buckets):
+        """ Init of the registry
+
+        Args:
+            buckets (tuple): upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = buckets
+        self.started = time.monotonic()
+        self._counters = ThreadShards()
+        self._histograms = ThreadShards(merge=merge_histograms)
+        self.gauges = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Registers a callback called with (name, value, labels) for every count and every observation
+
+        Args:
+            callback (callable): called on the thread that recorded the value, must be fast and thread-safe
+        """
+
+        self.listeners.append(callback)
+
+    def _notify(self, name, value, labels):
+        for callback in self.listeners:
+            callback(name, value, labels)
+
+    def inc(self, name, value=1, **labels):
+        """Adds value to a counter
+
+        Args:
+            name (str): name of the counter
+            value (int): amount added
+            **labels: label values of the counter, like stage="detail"
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        counters = self._counters.local()
+        counters[key] = counters.get(key, 0) + value
+        if self.listeners:
+            self._notify(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """Records one value, usually a duration in seconds, in a histogram
+
+        Args:
+            name (str): name of the histogram
+            value (float): observed value
+            **labels: label values of the histogram
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        histograms = self._histograms.local()
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+        if self.listeners:
+            self._notify(name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the body of a with statement into a histogram, also when it raises
+
+        Args:
+            name (str): name of the histogram
+            **labels: label values of the histogram
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, func, **labels):
+        """Registers a value read whenever the metrics are read, like the length of a queue
+
+        Args:
+            name (str): name of the gauge
+            func (callable): returns the current value, replaces an earlier gauge of the same name and labels
+            **labels: label values of the gauge
+        """
+
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = func
+
+    def count(self, name, **labels):
+        """Returns the current value of a counter, 0 if it was never increased
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        return sum(counters.get(key, 0) for counters in self._counters.shards())
+
+    @property
+    def counters(self):
+        """Every counter summed over the threads, keyed by (name, labels)
+        """
+
+        merged = {}
+        for counters in self._counters.shards():
+            # copied in one step, the thread owning the shard may add a key meanwhile
+            for key, value in dict(counters).items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    @property
+    def histograms(self):
+        """Every histogram merged over the threads, keyed by (name, labels)
+        """
+
+        merged = {}
+        for histograms in self._histograms.shards():
+            for key, histogram in dict(histograms).items():
+                if key not in merged:
+                    merged[key] = Histogram(self.buckets)
+                merged[key].merge(histogram)
+        return merged
+
+    def _read_gauges(self):
+        with self._lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for key, func in gauges:
+            try:
+                values[key] = func()
+            except Exception:
+                # a gauge of an object that went away
+                continue
+        return values
+
+    def snapshot(self):
+        """Returns every metric as plain data
+
+        Returns:
+            snapshot: dict with uptime (seconds), products_per_second, counters, gauges and histograms
+            (count, sum, p50, p90, p99), metrics are keyed like queue_depth{stage="detail"}
+        """
+
+        gauges = self._read_gauges()
+        uptime = time.monotonic() - self.started
+        counters = {metric_key(*key): value for key, value in self.counters.items()}
+        histograms = {
+            metric_key(*key): {
+                'count': h.count,
+                'sum': h.sum,
+                'p50': h.quantile(0.5),
+                'p90': h.quantile(0.9),
+                'p99': h.quantile(0.99),
+            } for key, h in self.histograms.items()
+        }
+        return {
+            'uptime': uptime,
+            'products_per_second': counters.get('products', 0) / uptime if uptime else 0.0,
+            'counters': counters,
+            'gauges': {metric_key(*key): value for key, value in gauges.items()},
+            'histograms': histograms,
+        }
+
+    def to_prometheus(self):
+        """Renders every metric in the Prometheus text exposition format
+
+        Returns:
+            text: one sample per line, names prefixed with amazon_scraper_
+        """
+
+        gauges = self._read_gauges()
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{metric_key(metric_prefix + name + '_total', labels)} {value}")
+        for (name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{metric_key(metric_prefix + name + '_bucket', labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric_key(metric_prefix + name + '_sum', labels)} {h.sum}")
+            lines.append(f"{metric_key(metric_prefix + name + '_count', labels)} {h.count}")
+        for (name, labels), value in sorted(gauges.items()):
+            lines.append(f"{metric_key(metric_prefix + name, labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """One line telling where the time goes: products per second, network, blocking, parsing and queues
+
+        Returns:
+            line: summary of the metrics
+        """
+
+        snap = self.snapshot()
+        counters, histograms = snap['counters'], snap['histograms']
+
+        def p50(key):
+            value = histograms.get(key, {}).get('p50')
+            return f"{value:g}s" if value is not None else '-'
+
+        queues = ' '.join(f"{dict(labels)['stage']}={value}" for (name, labels), value in self._read_gauges().items()
+                          if name == 'queue_depth')
+        listing = p50(metric_key('parse_seconds', (('stage', 'listing'),)))
+        detail = p50(metric_key('parse_seconds', (('stage', 'detail'),)))
+        return (f"{snap['uptime']:.0f}s | products {counters.get('products', 0)} ({snap['products_per_second']:.1f}/s)"
+                f" | requests {counters.get('requests', 0)}, {counters.get('bytes_fetched', 0) / (1024 * 1024):.1f} MiB"
+                f" ({counters.get('bytes_transferred', 0) / (1024 * 1024):.1f} MiB transferred),"
+                f" p50 {p50('request_seconds')}"
+                f" | blocked {counters.get('pages_blocked', 0)}, retries {counters.get('retries', 0)},"
+                f" errors {counters.get('request_errors', 0)}"
+                f" | parse p50 listing {listing} detail {detail}"
+                f" | queues {queues or '-'}")
+
+
+class MetricsServer():
+    """Serves the metrics in the Prometheus text format on http://host:port/metrics
+    """
+
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        """ Init of the server
+
+        Args:
+            metrics (Metrics): metrics to serve
+            host (str): address to listen on
+            port (int): port to listen on, 0 picks a free one
+        """
+        self.metrics = metrics
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """url the metrics are served on
+        """
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def _make_handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Starts serving on a background thread
+        """
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving and closes the socket
+        """
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class SummaryReporter():
+    """Prints the summary line of the metrics every interval seconds while a crawl runs
+    """
+
+    def __init__(self, metrics, interval=10.0, output=print):
+        """ Init of the reporter
+
+        Args:
+            metrics (Metrics): metrics to report
+            interval (float): seconds between two lines
+            output (callable): called with every line
+        """
+        self.metrics = metrics
+        self.interval = interval
+        self.output = output
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.output(self.metrics.summary())
+
+    def start(self):
+        """Starts reporting on a background thread
+        """
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-summary', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops reporting
+        """
+
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
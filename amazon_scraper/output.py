@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming output of scraped products, one json object per line (NDJSON) written by a single thread
+"""
+
+import os
+import time
+import queue
+import threading
+
+
+# put on the queue to make the writer thread exit
+_STOP = object()
+
+
+class NDJSONWriter():
+    """Appends products to an NDJSON file as they come in, writes are batched and done by one thread
+    so producers never wait on the disk and never interleave lines
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, on_flush=None, metrics=None):
+        """ Init of the writer
+
+        Args:
+            path (str): NDJSON file to append to
+            batch_size (int): maximum number of products written with one write call
+            flush_interval (float): seconds a product may wait in the queue before it is written
+            on_flush (callable): called from the writer thread with every list of products once it is on disk
+            metrics (Metrics): records the time spent writing and the number of products written
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.metrics = metrics
+        self.count = 0
+        # first exception raised by on_flush, raised again by close
+        self.error = None
+        # put never takes a lock shared with the other producers
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def write(self, product):
+        """Queues a product to be written
+
+        Args:
+            product (Product): product to write
+        """
+
+        self._queue.put(product)
+
+    def _next_batch(self):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        with open(self.path, mode='a', encoding='utf-8') as f:
+            running = True
+            while running:
+                lines = []
+                products = []
+                for product in self._next_batch():
+                    if product is _STOP:
+                        running = False
+                        continue
+                    lines.append(product.to_json() + '\n')
+                    products.append(product)
+                if lines:
+                    start = time.perf_counter()
+                    f.write(''.join(lines))
+                    f.flush()
+                    self.count += len(lines)
+                    if self.metrics is not None:
+                        self.metrics.observe('output_write_seconds', time.perf_counter() - start)
+                        self.metrics.inc('products_written', len(lines))
+                    if self.on_flush is not None:
+                        try:
+                            self.on_flush(products)
+                        except Exception as e:
+                            # the products are on disk already, keep writing the ones still queued
+                            print(f"{type(e).__name__}: {e} in on_flush of {self.path}")
+                            if self.error is None:
+                                self.error = e
+
+    def start(self, append=False):
+        """Starts the writer thread, the file is truncated first
+
+        Args:
+            append (bool): keep the products already in the file, used when a crawl is resumed
+        """
+
+        if not append:
+            open(self.path, mode='w').close()
+        self._thread = threading.Thread(target=self._run, name='ndjson-writer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Writes whatever is still queued and stops the writer thread, the first error raised by
+        on_flush is raised again here
+        """
+
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def compact(self, json_path, remove=True):
+        """Converts the NDJSON file into a json array file, line by line so memory stays constant
+
+        Args:
+            json_path (str): json file to write
+            remove (bool): delete the NDJSON file afterwards
+        """
+
+        with open(self.path, encoding='utf-8') as src, open(json_path, mode='w', encoding='utf-8') as dst:
+            dst.write('[')
+            first = True
+            for line in src:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                if not first:
+                    dst.write(',')
+                dst.write(line)
+                first = False
+            dst.write(']')
+        if remove:
+            os.remove(self.path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing in worker processes, so search and detail pages are parsed on every core
+while the requests stay on the threads of the scraper
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .product import Product, product_fields
+from .detail_parser import extract_details, detail_fields
+from .rules import RuleSet
+from .scraper import Scraper
+
+
+# scraper of the worker process, created once by _init_worker
+_worker_scraper = None
+# rules of the scrapers handing over pages, by version, the spec of a version is sent to a worker once
+_worker_rules = {}
+
+
+def _init_worker(parser, fields, rules):
+    global _worker_scraper
+    _worker_scraper = Scraper('parse-worker', parser=parser, detail_fields=fields, dedup=False, rules=rules)
+
+
+def _use_rules(rules):
+    # returns False if the rules are not known in this process yet, the page is then sent again with their spec
+    if rules is None:
+        _worker_scraper.refresh_rules()
+        return True
+    version, spec, path = rules
+    if version not in _worker_rules:
+        if spec is None:
+            return False
+        _worker_rules[version] = RuleSet(spec, path)
+    _worker_scraper.rules = _worker_rules[version]
+    return True
+
+
+def _parse_search_page(page_content, pages, rules):
+    scraper = _worker_scraper
+    if not _use_rules(rules):
+        return None
+    soup = scraper.make_soup(page_content)
+    pagination = {}
+    if pages:
+        scraper.follow_next = pages == 'next'
+        pagination = scraper.read_pagination(soup)
+    products = [scraper.get_listing_info(product) for product in scraper.get_product_tags(soup)]
+    # tuples pickle much smaller and faster than Product objects
+    records = [tuple(getattr(product, field) for field in product_fields) for product in products]
+    return (records, pagination), scraper.rules.take_hits()
+
+
+def _parse_details(page_content, fields, rules):
+    if not _use_rules(rules):
+        return None
+    rules = _worker_scraper.rules
+    return extract_details(page_content, fields or _worker_scraper.detail_fields, rules), rules.take_hits()
+
+
+class ParsePool():
+    """Pool of worker processes parsing raw html into compact records, gives the same
+    results as the parsing done on the scraper's threads
+    """
+
+    def __init__(self, workers=None, parser=None, detail_fields=detail_fields, start_method='spawn', rules=None):
+        """ Init of the pool
+
+        Args:
+            workers (int): number of worker processes, the number of cores by default
+            parser (str): BeautifulSoup tree builder for search pages, defaults to the fastest installed
+            detail_fields (iterable): fields read from product detail pages, any of "brand" and "description"
+            start_method (str): how worker processes are started, "spawn" is safe next to the scraper's threads
+            rules (str): extraction rules spec file used for pages handed over without rules, the bundled rules.json
+                by default. Scrapers hand over their own rules with every page, the rule hits are added to them
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.parser = parser
+        self.detail_fields = tuple(detail_fields)
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(start_method),
+                                            initializer=_init_worker, initargs=(parser, self.detail_fields, rules))
+
+    def search_page(self, page_content, pages='', rules=None):
+        """Extracts the search page information of every product on a search page in a worker process,
+        along with the pagination of the page so it is parsed only once
+
+        Args:
+            page_content (str): unicode encoded search page
+            pages (str): pagination read from the page, "next" for the url of the "next" link,
+                "count" for the page count, "" for none
+            rules (RuleSet): rules of the scraper the page belongs to, the rules of the pool if None
+
+        Returns:
+            products, pagination: list of Product filled with the search page information,
+            and the dict read_pagination returns ({} if pages is "")
+        """
+
+        records, pagination = self.run(_parse_search_page, rules, page_content, pages)
+        return [Product(*record) for record in records], pagination
+
+    def listing(self, page_content, rules=None):
+        """Extracts the search page information of every product on a search page in a worker process
+
+        Args:
+            page_content (str): unicode encoded search page
+            rules (RuleSet): rules of the scraper the page belongs to, the rules of the pool if None
+
+        Returns:
+            products: list of Product filled with the search page information
+        """
+
+        return self.search_page(page_content, rules=rules)[0]
+
+    def details(self, page_content, fields=None, rules=None):
+        """Extracts the detail fields of a product detail page in a worker process
+
+        Args:
+            page_content (str): unicode encoded detail page
+            fields (iterable): fields read from the page, the detail_fields of the pool if None
+            rules (RuleSet): rules of the scraper the page belongs to, the rules of the pool if None
+
+        Returns:
+            details: dict like extract_details returns
+        """
+
+        fields = tuple(fields) if fields is not None else None
+        return self.run(_parse_details, rules, page_content, fields)
+
+    def run(self, function, rules, *args):
+        """Calls a parsing function in a worker process, with the version of the rules only.
+        A worker that doesn't know that version asks for the spec, and the call is sent again with it
+
+        Args:
+            function (callable): _parse_search_page or _parse_details
+            rules (RuleSet): rules of the scraper the page belongs to, gets the hits of the call, the rules of the pool if None
+            *args: arguments of function in front of the rules
+
+        Returns:
+            result: what function extracted
+        """
+
+        if rules is None:
+            return self.executor.submit(function, *args, None).result()[0]
+        returned = self.executor.submit(function, *args, (rules.version, None, rules.path)).result()
+        if returned is None:
+            returned = self.executor.submit(function, *args, (rules.version, rules.spec, rules.path)).result()
+        result, hits = returned
+        rules.merge(hits)
+        return result
+
+    def close(self):
+        """Stops the worker processes
+        """
+
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Staged fetch/parse pipeline, every stage has its own pool of worker threads
+and hands its results to the next stage through a bounded queue
+"""
+
+import time
+import heapq
+import queue
+import itertools
+import threading
+
+
+# put on a stage queue once per worker to make it exit
+_STOP = object()
+
+
+class RetryLater(Exception):
+    """Raised by a stage function to have its item processed again after a delay,
+    the worker thread moves on to other items in the meantime
+    """
+
+    def __init__(self, delay):
+        super().__init__(f"retry in {delay:.1f} seconds")
+        self.delay = delay
+
+
+class StageError(Exception):
+    """An item failed in a stage of the pipeline, the exception it raised is the cause
+    """
+
+    def __init__(self, stage, item, error):
+        super().__init__(f"{type(error).__name__}: {error} in stage {stage}")
+        self.stage = stage
+        self.item = item
+        self.error = error
+
+
+class Stage():
+    """One step of the pipeline, run by its own pool of worker threads
+    """
+
+    def __init__(self, name, func, workers=1, maxsize=0):
+        """ Init of the stage
+
+        Args:
+            name (str): name used to submit items to this stage
+            func (callable): called with every item, returns an iterable (or None) of items for the next stage
+            workers (int): number of threads running func
+            maxsize (int): size of the queue in front of the stage, 0 means unbounded
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize)
+        self.next_stage = None
+        self.threads = []
+
+
+class Pipeline():
+    """Chains stages together and keeps track of the items still in flight
+    """
+
+    def __init__(self, sink=None, on_error=None):
+        """ Init of the pipeline
+
+        Args:
+            sink (callable): called with every item produced by the last stage
+            on_error (callable): called with (stage name, item, exception) for every item a stage function failed on,
+                from the worker thread of the stage
+        """
+        self.sink = sink
+        self.on_error = on_error
+        self.stages = {}
+        self.last_stage = None
+        self.errors = []
+        self.cancelled = False
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._scheduler = None
+        self._running = False
+
+    def add_stage(self, name, func, workers=1, maxsize=0):
+        """Appends a stage at the end of the pipeline, output of the previous last stage is fed into it
+
+        Returns:
+            stage: the newly created Stage
+        """
+
+        stage = Stage(name, func, workers, maxsize)
+        if self.last_stage is not None:
+            self.last_stage.next_stage = stage
+        self.stages[name] = stage
+        self.last_stage = stage
+        return stage
+
+    def submit(self, name, item):
+        """Puts an item on the queue of the named stage, blocks while that queue is full
+
+        Args:
+            name (str): name of the stage
+            item: anything the stage function accepts
+        """
+
+        with self._cond:
+            self._pending += 1
+        self.stages[name].queue.put(item)
+
+    def submit_later(self, name, item, delay):
+        """Puts an item on the queue of the named stage once delay seconds have passed, without blocking
+
+        Args:
+            name (str): name of the stage
+            item: anything the stage function accepts
+            delay (float): seconds to wait
+        """
+
+        with self._cond:
+            if self.cancelled:
+                return
+            self._pending += 1
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), name, item))
+            self._cond.notify_all()
+
+    def _schedule(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._delayed or self._delayed[0][0] > time.monotonic()):
+                    timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                _, _, name, item = heapq.heappop(self._delayed)
+            # already counted as pending by submit_later
+            self.stages[name].queue.put(item)
+
+    def _task_done(self):
+        with self._cond:
+            self._pending -= 1
+            if self._pending == 0:
+                self._cond.notify_all()
+
+    def _emit(self, stage, result):
+        if self.cancelled:
+            return
+        if stage.next_stage is not None:
+            self.submit(stage.next_stage.name, result)
+        elif self.sink is not None:
+            self.sink(result)
+
+    def _work(self, stage):
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+            if self.cancelled:
+                # dropped, the pipeline only waits for the items being processed
+                self._task_done()
+                continue
+            try:
+                for result in stage.func(item) or ():
+                    self._emit(stage, result)
+            except RetryLater as retry:
+                self.submit_later(stage.name, item, retry.delay)
+            except Exception as e:
+                # one bad item must not take the whole worker down
+                print(f"{type(e).__name__}: {e} in stage {stage.name}")
+                self.errors.append((stage.name, item, e))
+                if self.on_error is not None:
+                    self.on_error(stage.name, item, e)
+            finally:
+                self._task_done()
+
+    def start(self):
+        """Starts the worker threads of every stage
+        """
+
+        self._running = True
+        self._scheduler = threading.Thread(target=self._schedule, name='scheduler', daemon=True)
+        self._scheduler.start()
+        for stage in self.stages.values():
+            for i in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(stage,),
+                                          name=f"{stage.name}-{i}", daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+    def cancel(self):
+        """Drops every item that is queued or waiting for a retry, items being processed are finished
+        but what they produce is dropped too. join returns as soon as they are done
+        """
+
+        with self._cond:
+            self.cancelled = True
+            self._pending -= len(self._delayed)
+            self._delayed = []
+            self._cond.notify_all()
+
+    def join(self):
+        """Waits until every submitted item went through the whole pipeline, then stops the workers
+        """
+
+        with self._cond:
+            while self._pending:
+                self._cond.wait()
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._scheduler.join()
+
+        for stage in self.stages.values():
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+        for stage in self.stages.values():
+            for thread in stage.threads:
+                thread.join()
+            stage.threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.join()
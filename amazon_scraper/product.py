@@ -1,8 +1,33 @@
+import csv
 import json
+import math
+from array import array
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# order of the fields in the output files
+product_fields = ('url', 'asin', 'title', 'brand', 'description', 'price', 'img_url',
+                  'rating_stars', 'review_count', 'bestseller', 'prime')
+text_fields = ('url', 'asin', 'title', 'brand', 'description', 'img_url')
+json_encoder = json.JSONEncoder()
+
+# bits of ProductBatch.flags
+bestseller_flag = 1
+prime_flag = 2
+
 
 class Product():
     """ Hold information about object of type Product
     """
+
+    __slots__ = product_fields
+
     def __init__(self, url='', asin='', title='', brand='', description='', price=None, img_url='', rating_stars='', review_count=None, bestseller=False, prime=False):
 
         self.url = url
@@ -16,9 +41,175 @@ class Product():
         self.review_count = review_count
         self.bestseller = bestseller
         self.prime = prime
-    
+
+    def to_dict(self):
+        """convert object to dict, keys are in output file order
+        """
+        return {field: getattr(self, field) for field in product_fields}
+
     def to_json(self):
         """convert object to json string format
         """
-        return json.dumps(self, default=lambda o: o.__dict__)
-    
+        return json_encoder.encode(self.to_dict())
+
+
+def _float_or_nan(value):
+    return float('nan') if value is None or value == '' else float(value)
+
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else value
+
+
+class ProductBatch():
+    """ Hold many products column by column, prices and ratings are float64 arrays,
+    review counts an int64 array and bestseller/prime are bit flags, so memory per product
+    is a few bytes plus its strings. Missing numbers are stored as NaN, or -1 for review counts
+    """
+
+    def __init__(self, products=()):
+        """ Init of the batch
+
+        Args:
+            products (iterable): Product objects to add
+        """
+        self.columns = {field: [] for field in text_fields}
+        self.price = array('d')
+        self.rating_stars = array('d')
+        self.review_count = array('q')
+        self.flags = bytearray()
+        self.extend(products)
+
+    def append(self, product):
+        """Adds a product at the end of the batch
+
+        Args:
+            product (Product): product to add
+        """
+
+        for field in text_fields:
+            self.columns[field].append(getattr(product, field))
+        self.price.append(_float_or_nan(product.price))
+        self.rating_stars.append(_float_or_nan(product.rating_stars))
+        self.review_count.append(-1 if product.review_count is None else int(product.review_count))
+        self.flags.append((bestseller_flag if product.bestseller else 0) | (prime_flag if product.prime else 0))
+
+    def extend(self, products):
+        """Adds many products at the end of the batch
+
+        Args:
+            products (iterable): Product objects to add
+        """
+
+        for product in products:
+            self.append(product)
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __getitem__(self, index):
+        """Rebuilds the Product stored at index
+        """
+
+        review_count = self.review_count[index]
+        return Product(price=_nan_to_none(self.price[index]),
+                       rating_stars=_nan_to_none(self.rating_stars[index]),
+                       review_count=None if review_count < 0 else review_count,
+                       bestseller=bool(self.flags[index] & bestseller_flag),
+                       prime=bool(self.flags[index] & prime_flag),
+                       **{field: self.columns[field][index] for field in text_fields})
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def rows(self):
+        """Yields every product as a tuple of values in product_fields order, without building Product objects
+        """
+
+        columns = self.columns
+        for index in range(len(self)):
+            review_count = self.review_count[index]
+            yield (columns['url'][index], columns['asin'][index], columns['title'][index],
+                   columns['brand'][index], columns['description'][index],
+                   _nan_to_none(self.price[index]), columns['img_url'][index],
+                   _nan_to_none(self.rating_stars[index]),
+                   None if review_count < 0 else review_count,
+                   bool(self.flags[index] & bestseller_flag), bool(self.flags[index] & prime_flag))
+
+    def to_json(self, path):
+        """Writes the batch as a json array, same format as Scraper output files
+
+        Args:
+            path (str): file to write
+        """
+
+        with open(path, mode='w', encoding='utf-8') as f:
+            f.write('[')
+            f.write(','.join(json_encoder.encode(dict(zip(product_fields, row))) for row in self.rows()))
+            f.write(']')
+
+    def to_csv(self, path):
+        """Writes the batch as csv with a header line, missing values are empty cells
+
+        Args:
+            path (str): file to write
+        """
+
+        with open(path, mode='w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(product_fields)
+            writer.writerows(self.rows())
+
+    def to_arrow(self):
+        """Converts the batch into a pyarrow Table, numeric columns are handed over without going through python objects
+
+        Returns:
+            table: pyarrow.Table with one column per product field
+        """
+
+        if pyarrow is None:
+            raise ImportError("ProductBatch.to_arrow requires pyarrow, install it with: pip install pyarrow")
+
+        review_count = pyarrow.array(self.review_count, type=pyarrow.int64())
+        flags = pyarrow.array(self.flags, type=pyarrow.uint8())
+        pc = pyarrow.compute
+        columns = {field: pyarrow.array(self.columns[field], type=pyarrow.string()) for field in text_fields}
+        columns['price'] = pyarrow.array(self.price, type=pyarrow.float64(), from_pandas=True)
+        columns['rating_stars'] = pyarrow.array(self.rating_stars, type=pyarrow.float64(), from_pandas=True)
+        columns['review_count'] = pc.if_else(pc.less(review_count, 0), pyarrow.scalar(None, pyarrow.int64()), review_count)
+        columns['bestseller'] = pc.not_equal(pc.bit_wise_and(flags, bestseller_flag), 0)
+        columns['prime'] = pc.not_equal(pc.bit_wise_and(flags, prime_flag), 0)
+        return pyarrow.table({field: columns[field] for field in product_fields})
+
+    def to_parquet(self, path):
+        """Writes the batch as a parquet file
+
+        Args:
+            path (str): file to write
+        """
+
+        table = self.to_arrow()
+        pyarrow.parquet.write_table(table, path)
+
+    @classmethod
+    def read_json(cls, path):
+        """Loads a Scraper output file, either a json array or NDJSON
+
+        Args:
+            path (str): file to read
+
+        Returns:
+            batch: ProductBatch holding every product of the file
+        """
+
+        batch = cls()
+        with open(path, encoding='utf-8') as f:
+            first = f.read(1)
+            while first.isspace():
+                first = f.read(1)
+            f.seek(0)
+            records = json.load(f) if first == '[' else (json.loads(line) for line in f if line.strip())
+            for record in records:
+                batch.append(Product(**{field: record[field] for field in product_fields if field in record}))
+        return batch
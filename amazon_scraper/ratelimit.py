@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive pacing of the requests: a token bucket caps the request rate, and rate and
+concurrency follow AIMD (additive increase, multiplicative decrease) on amazon's block pages
+"""
+
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+
+class RateLimiter():
+    """Shared by every thread (or task) of a crawl. Each success raises the rate a little,
+    each block page cuts rate and concurrency down, and blocked urls are retried after a
+    jittered exponential backoff
+    """
+
+    def __init__(self, rate=10.0, min_rate=0.2, max_rate=100.0, concurrency=8, min_concurrency=1,
+                 max_concurrency=64, increase=0.05, decrease=0.5, base_delay=5.0, max_delay=120.0, window=100, cooldown=1.0):
+        """ Init of the rate limiter
+
+        Args:
+            rate (float): starting number of requests per second
+            min_rate (float): rate never goes below this
+            max_rate (float): rate never goes above this
+            concurrency (float): starting number of requests in flight at the same time
+            min_concurrency (int): concurrency never goes below this
+            max_concurrency (int): concurrency never goes above this
+            increase (float): requests per second added to the rate after every valid page
+            decrease (float): factor rate and concurrency are multiplied with after every block page
+            base_delay (float): seconds before the first retry of a blocked url, doubled on every retry
+            max_delay (float): longest wait before a retry
+            window (int): number of last pages the block rate is computed on
+            cooldown (float): seconds after a decrease during which further block pages don't decrease again,
+                so a burst of requests blocked together counts once
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.requests = 0
+        self.blocks = 0
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._recent = deque(maxlen=window)
+        self._attempts = {}
+        self._decreased = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # the bucket holds at most one second worth of requests
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Takes a request slot if the rate and concurrency allow it
+
+        Returns:
+            wait: 0 if the slot was taken, otherwise seconds to wait before trying again
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.in_flight >= int(self.concurrency):
+                return 0.05
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self.in_flight += 1
+            self.requests += 1
+            return 0
+
+    def acquire(self):
+        """Blocks until a request may be sent, must be followed by release
+        """
+
+        wait = self.try_acquire()
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    async def async_acquire(self):
+        """Waits without blocking the event loop until a request may be sent, must be followed by release
+        """
+
+        wait = self.try_acquire()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire()
+
+    def release(self):
+        """Gives back the slot taken by acquire once the response arrived
+        """
+
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, blocked):
+        """Adapts rate and concurrency to the outcome of a request
+
+        Args:
+            blocked (bool): True if amazon answered with a block page (robot check, request could not be satisfied)
+        """
+
+        with self._lock:
+            self._recent.append(blocked)
+            if blocked:
+                self.blocks += 1
+                now = time.monotonic()
+                if self._decreased is not None and now - self._decreased < self.cooldown:
+                    return
+                self._decreased = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease)
+                self._tokens = min(self._tokens, 0.0)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                # one more request in flight per concurrency successes
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def attempts(self, url):
+        """Returns how many retries of url were scheduled so far
+        """
+
+        with self._lock:
+            return self._attempts.get(url, 0)
+
+    def backoff(self, url):
+        """Counts one more retry of url and returns how long to wait before it
+
+        Args:
+            url (str): url that got an invalid page
+
+        Returns:
+            delay: seconds to wait, exponential in the number of retries with random jitter
+        """
+
+        with self._lock:
+            attempt = self._attempts.get(url, 0)
+            self._attempts[url] = attempt + 1
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def reset(self, url):
+        """Forgets the retries of url, once it succeeded or was given up on
+        """
+
+        with self._lock:
+            self._attempts.pop(url, None)
+
+    def stats(self):
+        """Returns the current pacing
+
+        Returns:
+            stats: dict with rate (requests per second), concurrency, in_flight, block_rate of the last pages, requests and blocks
+        """
+
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3),
+                'concurrency': int(self.concurrency),
+                'in_flight': self.in_flight,
+                'block_rate': sum(self._recent) / len(self._recent) if self._recent else 0.0,
+                'requests': self.requests,
+                'blocks': self.blocks,
+            }
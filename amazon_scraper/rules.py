@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative extraction rules: a json spec lists, for every field, the rules it can be read with
+in order of preference. The spec is compiled once into matchers, every rule of every field is
+tried during a single walk over the tags of a product and the first rule in order that matched
+gives the value. Hits of every rule are counted, and a changed spec file can be swapped in while a crawl runs
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+
+from .metrics import ThreadShards
+
+
+default_rules_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+# how the text or attribute a rule read is turned into the field value, None means the rule did not match
+converters = {
+    'str': lambda text, rule: text.strip(),
+    'float': lambda text, rule: float(text),
+    'int': lambda text, rule: int(text.replace(',', '')),
+    'price': lambda text, rule: float(text.strip().strip('$').replace(',', '')),
+    'equals': lambda text, rule: text.strip() == rule.value,
+    'present': lambda text, rule: True,
+}
+
+
+def class_matcher(classes):
+    """Compiles a class spec into a regex matching the class attribute of a tag
+
+    Args:
+        classes (str): class names that must follow each other in the class attribute, like "a-color-base a-text-normal"
+
+    Returns:
+        matcher: compiled regex to search the space joined classes of a tag with
+    """
+
+    return re.compile(r'(?:^|\s)' + r'\s+'.join(re.escape(name) for name in classes.split()) + r'(?:\s|$)')
+
+
+class Rule():
+    """One way of reading a field out of a tag: which tag, which classes, where the text comes from
+    and how it is converted
+    """
+
+    __slots__ = ('field', 'name', 'index', 'tag', 'classes', 'attr', 'regex', 'convert', 'prefix', 'value', 'presence')
+
+    def __init__(self, field, index, spec):
+        """ Init of the rule
+
+        Args:
+            field (str): field the rule fills
+            index (int): position of the rule among the rules of its field, lower is preferred
+            spec (dict): tag, class, attr, regex, type, prefix and value, only type has a default ("str")
+        """
+        self.field = field
+        self.index = index
+        self.name = spec.get('name') or f"{field}[{index}]"
+        self.tag = spec.get('tag')
+        self.classes = class_matcher(spec['class']) if spec.get('class') else None
+        self.attr = spec.get('attr')
+        self.regex = re.compile(spec['regex']) if spec.get('regex') else None
+        kind = spec.get('type', 'str')
+        if kind not in converters:
+            raise ValueError(f"Unknown type {kind!r} in rule {self.name} of {field}")
+        self.convert = converters[kind]
+        self.prefix = spec.get('prefix', '')
+        self.value = spec.get('value')
+        # the tag matching is the whole rule, its text is never read
+        self.presence = kind == 'present' and self.attr is None and self.regex is None
+
+    def apply(self, tag, joined_classes):
+        """Reads the field out of a tag
+
+        Args:
+            tag (bs4.Tag): tag of the product
+            joined_classes (str): classes of the tag joined with spaces
+
+        Returns:
+            value or None: field value, None if the rule does not match the tag
+        """
+
+        if self.classes is not None and not self.classes.search(joined_classes):
+            return None
+        if self.presence:
+            return True
+        if self.attr is not None:
+            text = tag.get(self.attr)
+            if text is None:
+                return None
+            if isinstance(text, list):
+                text = ' '.join(text)
+        else:
+            text = tag.text
+        if self.regex is not None:
+            match = self.regex.search(text)
+            if not match:
+                return None
+            text = match.group(1) if match.groups() else match.group(0)
+        try:
+            value = self.convert(text, self)
+        except ValueError:
+            return None
+        return self.prefix + value if self.prefix else value
+
+
+class RuleSet():
+    """Compiled spec of the listing fields and of the order of the detail page sources,
+    counts which rule every field was read with
+    """
+
+    def __init__(self, spec, path=None):
+        """ Init of the rule set
+
+        Args:
+            spec (dict): parsed spec, see rules.json
+            path (str): file the spec was read from, watched by changed()
+        """
+        self.spec = spec
+        self.path = path
+        self.mtime = os.path.getmtime(path) if path else None
+        # changes whenever the spec does, what was extracted with other rules is not reused
+        self.version = hashlib.blake2b(json.dumps(spec, sort_keys=True).encode('utf-8'), digest_size=8).hexdigest()
+        listing = spec.get('listing', {})
+        container = listing.get('container', {})
+        self.container_tag = container.get('tag', 'div')
+        self.container_attrs = {container['attr']: container['value']} if container.get('attr') else {}
+        self.fields = tuple(listing.get('fields', {}))
+        # rules are looked up by tag name during the walk, rules without a tag are tried on every tag
+        self.by_tag = {}
+        self.any_tag = []
+        for field, specs in listing.get('fields', {}).items():
+            for index, rule_spec in enumerate(specs):
+                rule = Rule(field, index, rule_spec)
+                if rule.tag is None:
+                    self.any_tag.append(rule)
+                else:
+                    self.by_tag.setdefault(rule.tag, []).append(rule)
+        self.detail_sources = {field: tuple(sources) for field, sources in spec.get('detail', {}).items()}
+        # counted per thread, every parsing thread records a hit for every product
+        self._hits = ThreadShards()
+
+    @classmethod
+    def from_file(cls, path=default_rules_path):
+        """Reads and compiles a spec file
+
+        Args:
+            path (str): json spec file
+
+        Returns:
+            rules: RuleSet
+        """
+
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), path=path)
+
+    def changed(self):
+        """Returns True if the spec file was modified since it was read
+        """
+
+        return self.path is not None and os.path.getmtime(self.path) != self.mtime
+
+    def extract(self, product):
+        """Reads every listing field of a product in one walk over its tags, stops early once
+        every field was read with its preferred rule
+
+        Args:
+            product (bs4.Tag): higher level html tag of a product
+
+        Returns:
+            values: dict of field to value, fields no rule matched are left out
+        """
+
+        # best[field] is (rule index, value, rule name) of the most preferred rule matched so far
+        best = {}
+        left = len(self.fields)
+        by_tag, any_tag = self.by_tag, self.any_tag
+        # walked lazily, the walk stops at the tag that gave the last preferred value
+        for tag in product.descendants:
+            if tag.name is None:
+                # text between the tags
+                continue
+            rules = by_tag.get(tag.name)
+            if rules is None and not any_tag:
+                continue
+            joined_classes = ' '.join(tag.get('class') or ())
+            for group in (rules or (), any_tag):
+                for rule in group:
+                    found = best.get(rule.field)
+                    if found is not None and found[0] <= rule.index:
+                        continue
+                    value = rule.apply(tag, joined_classes)
+                    if value is None:
+                        continue
+                    best[rule.field] = (rule.index, value, rule.name)
+                    if rule.index == 0:
+                        left -= 1
+            if not left:
+                break
+        self.record([(field, best[field][2] if field in best else 'miss') for field in self.fields])
+        return {field: found[1] for field, found in best.items()}
+
+    def record(self, hits):
+        """Counts the rules fields were read with
+
+        Args:
+            hits (iterable): (field, rule name) pairs, the rule name is "miss" if no rule gave a value
+        """
+
+        counts = self._hits.local()
+        for field, name in hits:
+            key = f"{field}:{name}"
+            counts[key] = counts.get(key, 0) + 1
+
+    def take_hits(self):
+        """Returns the hits the calling thread counted since its last call and starts over,
+        a ParsePool worker process sends them back with every page it parsed
+
+        Returns:
+            hits: dict like stats() returns
+        """
+
+        counts = self._hits.local()
+        hits = dict(counts)
+        counts.clear()
+        return hits
+
+    def merge(self, hits):
+        """Adds hits counted somewhere else, like in the worker processes of a ParsePool
+
+        Args:
+            hits (dict): dict like stats() returns
+        """
+
+        counts = self._hits.local()
+        for key, count in hits.items():
+            counts[key] = counts.get(key, 0) + count
+
+    def stats(self):
+        """Returns how often every rule gave a value and how often no rule did
+
+        Returns:
+            hits: dict like {"rating_stars:icon-alt": 20, "rating_stars:miss": 2}
+        """
+
+        merged = {}
+        for counts in self._hits.shards():
+            for key, count in dict(counts).items():
+                merged[key] = merged.get(key, 0) + count
+        return merged
+
+
+_default_spec = None
+_default_lock = threading.Lock()
+
+
+def default_rules():
+    """Returns a new rule set of the bundled spec, the file is read once per process.
+    Every scraper gets its own, so hits are counted per scraper
+
+    Returns:
+        rules: RuleSet
+    """
+
+    global _default_spec
+    with _default_lock:
+        if _default_spec is None:
+            with open(default_rules_path, encoding='utf-8') as f:
+                _default_spec = json.load(f)
+    return RuleSet(_default_spec, path=default_rules_path)
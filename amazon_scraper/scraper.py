@@ -3,53 +3,265 @@
 Module to get and parse the product info on Amazon Search
 """
 
+import os
 import re
+import json
 import time
-import random
 import uuid
+import heapq
+import queue
+import threading
+import itertools
+import zlib
+import urllib3
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor
 
-from .product import Product
+from .product import Product, ProductBatch, product_fields
+from .pipeline import Pipeline, RetryLater, StageError
+from .detail_parser import extract_details, detail_fields
+from .output import NDJSONWriter
+from .cache import get_asin
+from .dedup import AsinIndex
+from .ratelimit import RateLimiter
+from .checkpoint import pending, in_flight, done, failed
+from .metrics import Metrics, ThreadShards
+from .transport import TransportPool, ApiEndpoint, browser_headers
+from .download import BodyReader, accept_encoding, chunk_size
+from .rules import RuleSet, default_rules
+from .fingerprint import page_fingerprint
 
 
 base_url = "https://www.amazon.com"
+api_url = "https://api.scraperapi.com"
+
+# pages amazon answers with when it is throttling us
+block_markers = ("Sorry, we just need to make sure you're not a robot.", "The request could not be satisfied")
+# statuses amazon and the api gateways answer throttled requests with, retried like block pages
+throttle_statuses = (429, 503)
+# pages that are not a result page, these can say so anywhere on the page
+error_markers = ("We're sorry. The Web address you entered is not a functioning page on our site.",
+                 "Try checking your spelling or use more general terms")
+page_errors = error_markers + block_markers
+
+
+def find_marker(page_content, markers, window=None):
+    """Looks for markers in the beginning of a page, without decoding it if it is still bytes
+
+    Args:
+        page_content (str or bytes): page, decoded or as received
+        markers (iterable): strings to look for
+        window (int): characters or bytes looked at from the start of the page, the whole page if None
+
+    Returns:
+        marker or None: first marker found, None if there is none
+    """
+
+    head = page_content[:window] if window else page_content
+    for marker in markers:
+        if (marker.encode('utf-8') if isinstance(head, bytes) else marker) in head:
+            return marker
+    return None
+
+
+class ProductBuffer():
+    """ Hold the products finished by one thread, in the order they were numbered
+    """
+
+    __slots__ = ('count', 'products')
+
+    def __init__(self):
+        self.count = 0
+        self.products = []
+
+    def merged(self, other):
+        """Returns a new buffer holding the products of both buffers, still in the order they were numbered
+
+        Args:
+            other (ProductBuffer): buffer of another thread
+
+        Returns:
+            buffer: ProductBuffer
+        """
+
+        buffer = ProductBuffer()
+        buffer.count = self.count + other.count
+        buffer.products = list(heapq.merge(self.products, other.products, key=lambda item: item[0]))
+        return buffer
+
+
+def default_parser():
+    """Picks the fastest BeautifulSoup tree builder that is installed
+
+    Returns:
+        parser: "lxml" if lxml is installed, "html5lib" otherwise
+    """
+
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html5lib"
 
 
 class Scraper():
     """Does the requests with the Amazon servers
     """
 
-    def __init__(self, word):
+    def __init__(self, word, search_workers=4, listing_workers=1, detail_workers=10, parse_workers=2, queue_size=64,
+                 api_url=api_url, api_key="", parser=None, detail_fields=detail_fields,
+                 output_format='json', keep_products=True, cache=None,
+                 dedup=True, rate_limiter=None, checkpoint=None, resume=False,
+                 metrics=None, parse_pool=None, history=None, listing_only=False, transport=None,
+                 max_pages=None, max_products=None, follow_next=False, validity_window=64 * 1024, rules=None,
+                 fingerprints=None, debug_dir=None, debug_max_bytes=256 * 1024):
         """ Init of the scraper
+
+        Args:
+            word (str): word searched on amazon.com, also used to name the output file
+            search_workers (int): threads fetching search result pages
+            listing_workers (int): threads parsing search result pages
+            detail_workers (int): threads fetching product detail pages
+            parse_workers (int): threads parsing product detail pages
+            queue_size (int): maximum number of items waiting in front of each stage
+            api_url (str): scraperapi compatible endpoint the requests are sent through
+            api_key (str): key passed to the api_url endpoint
+            parser (str): BeautifulSoup tree builder for search pages ("lxml", "html.parser", "html5lib"), defaults to the fastest installed
+            detail_fields (iterable): fields read from product detail pages, any of "brand" and "description"
+            output_format (str): "ndjson" keeps the <word>.ndjson file products are streamed to,
+                "json" compacts it into a <word>.json array at the end of the search
+            keep_products (bool): also keep every product in product_obj_list, turn off to keep memory constant on large crawls
+            cache (ResponseCache): cache consulted before any page is requested, None to always go to the network
+            dedup (bool): fetch the detail page of every asin only once, products sharing an asin reuse its brand and description
+            rate_limiter (RateLimiter): paces the requests and schedules retries, a new one sized to the fetching threads by default
+            checkpoint (CheckpointStore): records every search page and product as it goes through the pipeline, None to not record
+            resume (bool): continue the crawl of word recorded in checkpoint instead of starting it over
+            metrics (Metrics): records request, parse and output timings, bytes, blocks and queue depths, a new one by default
+            parse_pool (ParsePool): worker processes search and detail pages are parsed in, None to parse on the stage threads
+            history (PriceHistory): store the price and rating changes of every product written are recorded in, None to not record
+            listing_only (bool): emit products from the search page information right away without fetching detail pages,
+                brand and description can be fetched afterwards by enrich
+            transport (TransportPool): endpoints the requests are sent through, by default a pool holding
+                the api_url endpoint on the scraper's session
+            max_pages (int): search pages crawled at most, every page by default
+            max_products (int): products emitted at most, no more search pages are fetched once they are listed
+            follow_next (bool): schedule every search page from the "next" link of the page before it instead of
+                from the page count of the first page, for searches whose pagination doesn't show the last page
+            validity_window (int): bytes at the start of a page looked at for block pages, block pages
+                stop downloading once that much is read, None to check whole pages
+            rules (str or RuleSet): extraction rules spec file or compiled rules, the bundled rules.json by default.
+                A spec file changed during the crawl is read again before the next search page is parsed
+            fingerprints (FingerprintStore): store of what was extracted from every page, pages unchanged since
+                an earlier crawl are not parsed again, None to parse every page
+            debug_dir (str): directory detail pages without a description are written to as <asin>.html, None to not write them
+            debug_max_bytes (int): bytes of a page written to debug_dir at most
         """
-        self.item_count = 1
+        # finished products are numbered by an atomic counter and kept in a buffer of the thread that finished them
+        self._numbers = itertools.count(1)
+        self._buffers = ThreadShards(ProductBuffer, ProductBuffer.merged)
         self.word = word
         self.session = requests.Session()
-        user_agents = [
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15',
-            'Mozilla/5.0 (Linux; Android 11; SM-G991B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 Mobile Safari/537.36',
-            # 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.79 Safari/537.36'
-            # Add more user agents here
-        ]
-        self.headers = {
-            'authority': 'www.amazon.com',
-            'pragma': 'no-cache',
-            'cache-control': 'no-cache',
-            'dnt': '1',
-            'upgrade-insecure-requests': '1',
-            'user-agent': random.choice(user_agents),
-            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-            'sec-fetch-site': 'none',
-            'sec-fetch-mode': 'navigate',
-            'sec-fetch-dest': 'document',
-            'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
-        }
-        self.product_obj_list = []
+        # one kept-alive connection per fetching thread
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=search_workers + detail_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = accept_encoding
+        self.headers = browser_headers()
         self.page_list = []
+        self.search_workers = search_workers
+        self.listing_workers = listing_workers
+        self.detail_workers = detail_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.api_url = api_url
+        self.api_key = api_key
+        self.parser = parser or default_parser()
+        self.detail_fields = tuple(detail_fields)
+        self.output_format = output_format
+        self.keep_products = keep_products
+        self.output = None
+        self.cache = cache
+        self.asin_index = AsinIndex() if dedup else None
+        self.rate_limiter = rate_limiter or RateLimiter(concurrency=search_workers + detail_workers,
+                                                        max_concurrency=search_workers + detail_workers)
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.metrics = metrics or Metrics()
+        self.parse_pool = parse_pool
+        self.history = history
+        self.listing_only = listing_only
+        self.transport = transport or TransportPool(
+            [ApiEndpoint(api_url, api_key, session=self.session, max_concurrency=search_workers + detail_workers)])
+        # the limits created here are sized to the fetching threads, scale_requests raises them for more threads
+        self.connections = search_workers + detail_workers
+        self._own_limits = (None if rate_limiter else self.rate_limiter, None if transport else self.transport)
+        for endpoint in self.transport.endpoints:
+            self.metrics.gauge('endpoint_health', endpoint.score, endpoint=endpoint.name)
+        if parse_pool is not None:
+            # stage threads only wait on the pool, enough of them keep every worker process busy
+            self.listing_workers = max(listing_workers, parse_pool.workers)
+            self.parse_workers = max(parse_workers, parse_pool.workers)
+        # read lazily, so the gauges follow a rate limiter swapped in later
+        self.metrics.gauge('rate_limit_rate', lambda: self.rate_limiter.rate)
+        self.metrics.gauge('rate_limit_concurrency', lambda: int(self.rate_limiter.concurrency))
+        self.metrics.gauge('requests_in_flight', lambda: self.rate_limiter.in_flight)
+        self.max_pages = max_pages
+        self.max_products = max_products
+        self.follow_next = follow_next
+        self.validity_window = validity_window
+        if rules is None:
+            self.rules = default_rules()
+        else:
+            self.rules = rules if isinstance(rules, RuleSet) else RuleSet.from_file(rules)
+        self.fingerprints = fingerprints
+        self.debug_dir = debug_dir
+        self.debug_max_bytes = debug_max_bytes
+        # search pages are scheduled while the first ones are parsed, from the listing stage
+        self.search_url = None
+        self.pipeline = None
+        self._page_lock = threading.Lock()
+        self._scheduled = set()
+        self.listed = 0
+        self.stopped = False
+        # set while an interrupted crawl is continued
+        self.resuming = False
+        # if a page does not get a valid response it is tried 5 times, waits in between are given by the rate limiter
+        self.max_retries = 5
+
+    @property
+    def product_obj_list(self):
+        """Products kept so far, merged from the buffers of every thread in the order they were finished
+        """
+
+        buffers = [buffer.products[:] for buffer in self._buffers.shards()]
+        return [product_obj for _, product_obj in heapq.merge(*buffers, key=lambda item: item[0])]
+
+    @property
+    def item_count(self):
+        """Number the next finished product gets
+        """
+
+        return sum(buffer.count for buffer in self._buffers.shards()) + 1
+
+    def keep_product(self, product_obj):
+        """Numbers a finished product and keeps it in the buffer of the calling thread if keep_products is on,
+        no lock is taken
+
+        Args:
+            product_obj (Product): finished product
+
+        Returns:
+            number: number of the product in the order products were finished
+        """
+
+        number = next(self._numbers)
+        buffer = self._buffers.local()
+        buffer.count += 1
+        if self.keep_products:
+            buffer.products.append((number, product_obj))
+        return number
 
     def prepare_url(self, search_word):
         """Get the Amazon search URL, based on the keywords passed
@@ -62,11 +274,23 @@ class Scraper():
         """
         return urljoin(base_url, ("/s?k=%s" % (search_word.replace(' ', '+'))))
 
-    def get_request(self, url):
+    def prepare_product_url(self, asin):
+        """Get the canonical url of a product detail page, the same for sponsored, redirected and organic listings
+
+        Args:
+            asin (str): Amazon Standard Identification Number of the product
+
+        Returns:
+            product url: url of the detail page (it will look something like https://www.amazon.com/dp/B0823RVHBT)
+        """
+        return urljoin(base_url, "/dp/%s" % asin)
+
+    def get_request(self, url, headers=None):
         """ Places GET request with the proper headers
 
         Args:
             url (str): Url where the get request will be placed
+            headers (dict): extra headers sent along, forwarded to amazon by the api endpoint
 
         Raises:
             requests.exceptions.ConnectionError: Raised when there is no internet connection while placing GET request
@@ -77,372 +301,369 @@ class Scraper():
             response or None: returns whatever response was sent back by the server or returns None if requests.exceptions.ConnectionError occurs
         """
         try:
+            # the transport picks the endpoint: a scraperapi compatible gateway (www.scraperapi.com), a proxy
+            # or amazon itself, see DirectEndpoint
+            self.rate_limiter.acquire()
+            try:
+                with self.metrics.timer('request_seconds'):
+                    response = self.transport.get(url, headers=headers, read=self.read_body)
+            finally:
+                self.rate_limiter.release()
+            self.metrics.inc('requests')
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.ContentDecodingError, requests.HTTPError) as e:
+            self.metrics.inc('request_errors')
+            print(str(e) + " while connecting to " + url)
+            return None
 
-            # if using scraperapi: www.scraperapi.com 
-
-            API_KEY = ""
-            payload = {"api_key": API_KEY, "url": url}
-            response = requests.get("https://api.scraperapi.com", params=payload)
-            
+        if not response:
+            self.metrics.inc('request_errors')
+        return response
 
-            # If not using scraperapi
+    def read_body(self, response):
+        """Reads the streamed body of a response and decompresses it, a block page stops the download
+        once its first validity_window bytes are read. Bytes on the wire and after decompression are counted
 
-            # time.sleep(random.randint(1, 15))
-            # response = self.session.get(url, headers=self.headers)
-            # if response.status_code != 200:
-            #     raise requests.HTTPError(
-            #         f"Error occured, status code: {response.status_code}")
+        Args:
+            response (requests.Response): response whose body is not read yet
 
+        Raises:
+            requests.exceptions.ConnectionError: raised when the connection breaks while reading
 
-        except (requests.exceptions.ConnectionError, requests.HTTPError) as e:
-            print(str(e) + " while connecting to " + url)
-            return None
+            requests.exceptions.ContentDecodingError: raised when the body can not be decompressed
+        """
 
-        return response
+        try:
+            reader = BodyReader(response.headers.get('Content-Encoding'), self.validity_window, self.is_blocked_page)
+            for chunk in response.raw.stream(chunk_size, decode_content=False):
+                if not reader.feed(chunk):
+                    break
+            body = reader.finish()
+        except (ValueError, zlib.error) as e:
+            response.close()
+            raise requests.exceptions.ContentDecodingError(e)
+        except urllib3.exceptions.HTTPError as e:
+            response.close()
+            raise requests.exceptions.ConnectionError(e)
+        if reader.aborted:
+            # the rest of the block page is never downloaded, its connection is dropped
+            response.close()
+            self.metrics.inc('downloads_aborted')
+        # read like requests does, response.content and response.text give the decompressed body
+        response._content = body
+        response._content_consumed = True
+        self.metrics.inc('bytes_transferred', reader.transferred)
+        self.metrics.inc('bytes_fetched', reader.size)
 
     def check_page_validity(self, page_content):
-        """Check if the page is a valid result page
+        """Check if the page is a valid result page, block pages are looked for in its first validity_window bytes
+        and the other error pages in the whole page
+
+        Args:
+            page_content (str or bytes): page, decoded or as received
 
         Returns:
             valid_page: returns true for valid page and false for invalid page(in accordance with conditions)
         """
 
-        if "We're sorry. The Web address you entered is not a functioning page on our site." in page_content:
-            valid_page = False
-            print("Amazon: We're sorry. The Web address you entered is not a functioning page on our site.")
-        elif "Try checking your spelling or use more general terms" in page_content:
-            valid_page = False
-            print("Amazon: Try checking your spelling or use more general terms")
-        elif "Sorry, we just need to make sure you're not a robot." in page_content:
-            valid_page = False
-            print("Amazon: Sorry, we just need to make sure you're not a robot.")
-        elif "The request could not be satisfied" in page_content:
-            valid_page = False
-            print("Amazon: The request could not be satisfied")
-        else:
-            valid_page = True
-        return valid_page
+        marker = find_marker(page_content, block_markers, self.validity_window) or find_marker(page_content, error_markers)
+        if marker is not None:
+            print("Amazon: " + marker)
+        return marker is None
 
-    def get_page_content(self, search_url):
-        """Retrieve the html content at search_url
+    def is_blocked_page(self, page_content):
+        """Check if the page is one of the pages amazon sends when it throttles requests
 
         Args:
-            search_url (str): Url where the get request will be placed
-
-        Raises:
-            ValueError: raised if no valid page is found
+            page_content (str or bytes): page, decoded or as received
 
         Returns:
-            response.text or None: returns html response encoded in unicode or returns None if get_requests function or if the page is not valid even after retries
+            blocked: returns true for robot check and request could not be satisfied pages
         """
 
-        valid_page = True
-        trial = 0
-        # if a page does not get a valid response it retries(5 times)
-        max_retries = 5
-        while (trial < max_retries):
+        return find_marker(page_content, block_markers, self.validity_window) is not None
 
-            response = self.get_request(search_url)
+    def accept_page(self, search_url, page_content, headers=None, endpoint=None, encoding=None):
+        """Checks a downloaded page, feeds the outcome to the rate limiter and stores valid pages in the cache.
+        Pages received as bytes are checked before they are decoded, invalid pages are never decoded
 
-            if (not response):
-                return None
+        Args:
+            search_url (str): Url the page was downloaded from
+            page_content (str or bytes): unicode encoded response or its body as received
+            headers (dict): response headers, kept by the cache for revalidation
+            endpoint (Endpoint): endpoint of the transport the page came through, its health is updated
+            encoding (str): charset of a page received as bytes, utf-8 if None
 
-            valid_page = self.check_page_validity(response.text)
+        Raises:
+            RetryLater: raised if the page is not valid and retries are left, with the backoff to wait before the next try
 
-            if valid_page:
-                break
+        Returns:
+            page_content or None: returns the page if valid or None if the page is not valid even after retries
+        """
 
-            print("No valid page was found, retrying in 30 seconds...")
-            time.sleep(30)
-            trial += 1
+        with self.metrics.timer('validity_check_seconds'):
+            valid_page = self.check_page_validity(page_content)
+            blocked = self.is_blocked_page(page_content)
+        self.rate_limiter.record(blocked)
+        if endpoint is not None:
+            self.transport.record_block(endpoint, blocked)
 
         if not valid_page:
-            print(
-                "Even after retrying, no valid page was found on this thread, terminating thread...")
-            self.generate_output_file()
-            return None
+            self.metrics.inc('pages_blocked' if blocked else 'pages_invalid')
+            return self.retry_page(search_url)
 
-        return response.text
+        self.rate_limiter.reset(search_url)
+        if isinstance(page_content, bytes):
+            page_content = page_content.decode(encoding or 'utf-8', errors='replace')
+        if self.cache is not None:
+            self.cache.put(search_url, page_content, headers)
+        return page_content
 
-    def get_product_url(self, product):
-        """Retrieves and returns product url
+    def retry_page(self, search_url):
+        """Schedules another try of a url no valid page came back from, until max_retries is reached
 
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
+            search_url (str): Url the page was downloaded from
+
+        Raises:
+            RetryLater: raised if retries are left, with the backoff to wait before the next try
 
         Returns:
-            url: returns full url of product
+            None: once no retries are left
         """
 
-        # regexp = "a-link-normal a-text-normal".replace(' ', '\s+')
-        regexp = "a-link-normal s-underline-text s-underline-link-text s-link-style a-text-normal".replace(' ', '\s+')
-        classes = re.compile(regexp)
-        product_url = product.find('a', attrs={'class': classes}).get('href')
-        return base_url + product_url
+        if self.rate_limiter.attempts(search_url) + 1 < self.max_retries:
+            self.metrics.inc('retries')
+            delay = self.rate_limiter.backoff(search_url)
+            print(f"No valid page was found, retrying in {delay:.0f} seconds...")
+            raise RetryLater(delay)
+        self.rate_limiter.reset(search_url)
+        self.metrics.inc('pages_given_up')
+        print("Even after retrying, no valid page was found at " + search_url)
+        return None
 
-    def get_product_asin(self, product):
-        """ Retrieves and returns Amazon Standard Identification Number (asin) of a product
+    def try_page_content(self, search_url):
+        """Retrieve the html content at search_url with a single request, from the cache if it holds a fresh copy.
+        A stale copy is revalidated with a conditional request and reused if the server answers 304
 
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
-
-        Returns:
-            asin: returns Amazon Standard Identification Number (asin) of a product
-        """
-
-        return product.get('data-asin')
+            search_url (str): Url where the get request will be placed
 
-    def get_brand_and_description(self, url):
-        """Retrieves and returns brand, description
-        Args:
-            product (str): higher level html tags of a product containing all the information about a product
+        Raises:
+            RetryLater: raised if the page is not valid or the request was throttled, and retries are left
 
         Returns:
-            title: returns brand, description or empty string if they aren't found
+            response.text or None: returns html response encoded in unicode or returns None if get_requests function or if the page is not valid even after retries
         """
-        try:
-            # time.sleep(15)
-            page_content = self.get_page_content(url)
-            if not page_content:
-                return '', ''
-            soup = BeautifulSoup(page_content, "html5lib")
-            
-            # Get brand
-            brand_row = soup.find('tr', class_='po-brand')
-            if brand_row:
-                brand = brand_row.find_all('td')[1].find('span').text.strip()
-            else:
-                brand_link = soup.find('a', id='bylineInfo')
-                if brand_link:
-                    brand_text = brand_link.get_text()
-                    # Split the text to get the brand name
-                    brand = brand_text.split(': ')[1] if ': ' in brand_text else brand_text
-                else:
-                    brand = ''
-            
-            # Get description
-            about_section = soup.find(re.compile(r'^h[1-6]$'), text=re.compile(r"About\s+this\s+item"))
 
-            if about_section:
-                parent_div = about_section.find_parent('div')
-                feature_items = parent_div.find_all('li')
-                description = [li.get_text(strip=True) for li in feature_items]
+        entry = self.cache.get(search_url) if self.cache is not None else None
+        if entry is not None and entry.fresh:
+            return entry.body
+        validators = entry.validators() if entry is not None else None
+
+        response = self.get_request(search_url, headers=validators)
+        if response is not None and response.status_code in throttle_statuses:
+            # throttled, the transport counted the failure of the endpoint already
+            print(f"Amazon: status {response.status_code}")
+            self.rate_limiter.record(True)
+            self.metrics.inc('pages_blocked')
+            return self.retry_page(search_url)
+        if (not response):
+            return None
 
-            else:
-                feature_bullets = soup.find('div', id='feature-bullets')
-                if feature_bullets:
-                    # Extract all list items from the feature bullets section
-                    description = [li.get_text(strip=True) for li in feature_bullets.find_all('li')]
-                else:
-                    description = []
+        if response.status_code == 304 and entry is not None:
+            if getattr(response, 'endpoint', None) is not None:
+                self.transport.record_block(response.endpoint, False)
+            self.cache.refresh(search_url)
+            return entry.body
 
-            if not description:
-                # print(url)
-                with open("product_page.html", "w", encoding="utf-8") as file:
-                    file.write(str(soup.prettify()))  # Prettify makes the HTML easier to read
-                    file.write("\n\n")
+        return self.accept_page(search_url, response.content, response.headers, getattr(response, 'endpoint', None),
+                                response.encoding)
 
-            return brand, '\n'.join(description)
+    def get_page_content(self, search_url):
+        """Retrieve the html content at search_url, retries invalid pages on this thread after the rate limiter's backoff.
+        Pipeline stages use try_page_content instead so waiting for a retry doesn't hold a worker
 
-            # with open("product_page.html", "w", encoding="utf-8") as file:
-            #     file.write(str(soup.prettify()))  # Prettify makes the HTML easier to read
-            #     file.write("\n\n")
-            
-            # brand_label = product.find('span', text="Brand")
-
-            # # Once 'Brand' is found, locate the next 'span' with class 'a-text-bold' that contains the actual brand
-            # brand = brand_label.find_next('span', class_='a-text-bold')
-            # return brand.text.strip()
-        
-        except AttributeError:
-            """AttributeError occurs when no brand is found and we get back None
-            in that case when we try to do title.text it raises AttributeError
-            because Nonetype object does not have text attribute"""
-            return ''
-        
-    def get_product_title(self, product):
-        """Retrieves and returns product title
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
+            search_url (str): Url where the get request will be placed
 
         Returns:
-            title: returns product title or empty string if no title is found
+            response.text or None: returns html response encoded in unicode or returns None if get_requests function or if the page is not valid even after retries
         """
 
-        regexp = "a-color-base a-text-normal".replace(' ', '\s+')
-        classes = re.compile(regexp)
-        try:
-            title = product.find('span', attrs={'class': classes})
-            return title.text.strip()
+        while True:
+            try:
+                return self.try_page_content(search_url)
+            except RetryLater as retry:
+                time.sleep(retry.delay)
 
-        except AttributeError:
-            """AttributeError occurs when no title is found and we get back None
-            in that case when we try to do title.text it raises AttributeError
-            because Nonetype object does not have text attribute"""
-            return ''
+    def get_product_asin(self, product):
+        """ Retrieves and returns Amazon Standard Identification Number (asin) of a product
 
-    def get_product_price(self, product):
-        """Retrieves and returns product price
         Args:
             product (str): higher level html tags of a product containing all the information about a product
 
         Returns:
-            price: returns product price or None if no price is found
+            asin: returns Amazon Standard Identification Number (asin) of a product
         """
 
-        try:
-            price = product.find('span', attrs={'class': 'a-offscreen'})
-            return float(price.text.strip('$').replace(',', ''))
-
-        except (AttributeError, ValueError):
-            """AttributeError occurs when no price is found and we get back None
-            in that case when we try to do price.text it raises AttributeError
-            because Nonetype object does not have text attribute"""
-
-            """ValueError is raised while converting price.text.strip() into float
-            of that value and that value for some reason is not convertible to
-            float"""
-
-            return None
-
-    def get_product_image_url(self, product):
-        """Retrieves and returns product image url
+        return product.get('data-asin')
 
+    def get_brand_and_description(self, url):
+        """Retrieves and returns brand, description
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
+            url (str): url of the product detail page
 
         Returns:
-            image_url: returns product image url
+            title: returns brand, description or empty strings if they aren't found
         """
 
-        image_tag = product.find('img')
-        return image_tag.get('src')
+        # time.sleep(15)
+        page_content = self.get_page_content(url)
+        if not page_content:
+            return '', ''
+        return self.parse_brand_and_description(page_content, asin=get_asin(url))
 
-    def get_product_rating(self, product):
-        """Retrieves and returns product rating
+    def parse_brand_and_description(self, page_content, asin=None):
+        """Extracts brand, description from an already fetched product detail page,
+        only the fields in self.detail_fields are looked for and the rest of the page is never tokenized
 
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
+            page_content (str): unicode encoded response of the product detail page
+            asin (str): asin of the product, names the debug dump of a page without a description
 
         Returns:
-            rating : returns product rating or returns None if no rating is found
+            title: returns brand, description or empty strings if they aren't found
         """
 
-        try:
-            rating = re.search(r'(\d.\d) out of 5', str(product))
-            return float(rating.group(1))
+        key, details = self.lookup_page('detail', page_content, f"{self.rules.version}:{','.join(self.detail_fields)}")
+        if details is None:
+            with self.metrics.timer('parse_seconds', stage='detail'):
+                if self.parse_pool is not None:
+                    details = self.parse_pool.details(page_content, self.detail_fields, self.rules)
+                else:
+                    details = extract_details(page_content, self.detail_fields, self.rules)
+            self.remember_page(key, 'detail', details)
+        brand = details.get('brand', '')
+        description = details.get('description', [])
 
-        except (AttributeError, ValueError):
-            """AttributeError occurs when no rating is found and we get back None
-            in that case when we try to do rating.text it raises AttributeError
-            because Nonetype object does not have text attribute"""
+        if not description and 'description' in self.detail_fields:
+            self.dump_page(asin, page_content)
 
-            """ValueError is raised while converting rating.group(1) into float
-            of that value and that value for some reason is not convertible to
-            float"""
+        return brand, '\n'.join(description)
 
-            return None
+    def dump_page(self, name, page_content):
+        """Writes the first debug_max_bytes of a page to <debug_dir>/<name>.html to look at why it could not be parsed,
+        does nothing unless debug_dir is set. Every page gets its own file, written whole or not at all
 
-    def get_product_review_count(self, product):
-        """Retrieves and returns number of reviews a product has
+        Args:
+            name (str): name of the file, like the asin of the product, a random name if None
+            page_content (str): unicode encoded page
+        """
+
+        if self.debug_dir is None:
+            return
+        os.makedirs(self.debug_dir, exist_ok=True)
+        name = re.sub(r'[^\w.-]', '_', name) if name else uuid.uuid4().hex
+        path = os.path.join(self.debug_dir, name + '.html')
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(page_content.encode('utf-8')[:self.debug_max_bytes])
+        os.replace(temp_path, path)
+
+    def get_listing_info(self, product):
+        """Gathers the information about a product available on the search page
+        and packs it into an object of class Product, brand and description are left empty.
+        Every field is read by the rules in self.rules during a single walk over the product tags
 
         Args:
             product (str): higher level html tags of a product containing all the information about a product
 
         Returns:
-            review count: returns number of reviews a product has or returns None if no reviews are available
+            product_obj: Product filled with the search page information
         """
 
-        try:
-            reviews_match = re.search(r'(\d+)\s+ratings', str(product))
-    
-            if reviews_match:
-                return int(reviews_match.group(1).strip().replace(',', ''))
-            return None
+        product_obj = Product(asin=product.get('data-asin'), rating_stars=None)
+        for field, value in self.rules.extract(product).items():
+            setattr(product_obj, field, value)
+        return product_obj
 
-        except (AttributeError, ValueError):
-            """AttributeError occurs when no review_count is found and we get back None
-            in that case when we try to do review_count.text it raises AttributeError
-            because Nonetype object does not have text attribute"""
+    def load_rules(self, rules=None):
+        """Swaps in new extraction rules, products parsed from then on use them
 
-            """ValueError is raised while converting review_count.text.strip() into
-            int of that value and that value for some reason is not convertible to
-            int"""
+        Args:
+            rules (str or RuleSet): spec file or compiled rules, the file of the current rules read again if None
+        """
 
-            return None
+        if not isinstance(rules, RuleSet):
+            rules = RuleSet.from_file(rules or self.rules.path)
+        # a single assignment, threads parsing a page meanwhile finish it with the rules they started with
+        self.rules = rules
+        print(f"Loaded extraction rules from {rules.path}")
 
-    def get_product_bestseller_status(self, product):
-        """Retrieves and returns if product is best-seller or not
+    def refresh_rules(self):
+        """Reads the spec file of the rules again if it changed, a broken file keeps the current rules
+        """
+
+        try:
+            if self.rules.changed():
+                self.load_rules()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"{type(e).__name__}: {e} while reading the extraction rules, the current rules are kept")
+            # not tried again until the file changes once more
+            self.rules.mtime = os.path.getmtime(self.rules.path) if os.path.exists(self.rules.path) else None
+
+    def get_product_info(self, product):
+        """Gathers all the information about a product and 
+        packs it all into an object of class Product
+        and appends it to list of Product objects
 
         Args:
             product (str): higher level html tags of a product containing all the information about a product
-
-        Returns:
-            bestseller_status: returns if product is best-seller or not
         """
 
-        try:
-            bestseller_status = product.find(
-                'span', attrs={'class': 'a-badge-text'})
-            return bestseller_status.text.strip() == 'Best Seller'
+        product_obj = self.get_listing_info(product)
+        product_obj.brand, product_obj.description = self.get_brand_and_description(product_obj.url)
+        self.keep_product(product_obj)
 
-        except AttributeError:
-            """AttributeError occurs when no bestseller_status is found and we get back None
-            in that case when we try to do bestseller_status.text it raises AttributeError
-            because Nonetype object does not have text attribute
-            """
-            return False
-
-    def get_product_prime_status(self, product):
-        """Retrieves and returns if product is supported by Amazon prime
+    def make_soup(self, page_content):
+        """Parses a page with the configured tree builder, pages which are already parsed are returned as is
 
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
+            page_content (str or BeautifulSoup): unicode encoded response
 
         Returns:
-            prime_status: eturns if product is supported by Amazon prime
+            soup: BeautifulSoup of the page
         """
 
-        regexp = "a-icon a-icon-prime a-icon-medium".replace(' ', '\s+')
-        classes = re.compile(regexp)
-        prime_status = product.find('i', attrs={'class': classes})
-        return bool(prime_status)
+        if isinstance(page_content, BeautifulSoup):
+            return page_content
+        return BeautifulSoup(page_content, self.parser)
 
-    def get_product_info(self, product):
-        """Gathers all the information about a product and 
-        packs it all into an object of class Product
-        and appends it to list of Product objects
+    def get_product_tags(self, page_content):
+        """Finds the higher level html tags of every product on a search page
 
         Args:
-            product (str): higher level html tags of a product containing all the information about a product
-        """
+            page_content (str or BeautifulSoup): unicode encoded response or its already parsed soup
 
-        product_obj = Product()
-        prod_url = self.get_product_url(product)
-        product_obj.url = prod_url
-        product_obj.asin = self.get_product_asin(product)
-        product_obj.title = self.get_product_title(product)
-        product_obj.brand, product_obj.description = self.get_brand_and_description(prod_url)
-        product_obj.price = self.get_product_price(product)
-        product_obj.img_url = self.get_product_image_url(product)
-        product_obj.rating_stars = self.get_product_rating(product)
-        product_obj.review_count = self.get_product_review_count(product)
-        product_obj.bestseller = self.get_product_bestseller_status(product)
-        product_obj.prime = self.get_product_prime_status(product)
+        Returns:
+            product_list: list of the product tags
+        """
 
-        self.product_obj_list.append(product_obj)
+        soup = self.make_soup(page_content)
+        return soup.find_all(self.rules.container_tag, attrs=self.rules.container_attrs)
 
     def get_page_count(self, page_content):
         """Extracts number of pages present while searching for user-specified word
 
         Args:
-            page_content (str): unicode encoded response
+            page_content (str or BeautifulSoup): unicode encoded response or its already parsed soup
 
         Returns:
             page count: returns number of search pages for user-specified word if IndexError is raised then function returns 1
         """
 
-        soup = BeautifulSoup(page_content, 'html5lib')
+        soup = self.make_soup(page_content)
         try:
             # pagination = soup.find_all(
             #     'li', attrs={'class': ['a-normal', 'a-disabled', 'a-last']})
@@ -464,6 +685,116 @@ class Scraper():
         except IndexError:
             return 1
 
+    def get_next_page_url(self, page_content):
+        """Extracts the url of the "next" link of the pagination
+
+        Args:
+            page_content (str or BeautifulSoup): unicode encoded response or its already parsed soup
+
+        Returns:
+            url or None: full url of the next search page, None on the last page
+        """
+
+        soup = self.make_soup(page_content)
+        link = soup.find('a', class_='s-pagination-next')
+        if link is None or not link.get('href'):
+            return None
+        return urljoin(base_url, link.get('href'))
+
+    def read_pagination(self, page_content):
+        """Reads what following_pages needs from the pagination of a search page: the url of the "next" link
+        if follow_next is on, the page count otherwise
+
+        Args:
+            page_content (str or BeautifulSoup): unicode encoded response or its already parsed soup
+
+        Returns:
+            pagination: dict with next_url or page_count
+        """
+
+        if self.follow_next:
+            return {'next_url': self.get_next_page_url(page_content)}
+        return {'page_count': self.get_page_count(page_content)}
+
+    def following_pages(self, page_url, pagination):
+        """Finds the search pages to fetch after a search page: the other pages of the page count of the first page,
+        or the page behind the "next" link if follow_next is on
+
+        Args:
+            page_url (str): url of the search page
+            pagination (dict): pagination of the search page read by read_pagination
+
+        Returns:
+            page urls: urls of the pages not scheduled yet, within max_pages
+        """
+
+        if self.follow_next:
+            next_url = pagination.get('next_url')
+            return self.claim_pages([next_url] if next_url else [])
+        if page_url != self.search_url:
+            return []
+        self.page_count = pagination['page_count']
+        if self.page_count > 1:
+            print(f"Processing {self.page_count} pages")
+        self.page_list = []
+        self.prepare_page_list(page_url)
+        # page 1 is the page that was just parsed
+        return self.claim_pages(self.page_list[1:])
+
+    def claim_pages(self, page_urls):
+        """Takes the search pages that were not scheduled yet, up to max_pages, and records them in the checkpoint
+
+        Args:
+            page_urls (list): urls of search pages
+
+        Returns:
+            page urls: urls of the pages to fetch
+        """
+
+        with self._page_lock:
+            claimed = []
+            for url in page_urls:
+                if self.stopped or (self.max_pages is not None and len(self._scheduled) >= self.max_pages):
+                    break
+                if url not in self._scheduled:
+                    self._scheduled.add(url)
+                    claimed.append(url)
+        if self.checkpoint is not None and claimed:
+            # pages recorded by an interrupted crawl are already done or queued by resume
+            added = self.checkpoint.add(self.word, 'search', [(url, None) for url in claimed])
+            claimed = [url for url in claimed if url in added]
+        return claimed
+
+    def schedule_page(self, page_url):
+        """Hands a search page to the search stage without blocking the listing stage it is called from
+
+        Args:
+            page_url (str): url of the search page
+        """
+
+        print('processing page ', page_url)
+        self.pipeline.submit_later('search', page_url, 0)
+
+    def take_products(self, products):
+        """Keeps the products of a search page that fit in max_products, the crawl stops once it is reached
+
+        Args:
+            products (list): products of one search page
+
+        Returns:
+            products: the products to emit
+        """
+
+        if self.max_products is None:
+            return products
+        with self._page_lock:
+            products = products[:max(0, self.max_products - self.listed)]
+            self.listed += len(products)
+            if self.listed >= self.max_products and not self.stopped:
+                self.stopped = True
+                print(f"Reached {self.max_products} products, no more search pages are fetched")
+        return products
+
     def prepare_page_list(self, search_url):
         """prepares a url for every page and appends it to page_list in accordance with the page count
 
@@ -478,18 +809,15 @@ class Scraper():
         """extracts higher level html tags for each product present while scraping all the pages in page_list
 
         Args:
-            page_content (str): unicode encoded response
+            page_content (str or BeautifulSoup): unicode encoded response or its already parsed soup
 
         """
 
-        soup = BeautifulSoup(page_content, "html5lib")
-        product_list = soup.find_all(
-            'div', attrs={'data-component-type': 's-search-result'})
-        
+        product_list = self.get_product_tags(page_content)
+
         for product in product_list:
             print(f"scraping product {self.item_count}")
             self.get_product_info(product)
-            self.item_count += 1
         # product = product_list[0]
         # self.get_product_info(product)
         # with open("product_list.html", "w", encoding="utf-8") as file:
@@ -526,6 +854,317 @@ class Scraper():
         with open('./' + filename, mode='w') as f:
             f.write(json_data)
 
+    def open_output(self, append=False):
+        """Starts streaming products to <word>.ndjson
+
+        Args:
+            append (bool): keep the products already in the file, used when a crawl is resumed
+        """
+
+        if self.output is not None:
+            return
+        path = './' + self.word + '.ndjson'
+        if append and not os.path.exists(path) and os.path.exists('./' + self.word + '.json'):
+            # the interrupted crawl was compacted already, its products go back into the file that is appended to
+            with open('./' + self.word + '.json', encoding='utf-8') as src, open(path, mode='w', encoding='utf-8') as dst:
+                for record in json.load(src):
+                    dst.write(json.dumps(record) + '\n')
+        self.output = self.output_writer(path)
+        self.output.start(append=append)
+
+    def output_writer(self, path):
+        """Creates the writer of an output file, the products it writes are done in the checkpoint and recorded in the history
+
+        Args:
+            path (str): NDJSON file to write
+
+        Returns:
+            writer: NDJSONWriter, not started yet
+        """
+
+        on_flush = self.output_flushed if self.checkpoint is not None or self.history is not None else None
+        return NDJSONWriter(path, on_flush=on_flush, metrics=self.metrics)
+
+    def close_output(self):
+        """Writes the products still queued, and compacts the NDJSON file into <word>.json if output_format is "json"
+        """
+
+        if self.output is None:
+            return
+        self.output.close()
+        if self.output_format == 'json':
+            self.output.compact('./' + self.word + '.json')
+        self.output = None
+
+    def checkpoint_mark(self, kind, key, state):
+        """Records the state of a search page or product in the checkpoint, does nothing without one
+
+        Args:
+            kind (str): "search" or "detail"
+            key (str): url of the search page or listing url of the product
+            state (str): one of pending, in_flight, done, failed
+        """
+
+        if self.checkpoint is not None and key:
+            self.checkpoint.mark(self.word, kind, key, state)
+
+    def output_flushed(self, products):
+        """Called by the output writer, products are done in the checkpoint once they are on disk so an interruption
+        never loses a product the checkpoint says is done, and their prices and ratings go to the history store
+
+        Args:
+            products (list): products just written to the output file
+        """
+
+        if self.checkpoint is not None:
+            # products whose detail page failed stay failed
+            self.checkpoint.mark_many(self.word, 'detail', [p.url for p in products], done, current=in_flight)
+        if self.history is not None:
+            self.history.record(products, keyword=self.word)
+
+    def fetch_search_page(self, page_url):
+        """pipeline stage: fetches one search page
+
+        Args:
+            page_url (str): url of one of search pages
+        """
+
+        if self.stopped:
+            return
+        self.checkpoint_mark('search', page_url, in_flight)
+        page_content = self.try_page_content(page_url)
+        if page_content:
+            yield page_url, page_content
+        else:
+            self.checkpoint_mark('search', page_url, failed)
+
+    def parse_search_page(self, item):
+        """pipeline stage: extracts search page information of every product on a search page
+
+        Args:
+            item (tuple): url of the search page and the unicode encoded response or its already parsed soup
+        """
+
+        page_url, page_content = item
+        self.refresh_rules()
+        paginate = bool(page_url) and (self.follow_next or page_url == self.search_url)
+        pages = ('next' if self.follow_next else 'count') if paginate else ''
+        key, known = self.lookup_page('search', page_content, f"{self.rules.version}:{self.parser}:{pages}")
+        if known is not None:
+            # unchanged since an earlier crawl, neither the pagination nor the products are parsed
+            if paginate:
+                for url in self.following_pages(page_url, known):
+                    self.schedule_page(url)
+            products = [Product(*record) for record in known['products']]
+        else:
+            if self.parse_pool is not None and isinstance(page_content, str):
+                # the worker process reads the pagination along with the products, the page is parsed there once
+                with self.metrics.timer('parse_seconds', stage='listing'):
+                    products, pagination = self.parse_pool.search_page(page_content, pages, self.rules)
+                if paginate:
+                    for url in self.following_pages(page_url, pagination):
+                        self.schedule_page(url)
+            else:
+                pagination = {}
+                if paginate:
+                    # the pages after this one are scheduled before its products are extracted,
+                    # the soup is parsed once for both
+                    with self.metrics.timer('parse_seconds', stage='page_count'):
+                        page_content = self.make_soup(page_content)
+                        pagination = self.read_pagination(page_content)
+                        page_urls = self.following_pages(page_url, pagination)
+                    for url in page_urls:
+                        self.schedule_page(url)
+                with self.metrics.timer('parse_seconds', stage='listing'):
+                    products = [self.get_listing_info(product) for product in self.get_product_tags(page_content)]
+            records = [[getattr(product_obj, field) for field in product_fields] for product_obj in products]
+            self.remember_page(key, 'search', dict(pagination, products=records))
+        products = self.take_products(products)
+        if self.checkpoint is not None and page_url:
+            # products are recorded before the page is done, an interrupted crawl finds them on resume
+            # listing-only products go straight to the output, they are in flight until written
+            added = self.checkpoint.add(self.word, 'detail', [(p.url, p.to_json()) for p in products],
+                                        state=in_flight if self.listing_only else pending)
+            self.checkpoint_mark('search', page_url, done)
+            if self.resuming:
+                # products recorded by the interrupted crawl are either done or queued by resume already
+                products = [p for p in products if p.url in added]
+        yield from products
+
+    def lookup_page(self, kind, page_content, salt=''):
+        """Fingerprints a page and looks up what an earlier crawl extracted from it, does nothing without a fingerprint store
+
+        Args:
+            kind (str): "search" or "detail"
+            page_content (str or BeautifulSoup): unicode encoded page, pages that are already parsed are not fingerprinted
+            salt (str): identifies how the fields are extracted, like the version of the rules
+
+        Returns:
+            key, fields: fingerprint of the page and the fields stored for it,
+            fields is None if the page was not seen before and both are None without a store
+        """
+
+        if self.fingerprints is None or not isinstance(page_content, str):
+            return None, None
+        with self.metrics.timer('parse_seconds', stage='fingerprint'):
+            key = page_fingerprint(page_content, kind, salt)
+        fields = self.fingerprints.get(key)
+        if fields is not None:
+            self.metrics.inc('pages_unchanged', stage=kind)
+        return key, fields
+
+    def remember_page(self, key, kind, fields):
+        """Stores what was extracted from a page under its fingerprint, does nothing without a fingerprint
+
+        Args:
+            key (str): fingerprint returned by lookup_page
+            kind (str): "search" or "detail"
+            fields (dict): json serializable fields extracted from the page
+        """
+
+        if key is not None:
+            self.fingerprints.put(key, kind, fields)
+
+    def fetch_detail_page(self, product_obj):
+        """pipeline stage: fetches the detail page of a product, once per asin if deduplication is on.
+        Products whose asin is already being fetched are handed on by parse_detail_page of that fetch
+
+        Args:
+            product_obj (Product): product filled by get_listing_info
+        """
+
+        self.checkpoint_mark('detail', product_obj.url, in_flight)
+        asin = product_obj.asin or get_asin(product_obj.url)
+        if self.asin_index is None or not asin:
+            yield product_obj, self.fetch_product_page(product_obj, product_obj.url)
+            return
+
+        status, details = self.asin_index.claim(asin, product_obj)
+        if status == 'fetch':
+            try:
+                page_content = self.fetch_product_page(product_obj, self.prepare_product_url(asin))
+            except RetryLater:
+                # the product comes back and keeps fetching for the products waiting on it
+                raise
+            except Exception:
+                # the products waiting for this asin go on with empty details, the pipeline records the error
+                for follower in self.release_asin(asin, product_obj, None):
+                    yield follower, None
+                raise
+            yield product_obj, page_content
+        elif status == 'done':
+            product_obj.brand, product_obj.description = details
+            yield product_obj, None
+
+    def fetch_product_page(self, product_obj, url):
+        """Fetches a detail page, the product is recorded as failed in the checkpoint if that fails
+
+        Args:
+            product_obj (Product): product the page belongs to
+            url (str): url of the detail page
+
+        Returns:
+            page_content or None: unicode encoded response or None if no valid page was received
+        """
+
+        page_content = self.try_page_content(url)
+        if not page_content:
+            self.checkpoint_mark('detail', product_obj.url, failed)
+        return page_content
+
+    def parse_detail_page(self, item):
+        """pipeline stage: fills brand and description of a product from its detail page,
+        and of the products that waited for the same asin
+
+        Args:
+            item (tuple): product and the unicode encoded detail page (None if fetching failed or it was already known)
+        """
+
+        product_obj, page_content = item
+        asin = product_obj.asin or get_asin(product_obj.url)
+        details = None
+        error = None
+        try:
+            if page_content:
+                details = self.parse_brand_and_description(page_content, asin=asin)
+                product_obj.brand, product_obj.description = details
+        except Exception as e:
+            error = e
+        finally:
+            # resolved even if parsing raised, the products waiting for this asin then go on with empty details
+            followers = self.release_asin(asin, product_obj, details)
+        if error is not None:
+            yield from followers
+            raise error
+        yield product_obj
+        yield from followers
+
+    def release_asin(self, asin, product_obj, details):
+        """Ends the fetch of an asin started by fetch_detail_page, does nothing without deduplication
+
+        Args:
+            asin (str): asin of the product
+            product_obj (Product): product that fetched the detail page
+            details (tuple): (brand, description), None if fetching or parsing failed
+
+        Returns:
+            followers: products that waited for the asin, filled with details or left empty
+        """
+
+        if self.asin_index is None or not asin:
+            return []
+        followers = self.asin_index.resolve(asin, product_obj, details)
+        for follower in followers:
+            follower.brand, follower.description = details or ('', '')
+        return followers
+
+    def collect_product(self, product_obj):
+        """pipeline sink: streams a finished product to the output file and appends it to list of Product objects
+
+        Args:
+            product_obj (Product): fully scraped product
+        """
+
+        # called from several worker threads at once, none of them waits on another
+        number = self.keep_product(product_obj)
+        self.metrics.inc('products')
+        print(f"scraped product {number}")
+        if self.output is not None:
+            self.output.write(product_obj)
+        else:
+            self.output_flushed([product_obj])
+
+    def build_pipeline(self, sink=None, on_error=None):
+        """Builds the search page -> listing -> detail page -> detail parse pipeline,
+        the search page -> listing pipeline in listing-only mode
+
+        Args:
+            sink (callable): called with every finished product, collect_product by default
+            on_error (callable): called with (stage name, item, exception) for every item a stage failed on
+
+        Returns:
+            pipeline: Pipeline which is not started yet
+        """
+
+        pipeline = Pipeline(sink=sink or self.collect_product, on_error=on_error)
+        pipeline.add_stage('search', self.fetch_search_page, self.search_workers, self.queue_size)
+        pipeline.add_stage('listing', self.parse_search_page, self.listing_workers, self.queue_size)
+        if not self.listing_only:
+            pipeline.add_stage('detail', self.fetch_detail_page, self.detail_workers, self.queue_size)
+            pipeline.add_stage('parse', self.parse_detail_page, self.parse_workers, self.queue_size)
+        self.watch_pipeline(pipeline)
+        return pipeline
+
+    def watch_pipeline(self, pipeline):
+        """Registers the queue length of every stage of a pipeline as a queue_depth gauge
+
+        Args:
+            pipeline (Pipeline): pipeline of the search
+        """
+
+        for name, stage in pipeline.stages.items():
+            self.metrics.gauge('queue_depth', stage.queue.qsize, stage=name)
+
     def search(self, search_word):
         """Initializies that search and puts together the whole class
 
@@ -533,32 +1172,310 @@ class Scraper():
             search_word (str): user given word to be searched
         """
 
+        if self.resume and self.checkpoint is not None and self.checkpoint.has_word(self.word):
+            self.resume_search()
+            return
+
         search_url = self.prepare_url(search_word)
         page_content = self.get_page_content(search_url)
         if (not page_content):
             return
 
-        self.page_count = self.get_page_count(page_content)
+        self.begin_search(search_url)
+        self.open_output()
+        # every stage runs on its own threads, detail pages of a search page are fetched
+        # as soon as that search page is parsed instead of one after the other
+        with self.build_pipeline() as pipeline:
+            # the first page is not fetched again: the listing stage extracts its products right away
+            # and schedules the other search pages from its pagination
+            self.pipeline = pipeline
+            pipeline.submit('listing', (search_url, page_content))
+        self.pipeline = None
+
+        # products were written while scraping, only the compaction to a json file is left
+        self.close_output()
+        self.print_summary()
+
+    def iter_products(self, keyword=None, max_workers=None, max_pages=None, timeout=None, on_error=None):
+        """Searches keyword and yields every product as soon as it is finished, while the crawl goes on.
+        Nothing is written to the output file and products are not kept, at most queue_size finished products wait
+        for the caller, the crawl slows down when the caller does. Leaving the loop early cancels the crawl
+
+        Args:
+            keyword (str): word searched on amazon.com, the word of the scraper by default
+            max_workers (int): threads fetching detail pages, detail_workers by default. The connection pool, and the
+                rate limiter and endpoint the scraper created, are raised to match (see scale_requests).
+                A rate_limiter or transport passed to the scraper keeps its own caps
+            max_pages (int): search pages crawled at most, max_pages of the scraper by default
+            timeout (float): seconds the whole crawl may take, the crawl is cancelled once they passed.
+                Requests still in flight then finish in the background and their products are dropped
+            on_error (callable): called with (stage name, item, exception) for every page or product that failed,
+                from the thread iterating. If None the first failure is raised as StageError and cancels the crawl
+
+        Raises:
+            StageError: a stage failed on a page or product and on_error is None
+            TimeoutError: the crawl did not finish within timeout seconds
+
+        Yields:
+            product_obj: finished Product
+        """
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        saved = (self.word, self.search_workers, self.detail_workers, self.max_pages)
+        if keyword is not None:
+            self.word = keyword
+        if max_workers is not None:
+            self.detail_workers = max_workers
+            self.search_workers = min(self.search_workers, max_workers)
+            self.scale_requests(self.search_workers + self.detail_workers)
+        if max_pages is not None:
+            self.max_pages = max_pages
+        if self.asin_index is not None:
+            # a cancelled call leaves fetches in flight that never end, every call starts a new index
+            self.asin_index = AsinIndex()
+        finished = object()
+        results = queue.Queue(self.queue_size)
+
+        def deliver(item):
+            # blocks the last stage while the caller is behind, gives up once the crawl is cancelled
+            while not pipeline.cancelled:
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def deliver_product(product_obj):
+            self.metrics.inc('products')
+            self.output_flushed([product_obj])
+            deliver(product_obj)
+
+        def run():
+            try:
+                with pipeline:
+                    pipeline.submit('search', self.search_url)
+            finally:
+                # the iterating thread also returns once this thread is gone and the queue is empty,
+                # the marker saves it the wait and is dropped if nobody reads anymore
+                try:
+                    results.put_nowait(finished)
+                except queue.Full:
+                    pass
+
+        search_url = self.prepare_url(self.word)
+        self.begin_search(search_url)
+        pipeline = self.build_pipeline(sink=deliver_product,
+                                       on_error=lambda stage, item, error: deliver(StageError(stage, item, error)))
+        self.pipeline = pipeline
+        runner = threading.Thread(target=run, name='iter-products', daemon=True)
+        runner.start()
+        try:
+            while True:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Search for '{self.word}' did not finish within {timeout} seconds")
+                try:
+                    # woken up regularly to look at the deadline and at the runner
+                    item = results.get(timeout=0.05)
+                except queue.Empty:
+                    if not runner.is_alive() and results.empty():
+                        return
+                    continue
+                if item is finished:
+                    return
+                if isinstance(item, StageError):
+                    if on_error is None:
+                        raise item from item.error
+                    on_error(item.stage, item.item, item.error)
+                    continue
+                yield item
+        finally:
+            if runner.is_alive():
+                self.cancel()
+                # requests in flight are waited for until the deadline at most
+                runner.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+            self.pipeline = None
+            self.word, self.search_workers, self.detail_workers, self.max_pages = saved
+
+    def keyword_scraper(self, word, **kwargs):
+        """Creates the scraper of another keyword crawled next to this one, it sends its requests through
+        the same session, transport and rate limiter, records into the same metrics, shares the asin index
+        and counts its rule hits in the same rules
+
+        Args:
+            word (str): keyword
+            **kwargs: passed on to Scraper for everything not shared
 
-        """if page count is 1, then there is no need to prepare page list therefore the condition and
-        we just parse the content recieved above
+        Returns:
+            scraper: Scraper for the keyword
         """
-        if self.page_count <= 1:
-            self.get_products(page_content)
 
-        else:
-            # if page count is more than 1, then we prepare a page list and start a thread at each page url
-            print(f"Processing {self.page_count} pages")
-            self.prepare_page_list(search_url)
-            # for page in self.page_list:
-            #     print('Processing page:', page)
-            #     self.get_products_wrapper(page)
-                # time.sleep(120)
-            # creating threads at each page in page_list
-            with ThreadPoolExecutor() as executor:
-                for page in self.page_list:
-                    print('processing page ', page)
-                    executor.submit(self.get_products_wrapper, page)
-
-        # generate a json output file
-        self.generate_output_file()
+        scraper = Scraper(word, **dict(kwargs, transport=self.transport, rate_limiter=self.rate_limiter,
+                                       metrics=self.metrics, rules=self.rules))
+        scraper.session = self.session
+        scraper.asin_index = self.asin_index
+        return scraper
+
+    def scale_requests(self, fetchers):
+        """Raises the limits on requests in flight created by the scraper to fetchers threads: the connection pool
+        of the session, the concurrency of its rate limiter and of its endpoint. A rate_limiter or transport passed
+        to the scraper keeps its own limits, limits are never lowered
+
+        Args:
+            fetchers (int): threads sending requests at the same time
+        """
+
+        if fetchers <= self.connections:
+            return
+        self.connections = fetchers
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=fetchers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        rate_limiter, transport = self._own_limits
+        if self.rate_limiter is rate_limiter:
+            rate_limiter.max_concurrency = max(rate_limiter.max_concurrency, fetchers)
+            rate_limiter.concurrency = max(rate_limiter.concurrency, float(fetchers))
+        if self.transport is transport:
+            for endpoint in transport.endpoints:
+                endpoint.max_concurrency = max(endpoint.max_concurrency, fetchers)
+
+    def cancel(self):
+        """Stops the running crawl from any thread: no more search pages are scheduled, pages and products
+        waiting in the pipeline are dropped, requests already sent are finished
+        """
+
+        with self._page_lock:
+            self.stopped = True
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+
+    def begin_search(self, search_url):
+        """Starts a new crawl from its first search page, the other pages are scheduled as it is parsed
+
+        Args:
+            search_url (str): url of the first search page
+        """
+
+        self.search_url = search_url
+        self._scheduled = {search_url}
+        self.listed = 0
+        self.stopped = False
+        self.start_checkpoint([search_url])
+
+    def start_checkpoint(self, page_urls):
+        """Forgets an earlier crawl of word and records the search pages of this one, does nothing without a checkpoint
+
+        Args:
+            page_urls (list): urls of the search pages
+        """
+
+        if self.checkpoint is None:
+            return
+        self.checkpoint.clear(self.word)
+        self.checkpoint.add(self.word, 'search', [(url, None) for url in page_urls])
+
+    def unfinished_work(self):
+        """Reads what an interrupted crawl of word left over from the checkpoint
+
+        Returns:
+            pages, products: urls of the search pages and Product objects that were pending or in flight
+        """
+
+        pages = [url for url, _ in self.checkpoint.unfinished(self.word, 'search')]
+        products = [Product(**json.loads(payload)) for _, payload in self.checkpoint.unfinished(self.word, 'detail')]
+        return pages, products
+
+    def resume_search(self):
+        """Continues an interrupted crawl of word, only the search pages and products the checkpoint doesn't have
+        as done go through the pipeline and their products are appended to the output file
+        """
+
+        pages, products = self.unfinished_work()
+        if not pages and not products:
+            print(f"Nothing left to resume for '{self.word}'")
+            return
+
+        print(f"Resuming '{self.word}': {len(pages)} search pages and {len(products)} products left")
+        self.resuming = True
+        self.search_url = self.prepare_url(self.word)
+        self.open_output(append=True)
+        with self.build_pipeline() as pipeline:
+            self.pipeline = pipeline
+            for page in pages:
+                pipeline.submit('search', page)
+            for product_obj in products:
+                if self.listing_only:
+                    self.collect_product(product_obj)
+                else:
+                    pipeline.submit('detail', product_obj)
+        self.pipeline = None
+
+        self.close_output()
+        self.print_summary()
+
+    def read_output(self):
+        """Reads the products of word back from the output file
+
+        Returns:
+            products: ProductBatch of the products in <word>.ndjson, or in <word>.json if there is no NDJSON file
+        """
+
+        path = './' + self.word + '.ndjson'
+        if not os.path.exists(path):
+            path = './' + self.word + '.json'
+        return ProductBatch.read_json(path)
+
+    def enrich(self, products=None, predicate=None, workers=None):
+        """Fetches brand and description of products emitted without them by a listing-only crawl,
+        the enriched products are written to <word>.enriched.ndjson (compacted to <word>.enriched.json if output_format is "json")
+
+        Args:
+            products (iterable): products to enrich, read from the output file of word if None
+            predicate (callable): takes a Product and returns True if its detail page is wanted, every product if None
+            workers (int): threads fetching detail pages in this pass, its own budget next to the crawl's detail_workers
+                which is used if None
+
+        Returns:
+            count: number of enriched products written
+        """
+
+        if products is None:
+            products = self.read_output()
+        selected = [product_obj for product_obj in products if predicate is None or predicate(product_obj)]
+        if not selected:
+            print(f"No products of '{self.word}' to enrich")
+            return 0
+
+        print(f"Enriching {len(selected)} products of '{self.word}'")
+        workers = workers or self.detail_workers
+        self.scale_requests(workers)
+        # fetch_detail_page marks the products in flight, they are done once written
+        output = self.output_writer('./' + self.word + '.enriched.ndjson')
+        output.start()
+        pipeline = Pipeline(sink=output.write)
+        pipeline.add_stage('detail', self.fetch_detail_page, workers, self.queue_size)
+        pipeline.add_stage('parse', self.parse_detail_page, self.parse_workers, self.queue_size)
+        self.watch_pipeline(pipeline)
+        with pipeline:
+            for product_obj in selected:
+                pipeline.submit('detail', product_obj)
+
+        output.close()
+        if self.output_format == 'json':
+            output.compact('./' + self.word + '.enriched.json')
+        return output.count
+
+    def print_summary(self):
+        """Prints how many detail page fetches were saved by deduplication and how the cache did
+        """
+
+        if self.asin_index is not None:
+            stats = self.asin_index.stats()
+            print(f"Detail pages fetched: {stats['fetches']}, fetches saved by asin deduplication: {stats['saved']}")
+        if self.cache is not None:
+            print(f"Cache: {self.cache.stats()}")
+        if self.fingerprints is not None:
+            print(f"Unchanged pages: {self.fingerprints.stats()}")
+        print(f"Transport: {self.transport.stats()}")
+        print(f"Extraction rules: {self.rules.stats()}")
+        print(f"Rate limiter: {self.rate_limiter.stats()}")
+        print(f"Metrics: {self.metrics.summary()}")
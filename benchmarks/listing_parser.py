@@ -0,0 +1,117 @@
+"""
+Measures CPU time spent per product while parsing a search page built out of
+copies of the bundled product_list.html
+
+    python benchmarks/listing_parser.py --products 22 --rounds 5
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from amazon_scraper.scraper import Scraper, base_url  # noqa: E402
+
+
+# the hard coded lookups of the search page fields that rules.json replaced, kept as the baseline
+product_url_classes = re.compile(r"a-link-normal\s+s-underline-text\s+s-underline-link-text\s+s-link-style\s+a-text-normal")
+product_title_classes = re.compile(r"a-color-base\s+a-text-normal")
+prime_classes = re.compile(r"a-icon\s+a-icon-prime\s+a-icon-medium")
+rating_regexp = re.compile(r'(\d.\d) out of 5')
+review_count_regexp = re.compile(r'([\d,]+)\s+ratings')
+
+
+def build_search_page(product_count):
+    """Builds a search page with product_count copies of the bundled product
+
+    Args:
+        product_count (int): number of products on the page
+
+    Returns:
+        page: html of the search page
+    """
+
+    with open(os.path.join(os.path.dirname(here), 'product_list.html'), encoding='utf-8') as f:
+        product = f.read()
+    return '<html><body>' + product * product_count + '</body></html>'
+
+
+def per_field_info(product):
+    """Search page information the way it was gathered before get_listing_info, one find per field
+    """
+
+    url = base_url + product.find('a', attrs={'class': product_url_classes}).get('href')
+    title = product.find('span', attrs={'class': product_title_classes})
+    price = product.find('span', attrs={'class': 'a-offscreen'})
+    try:
+        price = float(price.text.strip().strip('$').replace(',', ''))
+    except (AttributeError, ValueError):
+        price = None
+    image = product.find('img')
+    # the regexes ran over the whole product html
+    text = str(product)
+    rating = rating_regexp.search(text)
+    reviews = review_count_regexp.search(text)
+    badge = product.find('span', attrs={'class': 'a-badge-text'})
+    return (url, product.get('data-asin'), title.text.strip() if title else '', price,
+            image.get('src') if image else None, float(rating.group(1)) if rating else None,
+            int(reviews.group(1).replace(',', '')) if reviews else None,
+            badge is not None and badge.text.strip() == 'Best Seller',
+            product.find('i', attrs={'class': prime_classes}) is not None)
+
+
+def measure(func, rounds):
+    """Runs func rounds times
+
+    Returns:
+        seconds: smallest CPU time of a single run
+    """
+
+    best = None
+    for _ in range(rounds):
+        start = time.process_time()
+        func()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """Takes command line argument
+    """
+    parser = argparse.ArgumentParser(
+        description='Measures per product CPU time of search page parsing'
+    )
+    parser.add_argument('--products', type=int, default=22, help='Products on the search page')
+    parser.add_argument('--rounds', type=int, default=5, help='Runs per measurement, the best one is kept')
+    arg = parser.parse_args()
+
+    page = build_search_page(arg.products)
+    print(f"{arg.products} products, {len(page) // 1024} KiB per page, CPU ms per product (best of {arg.rounds})")
+    print(f"{'parser':<12}{'parse':>10}{'per field':>12}{'one pass':>12}{'total':>10}")
+
+    for backend in ('html5lib', 'html.parser', 'lxml'):
+        scraper = Scraper('benchmark', parser=backend)
+        try:
+            soup = scraper.make_soup(page)
+        except Exception as e:
+            print(f"{backend:<12}skipped ({e})")
+            continue
+        products = scraper.get_product_tags(soup)
+
+        # the old search path parsed each page twice, once for get_page_count and once for get_products
+        parse = measure(lambda: scraper.get_page_count(scraper.make_soup(page)), arg.rounds)
+        per_field = measure(lambda: [per_field_info(p) for p in products], arg.rounds)
+        one_pass = measure(lambda: [scraper.get_listing_info(p) for p in products], arg.rounds)
+
+        n = len(products)
+        print(f"{backend:<12}{parse / n * 1000:>10.3f}{per_field / n * 1000:>12.3f}"
+              f"{one_pass / n * 1000:>12.3f}{(parse + one_pass) / n * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
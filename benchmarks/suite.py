@@ -0,0 +1,262 @@
+"""
+Repeatable offline benchmark of the scraper: parse times of every stage on the bundled samples
+and synthetic pages built from them, and end-to-end search throughput and peak memory against
+the local mock server for several thread counts. Results are written to a json file, pass an
+earlier one with --compare to see how a change moved the numbers
+
+    python benchmarks/suite.py --threads 1 4 16 --latency 0.05 --output results.json
+    python benchmarks/suite.py --compare results.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+
+from mock_server import MockAmazonServer, read_sample  # noqa: E402
+from amazon_scraper.scraper import Scraper  # noqa: E402
+from amazon_scraper.ratelimit import RateLimiter  # noqa: E402
+from amazon_scraper.parse_pool import ParsePool  # noqa: E402
+
+
+# block of unrelated markup put in front of the detail sample to build a larger page
+filler = '<div class="a-section"><span class="a-size-base">%d</span><a href="/gp/help/%d">help</a></div>\n'
+
+
+def synthetic_pages(products_per_page, pages, filler_blocks):
+    """Builds the pages the parse stages are measured on
+
+    Args:
+        products_per_page (int): products on the search page
+        pages (int): page count announced by the pagination of the search page
+        filler_blocks (int): blocks of unrelated markup put in front of the large detail page
+
+    Returns:
+        pages: dict with the search page and the sample and large detail pages
+    """
+
+    server = MockAmazonServer(products_per_page=products_per_page, pages=pages)
+    server.httpd.server_close()
+    detail = read_sample('product_page.html')
+    head, body = detail.split('<body', 1)
+    padding = ''.join(filler % (i, i) for i in range(filler_blocks))
+    tag_end = body.index('>') + 1
+    return {
+        'search': server.search_page('https://www.amazon.com/s?k=benchmark&page=1'),
+        'detail': detail,
+        'detail_large': head + '<body' + body[:tag_end] + padding + body[tag_end:],
+    }
+
+
+def best_time(func, rounds):
+    """Runs func rounds times
+
+    Returns:
+        seconds: smallest wall time of a single run
+    """
+
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_parsing(pages, rounds, parser=None):
+    """Times the parse stages of the scraper without any network
+
+    Args:
+        pages (dict): pages built by synthetic_pages
+        rounds (int): runs per measurement, the best one is kept
+        parser (str): BeautifulSoup tree builder, the scraper's default if None
+
+    Returns:
+        results: dict of milliseconds per call of get_page_count, get_products (listing extraction of every
+        product of the search page, without detail pages) and get_brand_and_description (parsing only)
+    """
+
+    scraper = Scraper('benchmark', parser=parser)
+    search_page = pages['search']
+    products = len(list(scraper.parse_search_page((None, search_page))))
+    results = {
+        'parser': scraper.parser,
+        'search_page_bytes': len(search_page.encode('utf-8')),
+        'products_per_page': products,
+        'get_page_count_ms': best_time(lambda: scraper.get_page_count(search_page), rounds) * 1000,
+        'get_products_ms': best_time(lambda: list(scraper.parse_search_page((None, search_page))), rounds) * 1000,
+    }
+    for name in ('detail', 'detail_large'):
+        page = pages[name]
+        results[f'get_brand_and_description_{name}_ms'] = best_time(
+            lambda: scraper.parse_brand_and_description(page), rounds) * 1000
+        results[f'{name}_page_bytes'] = len(page.encode('utf-8'))
+    return results
+
+
+def measure_search(threads, server_options, rate, memory=True, parse_pool=None):
+    """Runs one complete search against a fresh mock server
+
+    Args:
+        threads (int): threads fetching detail pages, search page threads are capped at 4
+        server_options (dict): passed on to MockAmazonServer
+        rate (float): requests per second the rate limiter starts with and never exceeds
+        memory (bool): trace allocations to report the peak memory, slows the run down
+        parse_pool (ParsePool): worker processes parsing the pages, None to parse on the stage threads
+
+    Returns:
+        results: dict with seconds, products, products_per_second, requests, errors, captchas and peak_memory_mb
+    """
+
+    search_workers = min(4, threads)
+    fetching = search_workers + threads
+    rate_limiter = RateLimiter(rate=rate, max_rate=rate, concurrency=fetching, max_concurrency=fetching,
+                               base_delay=0.05, max_delay=0.5)
+    with MockAmazonServer(**server_options) as server, tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            scraper = Scraper('benchmark', search_workers=search_workers, detail_workers=threads,
+                              api_url=server.url, output_format='ndjson', keep_products=False,
+                              rate_limiter=rate_limiter, parse_pool=parse_pool)
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            # the scraper prints a line per product
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.search('benchmark')
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+        finally:
+            if memory:
+                tracemalloc.stop()
+            os.chdir(cwd)
+
+        products = scraper.item_count - 1
+        return {
+            'threads': threads,
+            'seconds': seconds,
+            'products': products,
+            'products_per_second': products / seconds if seconds else 0.0,
+            'requests': server.request_count,
+            'errors': server.error_count,
+            'captchas': server.captcha_count,
+            'peak_memory_mb': peak / (1024 * 1024) if peak is not None else None,
+        }
+
+
+def git_commit():
+    """Returns the commit the benchmark runs on, None outside of a git checkout
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    """Prints every number next to the same number of an earlier run
+
+    Args:
+        baseline (dict): results of the earlier run
+        results (dict): results of this run
+    """
+
+    print(f"\ncompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    for key, value in results['parsing'].items():
+        old = baseline.get('parsing', {}).get(key)
+        if key.endswith('_ms') and old:
+            print(f"{key:<45}{old:>10.3f}{value:>10.3f}{value / old:>8.2f}x")
+    old_runs = {run['threads']: run for run in baseline.get('search', [])}
+    for run in results['search']:
+        old = old_runs.get(run['threads'])
+        if old and old['products_per_second']:
+            print(f"{'products/s with %d threads' % run['threads']:<45}{old['products_per_second']:>10.1f}"
+                  f"{run['products_per_second']:>10.1f}{run['products_per_second'] / old['products_per_second']:>8.2f}x")
+
+
+def main():
+    """Takes command line argument
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmarks parsing and end-to-end search against the local mock server'
+    )
+    parser.add_argument('--threads', type=int, nargs='*', default=[1, 4, 16],
+                        help='Detail page thread counts the search is run with')
+    parser.add_argument('--pages', type=int, default=3, help='Search pages of the benchmark search')
+    parser.add_argument('--products-per-page', type=int, default=22, help='Products on every search page')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds every mock response is delayed by')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503 error')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='Share of requests answered with a robot check')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the failing requests')
+    parser.add_argument('--rate', type=float, default=1000.0, help='Requests per second allowed by the rate limiter')
+    parser.add_argument('--filler', type=int, default=2000,
+                        help='Blocks of markup put in front of the large synthetic detail page')
+    parser.add_argument('--rounds', type=int, default=5, help='Runs per parse measurement, the best one is kept')
+    parser.add_argument('--parser', default=None, help='BeautifulSoup tree builder, the fastest installed by default')
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='Worker processes parsing the pages of the searches, 0 parses on the stage threads')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracing allocations during the searches')
+    parser.add_argument('--output', default='benchmark_results.json', help='json file the results are written to')
+    parser.add_argument('--compare', default=None, help='json file of an earlier run to compare with')
+    arg = parser.parse_args()
+
+    pages = synthetic_pages(arg.products_per_page, arg.pages, arg.filler)
+    parsing = measure_parsing(pages, arg.rounds, arg.parser)
+    print(f"parsing with {parsing['parser']}, ms per call (best of {arg.rounds})")
+    for key, value in parsing.items():
+        if key.endswith('_ms'):
+            print(f"  {key:<43}{value:>10.3f}")
+
+    server_options = dict(products_per_page=arg.products_per_page, pages=arg.pages, latency=arg.latency,
+                          error_rate=arg.error_rate, captcha_rate=arg.captcha_rate, seed=arg.seed)
+    print(f"\nsearch of {arg.pages} pages, {arg.latency * 1000:.0f} ms latency, "
+          f"{arg.error_rate:.0%} errors, {arg.captcha_rate:.0%} robot checks")
+    print(f"{'threads':>8}{'seconds':>10}{'products':>10}{'products/s':>12}{'requests':>10}{'peak MiB':>10}")
+    search = []
+    parse_pool = ParsePool(arg.parse_processes, parser=arg.parser) if arg.parse_processes else None
+    for threads in arg.threads:
+        run = measure_search(threads, server_options, arg.rate, memory=not arg.no_memory, parse_pool=parse_pool)
+        search.append(run)
+        peak = f"{run['peak_memory_mb']:.1f}" if run['peak_memory_mb'] is not None else '-'
+        print(f"{threads:>8}{run['seconds']:>10.2f}{run['products']:>10}{run['products_per_second']:>12.1f}"
+              f"{run['requests']:>10}{peak:>10}")
+    if parse_pool is not None:
+        parse_pool.close()
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': vars(arg),
+        },
+        'parsing': parsing,
+        'search': search,
+    }
+    with open(arg.output, mode='w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {arg.output}")
+
+    if arg.compare:
+        with open(arg.compare, encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
 import time
 import argparse
-from amazon_scraper.scraper import Scraper
+from amazon_scraper.scraper import Scraper, api_url
+from amazon_scraper.cache import ResponseCache
+from amazon_scraper.fingerprint import FingerprintStore
+from amazon_scraper.batch import BatchScraper, read_keywords
+from amazon_scraper.ratelimit import RateLimiter
+from amazon_scraper.checkpoint import CheckpointStore
+from amazon_scraper.metrics import Metrics, MetricsServer, SummaryReporter
+from amazon_scraper.parse_pool import ParsePool
+from amazon_scraper.history import PriceHistory
+from amazon_scraper.enrich import price_between, rating_at_least, new_asins, all_of
+from amazon_scraper.transport import TransportPool, ApiEndpoint, DirectEndpoint, ProxyEndpoint
+from amazon_scraper.distributed import Coordinator, Worker, QueueServer, open_queue
 
 
 def main():
@@ -16,12 +27,172 @@ def main():
         default='smart phone',
         help='Enter the word you want to search'
     )
+    parser.add_argument('-f', '--keyword-file', default=None,
+                        help='File with one word per line, all words are searched on shared worker pools')
+    parser.add_argument('--search-workers', type=int, default=4,
+                        help='Threads fetching search result pages')
+    parser.add_argument('--listing-workers', type=int, default=1,
+                        help='Threads parsing search result pages')
+    parser.add_argument('--detail-workers', type=int, default=10,
+                        help='Threads fetching product detail pages')
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help='Threads parsing product detail pages')
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='Worker processes parsing search and detail pages, 0 parses on the parsing threads')
+    parser.add_argument('--detail-fields', nargs='*', default=['brand', 'description'],
+                        choices=['brand', 'description'],
+                        help='Fields read from product detail pages')
+    parser.add_argument('--output-format', default='json', choices=['json', 'ndjson'],
+                        help='json compacts the streamed <word>.ndjson file into <word>.json at the end')
+    parser.add_argument('--cache', default=None,
+                        help='SQLite file to cache downloaded pages in, pages are downloaded every time if not given')
+    parser.add_argument('--cache-size', type=int, default=512,
+                        help='Maximum size of the cache in MB')
+    parser.add_argument('--fingerprints', default=None,
+                        help='SQLite file keeping what was extracted from every page, pages unchanged since '
+                             'an earlier crawl are not parsed again')
+    parser.add_argument('--debug-dir', default=None,
+                        help='Directory detail pages without a description are written to as <asin>.html')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Fetch the detail page of every listing, even if its asin was already fetched')
+    parser.add_argument('--api-key', default='', help='Key of the scraperapi compatible endpoint')
+    parser.add_argument('--api-url', default=api_url, help='scraperapi compatible endpoint the requests are sent through')
+    parser.add_argument('--proxy', action='append', default=[],
+                        help='Also send requests straight to amazon through this proxy, can be given several times')
+    parser.add_argument('--direct', action='store_true',
+                        help='Also send requests straight to amazon from this machine')
+    parser.add_argument('--endpoint-concurrency', type=int, default=8,
+                        help='Requests in flight at the same time through each proxy or direct endpoint')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='Requests per second to start with, adapted to the block pages amazon sends')
+    parser.add_argument('--max-rate', type=float, default=100.0,
+                        help='Requests per second never exceeded')
+    parser.add_argument('--checkpoint', default=None,
+                        help='SQLite file recording every search page and product, so an interrupted crawl can be resumed')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the crawl recorded in the --checkpoint file instead of starting over')
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help='Search pages crawled at most for every word')
+    parser.add_argument('--max-products', type=int, default=None,
+                        help='Products written at most for every word, the crawl stops fetching search pages once reached')
+    parser.add_argument('--follow-next', action='store_true',
+                        help='Schedule every search page from the "next" link of the page before it')
+    parser.add_argument('--listing-only', action='store_true',
+                        help='Write products from the search pages right away, without fetching their detail pages')
+    parser.add_argument('--enrich', action='store_true',
+                        help='After a --listing-only crawl, fetch brand and description of the selected products '
+                             'into <word>.enriched.json')
+    parser.add_argument('--enrich-workers', type=int, default=4,
+                        help='Threads fetching detail pages during the enrichment pass')
+    parser.add_argument('--enrich-min-price', type=float, default=None, help='Only enrich products at least this price')
+    parser.add_argument('--enrich-max-price', type=float, default=None, help='Only enrich products at most this price')
+    parser.add_argument('--enrich-min-rating', type=float, default=None, help='Only enrich products rated at least this')
+    parser.add_argument('--enrich-new-only', action='store_true',
+                        help='Only enrich products whose asin was not in the --history file before this crawl')
+    parser.add_argument('--history', default=None,
+                        help='SQLite file the price and rating changes of every product are recorded in')
+    parser.add_argument('--role', default=None, choices=['coordinator', 'worker'],
+                        help='Distributed crawl: the coordinator queues the words and writes the output, workers crawl')
+    parser.add_argument('--queue', default='amazon_queue.sqlite',
+                        help='Task queue of a distributed crawl: a SQLite file, or the http url of a coordinator for workers')
+    parser.add_argument('--queue-port', type=int, default=None,
+                        help='Coordinator only: serve the queue over http on this port to workers on other machines')
+    parser.add_argument('--queue-host', default='127.0.0.1',
+                        help='Coordinator only: address the queue is served on, this machine only by default. '
+                             'The queue has no authentication, give the address of a private network')
+    parser.add_argument('--lease-timeout', type=float, default=120.0,
+                        help='Seconds a task stays with a worker that stopped extending its lease')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve live metrics in the Prometheus text format on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--summary-interval', type=float, default=None,
+                        help='Print a metrics summary line every this many seconds')
 
     arg = parser.parse_args()
     arg.word = ''.join(arg.word)
-    amazon = Scraper(arg.word)
-    amazon.search(arg.word)
+    if arg.resume and not arg.checkpoint:
+        parser.error('--resume needs --checkpoint')
+    checkpoint = CheckpointStore(arg.checkpoint) if arg.checkpoint else None
+    metrics = Metrics()
+    history = PriceHistory(arg.history) if arg.history else None
+    if arg.enrich_new_only and history is None:
+        parser.error('--enrich-new-only needs --history')
+    predicates = []
+    if arg.enrich_min_price is not None or arg.enrich_max_price is not None:
+        predicates.append(price_between(arg.enrich_min_price, arg.enrich_max_price))
+    if arg.enrich_min_rating is not None:
+        predicates.append(rating_at_least(arg.enrich_min_rating))
+    if arg.enrich_new_only:
+        # taken before the crawl records this crawl's products
+        predicates.append(new_asins(history.asins()))
+    parse_pool = ParsePool(arg.parse_processes, detail_fields=arg.detail_fields) if arg.parse_processes else None
+    cache = ResponseCache(arg.cache, max_size=arg.cache_size * 1024 * 1024) if arg.cache else None
+    fingerprints = FingerprintStore(arg.fingerprints) if arg.fingerprints else None
+    fetching_workers = arg.search_workers + arg.detail_workers
+    rate_limiter = RateLimiter(rate=arg.rate, max_rate=arg.max_rate,
+                               concurrency=fetching_workers, max_concurrency=fetching_workers)
+    endpoints = [ProxyEndpoint(proxy, max_concurrency=arg.endpoint_concurrency) for proxy in arg.proxy]
+    if arg.direct:
+        endpoints.append(DirectEndpoint(max_concurrency=arg.endpoint_concurrency))
+    if arg.api_key or not endpoints:
+        endpoints.insert(0, ApiEndpoint(arg.api_url, arg.api_key, max_concurrency=fetching_workers))
+    options = dict(search_workers=arg.search_workers,
+                   listing_workers=arg.listing_workers,
+                   detail_workers=arg.detail_workers,
+                   parse_workers=arg.parse_workers,
+                   detail_fields=arg.detail_fields,
+                   output_format=arg.output_format,
+                   keep_products=False,
+                   cache=cache,
+                   fingerprints=fingerprints,
+                   debug_dir=arg.debug_dir,
+                   dedup=not arg.no_dedup,
+                   rate_limiter=rate_limiter,
+                   checkpoint=checkpoint,
+                   resume=arg.resume,
+                   metrics=metrics,
+                   parse_pool=parse_pool,
+                   history=history,
+                   listing_only=arg.listing_only,
+                   max_pages=arg.max_pages,
+                   max_products=arg.max_products,
+                   follow_next=arg.follow_next,
+                   transport=TransportPool(endpoints))
 
+    server = MetricsServer(metrics, port=arg.metrics_port) if arg.metrics_port is not None else None
+    reporter = SummaryReporter(metrics, interval=arg.summary_interval) if arg.summary_interval else None
+    for background in (server, reporter):
+        if background is not None:
+            background.start()
+    try:
+        if arg.role is not None:
+            words = read_keywords(arg.keyword_file) if arg.keyword_file else [arg.word]
+            queue = open_queue(arg.queue, lease_timeout=arg.lease_timeout)
+            if arg.role == 'coordinator':
+                queue_server = QueueServer(queue, host=arg.queue_host, port=arg.queue_port) if arg.queue_port is not None else None
+                if queue_server is not None:
+                    queue_server.start()
+                    print(f"Serving the queue on {queue_server.url}")
+                Coordinator(queue, output_format=arg.output_format).run(words)
+                if queue_server is not None:
+                    queue_server.stop()
+            else:
+                Worker(queue, threads=arg.detail_workers, **options).run()
+        elif arg.keyword_file:
+            words = read_keywords(arg.keyword_file)
+            BatchScraper(words, **options).search()
+        else:
+            words = [arg.word]
+            amazon = Scraper(arg.word, **options)
+            amazon.search(arg.word)
+        if arg.enrich and arg.role != 'worker':
+            for word in words:
+                Scraper(word, **options).enrich(predicate=all_of(*predicates), workers=arg.enrich_workers)
+    finally:
+        for background in (server, reporter):
+            if background is not None:
+                background.stop()
+        if parse_pool is not None:
+            parse_pool.close()
 
 if __name__ == "__main__":
     print("Extracting...")
@@ -0,0 +1,242 @@
+"""
+Local stand-in for the scraperapi endpoint, serves the bundled html samples so the
+scraper can be run without network access or api credits
+
+    with MockAmazonServer() as server:
+        amazon = Scraper('toaster', api_url=server.url)
+        amazon.search('toaster')
+"""
+
+import os
+import gzip
+import zlib
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+# asin of the single product contained in product_list.html
+sample_asin = "B0D4215HCX"
+captcha_page = "<html><body><h4>Sorry, we just need to make sure you're not a robot.</h4></body></html>"
+error_page = "<html><body><h1>503 ERROR</h1><h2>The request could not be satisfied.</h2></body></html>"
+
+
+def read_sample(filename):
+    """Reads one of the bundled html samples
+
+    Args:
+        filename (str): name of the file next to this module
+
+    Returns:
+        content: content of the file
+    """
+
+    with open(os.path.join(here, filename), encoding='utf-8') as f:
+        return f.read()
+
+
+class MockAmazonServer():
+    """Serves product_list.html for search urls and product_page.html for everything else,
+    optionally slowed down and answering some requests with errors or robot checks.
+    Pages carry an ETag, a request sending it back in If-None-Match gets a 304
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, products_per_page=22, pages=1, latency=0.0,
+                 error_rate=0.0, captcha_rate=0.0, seed=None, listing_sample=None, detail_sample=None, compress=True):
+        """ Init of the server
+
+        Args:
+            host (str): address to listen on
+            port (int): port to listen on, 0 picks a free one
+            products_per_page (int): number of products on every search page, each gets its own asin
+            pages (int): number of search pages announced by the pagination of every search page
+            latency (float): seconds every response is delayed by
+            error_rate (float): share of requests answered with a 503 error
+            captcha_rate (float): share of requests answered with a robot check page
+            seed (int): seed of the random choice of failing requests, for repeatable runs
+            listing_sample (str): html of one product on a search page, product_list.html by default
+            detail_sample (str): html of a detail page, product_page.html by default
+            compress (bool): gzip the responses of requests accepting it
+        """
+        self.products_per_page = products_per_page
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.captcha_rate = captcha_rate
+        self.listing_sample = listing_sample or read_sample('product_list.html')
+        self.detail_sample = detail_sample or read_sample('product_page.html')
+        self.compress = compress
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.error_count = 0
+        self.captcha_count = 0
+        self.not_modified_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """url to pass as api_url to the scraper
+        """
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def search_page(self, target_url):
+        """Builds a search page out of copies of the listing sample
+
+        Args:
+            target_url (str): amazon url that was requested
+
+        Returns:
+            page: html of the search page
+        """
+
+        query = parse_qs(urlparse(target_url).query)
+        page = query.get('page', ['1'])[0]
+        products = []
+        for i in range(self.products_per_page):
+            asin = "B%s%03d%05d" % ('X', int(page) % 1000, i)
+            products.append(self.listing_sample.replace(sample_asin, asin))
+        pagination = ''
+        if self.pages > 1:
+            pagination = f'<span class="s-pagination-item s-pagination-disabled">{self.pages}</span>'
+        if int(page) < self.pages:
+            keyword = query.get('k', [''])[0].replace(' ', '+')
+            pagination += (f'<a href="/s?k={keyword}&amp;page={int(page) + 1}" '
+                           f'class="s-pagination-item s-pagination-next s-pagination-button">Next</a>')
+        return '<html><body>' + '\n'.join(products) + pagination + '</body></html>'
+
+    def detail_page(self, target_url):
+        """Returns the detail page sample
+
+        Args:
+            target_url (str): amazon url that was requested
+
+        Returns:
+            page: html of the detail page
+        """
+
+        return self.detail_sample
+
+    def respond(self, target_url):
+        """Decides what to send back for a requested amazon url
+
+        Args:
+            target_url (str): amazon url that was requested
+
+        Returns:
+            status, body: http status code and html body
+        """
+
+        with self._lock:
+            draw = self._random.random()
+            if draw < self.error_rate:
+                self.error_count += 1
+                return 503, error_page
+            if draw < self.error_rate + self.captcha_rate:
+                self.captcha_count += 1
+                return 200, captcha_page
+
+        if urlparse(target_url).path.startswith('/s'):
+            return 200, self.search_page(target_url)
+        return 200, self.detail_page(target_url)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with server._lock:
+                    server.request_count += 1
+                target_url = parse_qs(urlparse(self.path).query).get('url', [''])[0]
+                if server.latency:
+                    time.sleep(server.latency)
+                status, body = server.respond(target_url)
+                body = body.encode('utf-8')
+                etag = '"%08x"' % zlib.crc32(body)
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    with server._lock:
+                        server.not_modified_count += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                gzipped = server.compress and 'gzip' in self.headers.get('Accept-Encoding', '')
+                if gzipped:
+                    body = gzip.compress(body, compresslevel=5)
+                with server._lock:
+                    server.bytes_sent += len(body)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                if status == 200:
+                    self.send_header('ETag', etag)
+                if gzipped:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Starts serving on a background thread
+        """
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving and closes the socket
+        """
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    """Takes command line argument
+    """
+    parser = argparse.ArgumentParser(
+        description='Serves the bundled html samples like the scraperapi endpoint'
+    )
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--products-per-page', type=int, default=22,
+                        help='Number of products on every search page')
+    parser.add_argument('--pages', type=int, default=1, help='Number of search pages of every search')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every response is delayed by')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503 error')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='Share of requests answered with a robot check')
+    parser.add_argument('--no-compress', action='store_true', help='Never gzip the responses')
+    arg = parser.parse_args()
+
+    server = MockAmazonServer(port=arg.port, products_per_page=arg.products_per_page, pages=arg.pages,
+                              latency=arg.latency, error_rate=arg.error_rate, captcha_rate=arg.captcha_rate,
+                              compress=not arg.no_compress)
+    print(f"Serving on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests: every test runs in its own directory, output files of the scraper land there,
+and searches go to a MockAmazonServer instead of amazon
+"""
+
+import pytest
+
+from mock_server import MockAmazonServer
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in a temporary directory
+    """
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def mock_amazon():
+    """Returns a function starting a MockAmazonServer with the given options, every server is stopped after the test
+    """
+
+    servers = []
+
+    def start(**kwargs):
+        server = MockAmazonServer(**kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def build_detail_page(brand='Acme', bullets=5, padding=0, po_brand=True, byline=True):
+    """Builds a product detail page like amazon's: a brand row and a byline in front of an "About this item" list
+
+    Args:
+        brand (str): brand shown in the brand row and the byline
+        bullets (int): number of items of the "About this item" list
+        padding (int): characters of filler markup between the brand row and the list, and inside every item
+        po_brand (bool): add the tr.po-brand row
+        byline (bool): add the a#bylineInfo link
+
+    Returns:
+        page: html of the page
+    """
+
+    filler = '<span class="filler">' + 'x' * padding + '</span>' if padding else ''
+    parts = ['<html><head><script>var ue_id = "R4ND0M";</script></head><body><div id="dp"><div id="centerCol">']
+    if byline:
+        parts.append(f'<a id="bylineInfo" href="/stores/{brand}">Visit the {brand} Store</a>')
+    if po_brand:
+        parts.append('<table><tr class="a-spacing-small po-brand"><td><span>Brand</span></td>'
+                     f'<td><span class="a-size-base po-break-word">{brand}</span></td></tr></table>')
+    parts.append(filler)
+    parts.append('<div id="feature-bullets"><h1>About this item</h1><ul>')
+    parts.extend(f'<li><span class="a-list-item">Feature {i} {filler}</span></li>' for i in range(bullets))
+    parts.append('</ul></div></div></div></body></html>')
+    return ''.join(parts)
+
+
+@pytest.fixture
+def detail_page():
+    """Returns build_detail_page
+    """
+
+    return build_detail_page
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from amazon_scraper.async_scraper import AsyncScraper
+from amazon_scraper.ratelimit import RateLimiter
+
+from mock_server import read_sample
+
+
+def test_async_search_gets_every_product(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=3, detail_sample=detail_page())
+    scraper = AsyncScraper('toaster', api_url=server.url)
+    asyncio.run(scraper.search('toaster'))
+
+    assert len(scraper.product_obj_list) == 15
+    assert all(product.brand == 'Acme' for product in scraper.product_obj_list)
+
+
+def test_failing_product_does_not_cancel_the_others(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=2, detail_sample=detail_page())
+    scraper = AsyncScraper('toaster', api_url=server.url, dedup=False)
+    parse = scraper.parse_brand_and_description
+
+    def failing_parse(page_content, asin=None):
+        if asin.endswith('2'):
+            raise ValueError(f"cannot parse {asin}")
+        return parse(page_content, asin)
+
+    scraper.parse_brand_and_description = failing_parse
+    asyncio.run(scraper.search('toaster'))
+
+    assert len(scraper.product_obj_list) == 8
+    assert scraper.metrics.count('task_errors') == 2
+
+
+def test_products_waiting_for_a_failed_asin_are_collected(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=3, listing_sample=read_sample('product_list.html') * 2,
+                         detail_sample=detail_page())
+    scraper = AsyncScraper('toaster', api_url=server.url)
+    parse = scraper.parse_brand_and_description
+
+    def failing_parse(page_content, asin=None):
+        if asin.endswith('1'):
+            raise ValueError(f"cannot parse {asin}")
+        return parse(page_content, asin)
+
+    scraper.parse_brand_and_description = failing_parse
+    asyncio.run(scraper.search('toaster'))
+
+    brands = sorted((product.asin, product.brand) for product in scraper.product_obj_list)
+    assert brands == [('BX00100000', 'Acme'), ('BX00100000', 'Acme'), ('BX00100001', ''),
+                      ('BX00100002', 'Acme'), ('BX00100002', 'Acme')]
+
+
+def test_throttled_pages_are_retried(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=2, error_rate=0.3, seed=3, detail_sample=detail_page())
+    scraper = AsyncScraper('toaster', api_url=server.url,
+                           rate_limiter=RateLimiter(rate=100.0, base_delay=0.01, max_delay=0.05))
+    # a 503 drawn for the same url every time would give it up
+    scraper.max_retries = 20
+    asyncio.run(scraper.search('toaster'))
+
+    assert server.error_count > 0
+    assert len(scraper.product_obj_list) == 10
+    assert all(product.brand == 'Acme' for product in scraper.product_obj_list)
+    assert scraper.metrics.count('pages_blocked') == server.error_count
+    assert scraper.rate_limiter.stats()['blocks'] == server.error_count
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import json
+
+from amazon_scraper.batch import BatchScraper
+
+
+def test_keyword_finishes_when_a_product_fails(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=4, pages=2, detail_sample=detail_page())
+    batch = BatchScraper(['toaster', 'kettle'], api_url=server.url, dedup=False)
+    make_scraper = batch.make_scraper
+
+    def failing_scraper(word):
+        scraper = make_scraper(word)
+        if word == 'kettle':
+            parse = scraper.parse_brand_and_description
+
+            def failing_parse(page_content, asin=None):
+                if asin == 'BX00200001':
+                    raise ValueError(f"cannot parse {asin}")
+                return parse(page_content, asin)
+
+            scraper.parse_brand_and_description = failing_parse
+        return scraper
+
+    batch.make_scraper = failing_scraper
+    batch.search()
+
+    assert sorted(batch.finished) == ['kettle', 'toaster']
+    with open('toaster.json', encoding='utf-8') as f:
+        assert len(json.load(f)) == 8
+    with open('kettle.json', encoding='utf-8') as f:
+        assert len(json.load(f)) == 7
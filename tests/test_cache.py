@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+
+from amazon_scraper.cache import ResponseCache
+from amazon_scraper.scraper import Scraper
+
+
+def detail_url(asin):
+    return 'https://www.amazon.com/dp/%s?ref_=sr_1_1' % asin
+
+
+def test_pages_go_stale_after_their_ttl():
+    cache = ResponseCache(ttl={'detail': 0})
+    cache.put(detail_url('B000000001'), '<html>old</html>')
+    cache.put('https://www.amazon.com/s?k=lamp&qid=123', '<html>search</html>')
+
+    stale = cache.get(detail_url('B000000001'))
+    # the volatile qid parameter doesn't change the key
+    fresh = cache.get('https://www.amazon.com/s?k=lamp&qid=456')
+
+    assert stale.body == '<html>old</html>' and not stale.fresh
+    assert fresh.body == '<html>search</html>' and fresh.fresh
+    assert cache.get(detail_url('B000000002')) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_page_is_evicted():
+    # random pages compress to about the same size, there is room for two and a half of them
+    pages = {asin: os.urandom(500).hex() for asin in ('B000000001', 'B000000002', 'B000000003')}
+    cache = ResponseCache()
+    cache.put(detail_url('B000000001'), pages['B000000001'])
+    cache.put(detail_url('B000000002'), pages['B000000002'])
+    cache.max_size = cache.size * 5 // 4
+    cache.get(detail_url('B000000001'))
+
+    cache.put(detail_url('B000000003'), pages['B000000003'])
+
+    assert cache.get(detail_url('B000000002')) is None
+    assert cache.get(detail_url('B000000001')).body == pages['B000000001']
+    assert cache.get(detail_url('B000000003')).body == pages['B000000003']
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size'] <= cache.max_size
+
+
+def test_stale_page_is_revalidated_with_a_conditional_request(mock_amazon):
+    server = mock_amazon(products_per_page=3)
+    cache = ResponseCache(ttl={'search': 0})
+    scraper = Scraper('toaster', api_url=server.url, cache=cache)
+    url = scraper.prepare_url('toaster')
+
+    first = scraper.get_page_content(url)
+    second = scraper.get_page_content(url)
+
+    assert second == first
+    assert server.request_count == 2
+    assert server.not_modified_count == 1
+    assert cache.stats()['revalidations'] == 1
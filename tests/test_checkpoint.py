@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import json
+
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.checkpoint import CheckpointStore, done, in_flight
+from amazon_scraper.history import PriceHistory
+
+
+def read_products(word):
+    with open(word + '.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_resume_fetches_only_the_products_left_over(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=3, detail_sample=detail_page())
+    checkpoint = CheckpointStore('checkpoint.sqlite')
+    scraper = Scraper('toaster', api_url=server.url, checkpoint=checkpoint)
+    parse = scraper.parse_brand_and_description
+
+    def failing_parse(page_content, asin=None):
+        if asin.endswith('3'):
+            raise ValueError(f"cannot parse {asin}")
+        return parse(page_content, asin)
+
+    scraper.parse_brand_and_description = failing_parse
+    scraper.search('toaster')
+    assert len(read_products('toaster')) == 12
+    counts = checkpoint.counts('toaster')
+    assert (counts[('detail', done)], counts[('detail', in_flight)]) == (12, 3)
+
+    requests = server.request_count
+    resumed = Scraper('toaster', api_url=server.url, checkpoint=checkpoint, resume=True)
+    resumed.search('toaster')
+
+    products = read_products('toaster')
+    assert sorted(product['asin'] for product in products) == sorted(
+        "BX%03d%05d" % (page, i) for page in (1, 2, 3) for i in range(5))
+    assert all(product['brand'] == 'Acme' for product in products)
+    # only the three detail pages left over are requested again
+    assert server.request_count - requests == 3
+    assert checkpoint.counts('toaster')[('detail', done)] == 15
+    assert ('detail', in_flight) not in checkpoint.counts('toaster')
+
+
+def test_resume_of_a_finished_crawl_fetches_nothing(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=2, detail_sample=detail_page())
+    checkpoint = CheckpointStore('checkpoint.sqlite')
+    Scraper('toaster', api_url=server.url, checkpoint=checkpoint).search('toaster')
+
+    requests = server.request_count
+    Scraper('toaster', api_url=server.url, checkpoint=checkpoint, resume=True).search('toaster')
+
+    assert server.request_count == requests
+    assert len(read_products('toaster')) == 10
+
+
+def test_resume_after_enrich_fetches_nothing(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=2, detail_sample=detail_page())
+    checkpoint = CheckpointStore('checkpoint.sqlite')
+    history = PriceHistory('history.sqlite')
+    Scraper('toaster', api_url=server.url, checkpoint=checkpoint, history=history, listing_only=True).search('toaster')
+    assert all(product['brand'] == '' for product in read_products('toaster'))
+
+    enriched = Scraper('toaster', api_url=server.url, checkpoint=checkpoint, history=history).enrich(workers=3)
+
+    assert enriched == 10
+    assert all(product['brand'] == 'Acme' for product in read_products('toaster.enriched'))
+    assert checkpoint.counts('toaster') == {('search', done): 2, ('detail', done): 10}
+    assert {history.latest(asin)['brand'] for asin in history.asins()} == {'Acme'}
+
+    requests = server.request_count
+    Scraper('toaster', api_url=server.url, checkpoint=checkpoint, resume=True).search('toaster')
+
+    assert server.request_count == requests
+    assert len(read_products('toaster')) == 10
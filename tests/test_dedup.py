@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import time
+
+from amazon_scraper.scraper import Scraper
+
+from mock_server import read_sample
+
+
+def test_products_waiting_for_a_failed_asin_go_on_with_empty_details(mock_amazon, detail_page):
+    # every asin is listed twice on each page, the second product waits for the detail page of the first
+    server = mock_amazon(products_per_page=3, listing_sample=read_sample('product_list.html') * 2,
+                         detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url)
+    parse = scraper.parse_brand_and_description
+
+    def failing_parse(page_content, asin=None):
+        if asin.endswith('1'):
+            raise ValueError(f"cannot parse {asin}")
+        return parse(page_content, asin)
+
+    scraper.parse_brand_and_description = failing_parse
+    scraper.search('toaster')
+
+    brands = sorted((product.asin, product.brand) for product in scraper.product_obj_list)
+    assert brands == [('BX00100000', 'Acme'), ('BX00100000', 'Acme'), ('BX00100001', ''),
+                      ('BX00100002', 'Acme'), ('BX00100002', 'Acme')]
+    assert scraper.asin_index.stats() == {'fetches': 3, 'saved': 3}
+
+
+def test_failed_fetch_hands_on_the_waiting_products(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=2, listing_sample=read_sample('product_list.html') * 2,
+                         detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url, detail_workers=2)
+    fetch = scraper.fetch_product_page
+
+    def failing_fetch(product_obj, url):
+        if product_obj.asin.endswith('0'):
+            # fails once the second product of the asin waits for this fetch
+            deadline = time.monotonic() + 5
+            while scraper.asin_index.saved == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            raise ConnectionError(f"cannot fetch {url}")
+        return fetch(product_obj, url)
+
+    scraper.fetch_product_page = failing_fetch
+    scraper.search('toaster')
+
+    brands = sorted((product.asin, product.brand) for product in scraper.product_obj_list)
+    assert brands == [('BX00100000', ''), ('BX00100001', 'Acme'), ('BX00100001', 'Acme')]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from amazon_scraper.detail_parser import extract_details, chunk_size
+
+
+@pytest.mark.parametrize('padding', [0, chunk_size // 10, chunk_size // 4])
+def test_about_this_item_list_crossing_chunks_is_read_whole(detail_page, padding):
+    page = detail_page(bullets=10, padding=padding)
+    if padding:
+        # the list starts in the first chunk and ends in a later one
+        assert page.find('Feature 0') < chunk_size < page.find('Feature 9')
+
+    details = extract_details(page)
+
+    assert details['brand'] == 'Acme'
+    assert len(details['description']) == 10
+    assert details['description'][-1].startswith('Feature 9')
+
+
+def test_feature_bullets_without_heading(detail_page):
+    page = detail_page(bullets=4, padding=5000).replace('<h1>About this item</h1>', '')
+
+    details = extract_details(page)
+
+    assert len(details['description']) == 4
+
+
+def test_byline_when_there_is_no_brand_row(detail_page):
+    details = extract_details(detail_page(po_brand=False), fields=('brand',))
+
+    assert details == {'brand': 'Visit the Acme Store'}
+
+
+@pytest.mark.parametrize('items', [
+    '<ul><li>one<li>two</ul>',
+    '<ul><li>one</li><li>two</ul>',
+    '<li>one<li>two',
+])
+def test_unclosed_list_items_are_kept(items):
+    page = '<div><h1>About this item</h1>%s</div>' % items
+
+    details = extract_details(page, fields=('description',))
+
+    assert details['description'] == ['one', 'two']
+
+
+def test_list_items_above_the_heading_in_the_same_div():
+    page = ('<div id="outer"><ul><li>skipped</li></ul>'
+            '<div><ul><li>zero</li></ul><h2>About this item</h2><ul><li>one</li></ul></div></div>')
+
+    details = extract_details(page, fields=('description',))
+
+    assert details['description'] == ['zero', 'one']
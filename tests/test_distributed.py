@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+from amazon_scraper.distributed import TaskQueue, QueueServer, RemoteQueue, Coordinator, Worker
+
+
+def read_products(word):
+    with open(word + '.json', encoding='utf-8') as f:
+        return sorted(json.load(f), key=lambda product: product['asin'])
+
+
+def test_workers_drain_the_queue(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=4, pages=3, detail_sample=detail_page())
+    queue = TaskQueue('queue.sqlite')
+    coordinator = Coordinator(queue, poll_interval=0.1)
+    coordinator.submit(['toaster', 'kettle'])
+    Worker(queue, threads=4, poll_interval=0.1, api_url=server.url).run()
+
+    assert coordinator.export() == {'kettle': 12, 'toaster': 12}
+    assert all(product['brand'] == 'Acme' for product in read_products('toaster'))
+
+
+def test_failed_detail_task_emits_the_product_without_details(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=3, detail_sample=detail_page())
+    queue = TaskQueue('queue.sqlite', max_attempts=2)
+    coordinator = Coordinator(queue, poll_interval=0.1)
+    coordinator.submit(['toaster'])
+    worker = Worker(queue, threads=2, poll_interval=0.1, api_url=server.url)
+    scraper = worker.scraper_for('toaster')
+    parse = scraper.parse_brand_and_description
+
+    def failing_parse(page_content, asin=None):
+        if asin.endswith('1'):
+            raise ValueError(f"cannot parse {asin}")
+        return parse(page_content, asin)
+
+    scraper.parse_brand_and_description = failing_parse
+    worker.run()
+    coordinator.export()
+
+    assert [(product['asin'], product['brand']) for product in read_products('toaster')] == [
+        ('BX00100000', 'Acme'), ('BX00100001', ''), ('BX00100002', 'Acme')]
+    assert queue.counts()['detail failed'] == 1
+
+
+
+def test_asin_of_two_keywords_is_fetched_once(mock_amazon, detail_page):
+    # both keywords list the same asins
+    server = mock_amazon(products_per_page=3, detail_sample=detail_page())
+    queue = TaskQueue('queue.sqlite', max_attempts=2)
+    coordinator = Coordinator(queue, poll_interval=0.1)
+    coordinator.submit(['toaster', 'kettle'])
+    worker = Worker(queue, threads=4, poll_interval=0.1, api_url=server.url)
+    for word in ('toaster', 'kettle'):
+        scraper = worker.scraper_for(word)
+
+        def failing_parse(page_content, asin=None, parse=scraper.parse_brand_and_description):
+            if asin.endswith('1'):
+                raise ValueError(f"cannot parse {asin}")
+            return parse(page_content, asin)
+
+        scraper.parse_brand_and_description = failing_parse
+    worker.run()
+
+    assert coordinator.export() == {'toaster': 3, 'kettle': 3}
+    for word in ('toaster', 'kettle'):
+        assert [(product['asin'], product['brand']) for product in read_products(word)] == [
+            ('BX00100000', 'Acme'), ('BX00100001', ''), ('BX00100002', 'Acme')]
+    # two search pages, two detail pages and two tries of the failing one
+    assert server.request_count == 6
+    assert queue.counts()['detail done'] + queue.counts()['detail failed'] == 3
+
+def test_worker_waits_for_an_unreachable_coordinator(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=3, detail_sample=detail_page())
+    queue = TaskQueue('queue.sqlite')
+    Coordinator(queue).submit(['toaster'])
+    queue_server = QueueServer(queue, port=0)
+    port = queue_server.httpd.server_address[1]
+    queue_server.httpd.server_close()
+
+    worker = Worker(RemoteQueue(f"http://127.0.0.1:{port}/", timeout=5.0), threads=2, poll_interval=0.1,
+                    retry_delay=0.05, max_retry_delay=0.2, api_url=server.url)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    # the coordinator comes up after the worker started
+    threading.Event().wait(0.5)
+    with QueueServer(queue, port=port) as queue_server:
+        thread.join(30)
+        assert not thread.is_alive()
+
+    assert queue.finished()
+    assert queue.counts()['results'] == 3
+
+
+def test_queue_is_served_on_this_machine_by_default():
+    queue = TaskQueue('queue.sqlite')
+    queue_server = QueueServer(queue, port=0)
+    try:
+        assert queue_server.httpd.server_address[0] == '127.0.0.1'
+    finally:
+        queue_server.httpd.server_close()
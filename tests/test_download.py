@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.ratelimit import RateLimiter
+
+from mock_server import read_sample
+
+
+no_results = '<div class="s-no-outline">No results for toaster. Try checking your spelling or use more general terms</div>'
+
+
+def test_error_page_past_the_validity_window_is_invalid(mock_amazon):
+    # the message of a search without results comes after the header, past the first validity_window bytes
+    header = '<div class="nav-header">' + 'x' * 2048 + '</div>'
+    server = mock_amazon(products_per_page=1, listing_sample=header + no_results)
+    scraper = Scraper('toaster', api_url=server.url, validity_window=1024,
+                      rate_limiter=RateLimiter(rate=100.0, base_delay=0.01, max_delay=0.05))
+
+    assert scraper.get_page_content(scraper.prepare_url('toaster')) is None
+    assert server.request_count == scraper.max_retries
+    assert scraper.metrics.count('pages_invalid') == scraper.max_retries
+    assert scraper.metrics.count('pages_blocked') == 0
+
+
+def test_compressed_search_pages_are_read_whole(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=2, detail_sample=detail_page(padding=20000),
+                         listing_sample=read_sample('product_list.html'))
+    scraper = Scraper('toaster', api_url=server.url, validity_window=1024)
+    scraper.search('toaster')
+
+    assert len(scraper.product_obj_list) == 10
+    assert all(product.brand == 'Acme' for product in scraper.product_obj_list)
+    assert 0 < scraper.metrics.count('bytes_transferred') < scraper.metrics.count('bytes_fetched')
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from amazon_scraper import fingerprint
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.fingerprint import FingerprintStore
+
+
+def crawl(server, store):
+    scraper = Scraper('toaster', api_url=server.url, fingerprints=store)
+    scraper.search('toaster')
+    return scraper
+
+
+def test_unchanged_pages_are_not_parsed_again(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=3, pages=2, detail_sample=detail_page())
+    store = FingerprintStore('fingerprints.sqlite')
+    first = crawl(server, store)
+    second = crawl(server, store)
+
+    assert second.metrics.count('pages_unchanged', stage='search') == 2
+    assert second.metrics.count('pages_unchanged', stage='detail') == 6
+    assert ([product.to_dict() for product in sorted(second.product_obj_list, key=lambda p: p.asin)] ==
+            [product.to_dict() for product in sorted(first.product_obj_list, key=lambda p: p.asin)])
+
+
+def test_new_extractor_version_parses_every_page_again(mock_amazon, detail_page, monkeypatch):
+    server = mock_amazon(products_per_page=3, pages=2, detail_sample=detail_page())
+    store = FingerprintStore('fingerprints.sqlite')
+    crawl(server, store)
+
+    monkeypatch.setattr(fingerprint, 'extractor_version', fingerprint.extractor_version + 1)
+    scraper = crawl(server, store)
+
+    assert scraper.metrics.count('pages_unchanged', stage='search') == 0
+    # every detail page of the mock server is the same page, the first one is parsed again
+    assert scraper.metrics.count('pages_unchanged', stage='detail') == 5
+    assert store.stats()['stored'] == 2 * (2 + 1)
+    assert len(scraper.product_obj_list) == 6
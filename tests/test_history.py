@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from amazon_scraper.history import PriceHistory
+from amazon_scraper.product import Product
+
+
+def lamp(price, asin='B000000001', rating_stars=4.5):
+    return Product(url=f'/dp/{asin}', asin=asin, title='Lamp', price=price, rating_stars=rating_stars, review_count=10)
+
+
+def test_history_row_only_when_a_tracked_field_changes():
+    history = PriceHistory()
+
+    assert history.record([lamp(20.0)], keyword='lamp', seen_at=100) == 1
+    assert history.record([lamp(20.0)], keyword='lamp', seen_at=200) == 0
+    assert history.record([lamp(15.0)], keyword='lamp', seen_at=300) == 1
+    # products without an asin can't be tracked
+    assert history.record([Product(title='no asin', price=1.0)], seen_at=300) == 0
+
+    assert [(row['seen_at'], row['price']) for row in history.history('B000000001')] == [(100, 20.0), (300, 15.0)]
+    latest = history.latest('B000000001')
+    assert (latest['first_seen'], latest['last_seen'], latest['last_changed']) == (100, 300, 300)
+    assert [row['seen_at'] for row in history.changes_since(150)] == [300]
+    assert history.asins() == {'B000000001'}
+
+
+def test_price_drops():
+    history = PriceHistory()
+    history.record([lamp(20.0), lamp(50.0, 'B000000002'), lamp(10.0, 'B000000003')], keyword='lamp', seen_at=100)
+    history.record([lamp(15.0), lamp(49.0, 'B000000002'), lamp(12.0, 'B000000003'), lamp(5.0, 'B000000004')],
+                   keyword='lamp', seen_at=200)
+
+    drops = history.price_drops(since=150)
+
+    # the new product and the one that got dearer are left out, biggest drop first
+    assert [(d['asin'], d['old_price'], d['price']) for d in drops] == [('B000000001', 20.0, 15.0),
+                                                                         ('B000000002', 50.0, 49.0)]
+    assert drops[0]['drop'] == 0.25
+    assert [d['asin'] for d in history.price_drops(since=150, min_drop=0.1)] == ['B000000001']
+    # nothing changed before the first crawl
+    assert history.price_drops(since=50) == []
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from amazon_scraper.scraper import Scraper
+
+from mock_server import read_sample
+
+
+def test_products_stream_and_every_call_starts_over(mock_amazon, detail_page):
+    # every asin is listed twice, the second product waits for the fetch of the first
+    server = mock_amazon(products_per_page=4, pages=3, listing_sample=read_sample('product_list.html') * 2,
+                         detail_sample=detail_page(), latency=0.02)
+    scraper = Scraper('toaster', api_url=server.url)
+
+    # leaving the loop early cancels the crawl with fetches of some asins in flight
+    for product in scraper.iter_products('kettle'):
+        break
+    assert scraper.word == 'toaster'
+
+    products = list(scraper.iter_products('kettle'))
+    assert len(products) == 24
+    assert all(product.brand == 'Acme' for product in products)
+    assert scraper.word == 'toaster'
+
+
+def test_timeout_is_kept_while_requests_are_in_flight(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=3, detail_sample=detail_page(), latency=0.5)
+    scraper = Scraper('toaster', api_url=server.url)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        list(scraper.iter_products(timeout=0.3))
+    assert time.monotonic() - start < 0.45
+    assert scraper.word == 'toaster'
+
+
+def test_failed_products_go_to_on_error(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=2, detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url)
+    parse = scraper.parse_brand_and_description
+
+    def failing_parse(page_content, asin=None):
+        if asin.endswith('4'):
+            raise ValueError(f"cannot parse {asin}")
+        return parse(page_content, asin)
+
+    scraper.parse_brand_and_description = failing_parse
+    errors = []
+    products = list(scraper.iter_products(on_error=lambda stage, item, error: errors.append((stage, str(error)))))
+
+    assert len(products) == 8
+    assert sorted(errors) == [('parse', 'cannot parse BX00100004'), ('parse', 'cannot parse BX00200004')]
+
+
+def test_max_workers_raises_the_limits_of_the_scraper(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url, search_workers=1, detail_workers=2)
+
+    assert len(list(scraper.iter_products(max_workers=16))) == 5
+
+    assert scraper.connections == 17
+    assert scraper.rate_limiter.max_concurrency == 17
+    assert [endpoint.max_concurrency for endpoint in scraper.transport.endpoints] == [17]
+    assert (scraper.search_workers, scraper.detail_workers) == (1, 2)
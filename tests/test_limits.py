@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from amazon_scraper.scraper import Scraper
+
+
+@pytest.mark.parametrize('follow_next', [False, True])
+def test_max_pages(mock_amazon, follow_next):
+    server = mock_amazon(products_per_page=4, pages=10)
+    scraper = Scraper('toaster', api_url=server.url, listing_only=True, max_pages=3, follow_next=follow_next)
+    scraper.search('toaster')
+
+    # listing-only crawls request search pages only
+    assert server.request_count == 3
+    assert sorted({product.asin[2:5] for product in scraper.product_obj_list}) == ['001', '002', '003']
+    assert len(scraper.product_obj_list) == 12
+
+
+def test_follow_next_crawls_every_page(mock_amazon):
+    server = mock_amazon(products_per_page=4, pages=5)
+    scraper = Scraper('toaster', api_url=server.url, listing_only=True, follow_next=True)
+    scraper.search('toaster')
+
+    assert server.request_count == 5
+    assert len(scraper.product_obj_list) == 20
+
+
+def test_max_products(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=4, pages=10, detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url, search_workers=1, max_products=10)
+    scraper.search('toaster')
+
+    assert len(scraper.product_obj_list) == 10
+    assert all(product.brand == 'Acme' for product in scraper.product_obj_list)
+    # only the detail pages of the ten products are requested
+    assert scraper.asin_index.stats()['fetches'] == 10
+    # three search pages list them, the fetch stage may have the next one on its way before they are parsed
+    assert server.request_count - 10 in (3, 4)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from amazon_scraper.metrics import Metrics, MetricsServer
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.product import Product
+
+
+def run_threads(target, count):
+    for _ in range(count):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+
+
+def test_shards_of_exited_threads_are_folded():
+    metrics = Metrics()
+
+    def record():
+        metrics.inc('products')
+        metrics.observe('parse_seconds', 0.002, stage='detail')
+
+    run_threads(record, 50)
+    record()
+
+    # the totals of the exited threads and the shard of this thread
+    assert len(metrics._counters.shards()) == 2
+    assert len(metrics._histograms.shards()) == 2
+    assert metrics.count('products') == 51
+    assert metrics.histograms[('parse_seconds', (('stage', 'detail'),))].count == 51
+
+
+def test_products_of_exited_threads_keep_their_order():
+    scraper = Scraper('toaster')
+
+    def keep():
+        scraper.keep_product(Product(asin=f"B{scraper.item_count:09d}"))
+
+    run_threads(keep, 20)
+    keep()
+
+    assert len(scraper._buffers.shards()) == 2
+    assert [product.asin for product in scraper.product_obj_list] == [f"B{number:09d}" for number in range(1, 22)]
+
+
+def test_metrics_server_serves_the_crawl_metrics(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=3, detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url)
+    scraper.search('toaster')
+
+    with MetricsServer(scraper.metrics, port=0) as metrics_server:
+        with urlopen(metrics_server.url) as response:
+            content_type = response.headers['Content-Type']
+            body = response.read().decode('utf-8')
+        with pytest.raises(HTTPError):
+            urlopen(metrics_server.url.replace('/metrics', '/other'))
+
+    samples = dict(line.rsplit(' ', 1) for line in body.splitlines())
+    names = {key.split('{')[0] for key in samples}
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert all(name.startswith('amazon_scraper_') for name in names)
+    assert {'amazon_scraper_requests_total', 'amazon_scraper_products_total',
+            'amazon_scraper_request_seconds_bucket', 'amazon_scraper_request_seconds_sum',
+            'amazon_scraper_request_seconds_count'} <= names
+    assert float(samples['amazon_scraper_requests_total']) == server.request_count
+    assert samples['amazon_scraper_request_seconds_bucket{le="+Inf"}'] == samples['amazon_scraper_request_seconds_count']
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from amazon_scraper.output import NDJSONWriter
+from amazon_scraper.product import Product
+
+
+def make_product(number):
+    return Product(asin=f"B{number:09d}", title=f"Product {number}")
+
+
+def test_failing_on_flush_keeps_writing_and_raises_on_close(tmp_path):
+    flushed = []
+
+    def on_flush(products):
+        flushed.append(len(products))
+        if len(flushed) == 1:
+            raise ValueError('checkpoint is gone')
+
+    writer = NDJSONWriter(str(tmp_path / 'out.ndjson'), batch_size=2, flush_interval=0.01, on_flush=on_flush)
+    writer.start()
+    for number in range(6):
+        writer.write(make_product(number))
+    with pytest.raises(ValueError, match='checkpoint is gone'):
+        writer.close()
+
+    with open(tmp_path / 'out.ndjson', encoding='utf-8') as f:
+        asins = [json.loads(line)['asin'] for line in f]
+    assert asins == [f"B{number:09d}" for number in range(6)]
+    assert sum(flushed) == 6
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.parse_pool import ParsePool
+from amazon_scraper.rules import RuleSet, default_rules_path
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with ParsePool(workers=2) as pool:
+        yield pool
+
+
+def crawl(server, **kwargs):
+    scraper = Scraper('toaster', api_url=server.url, **kwargs)
+    if scraper.parse_pool is not None:
+        # every search page, paginated ones too, is parsed in the pool
+        scraper.make_soup = None
+    scraper.search('toaster')
+    return sorted((product.to_dict() for product in scraper.product_obj_list), key=lambda product: product['asin'])
+
+
+@pytest.mark.parametrize('follow_next', [False, True])
+def test_pool_parses_like_the_scraper_threads(mock_amazon, detail_page, pool, follow_next):
+    server = mock_amazon(products_per_page=4, pages=3, detail_sample=detail_page())
+
+    in_threads = crawl(server, follow_next=follow_next)
+    in_pool = crawl(server, follow_next=follow_next, parse_pool=pool)
+
+    assert len(in_pool) == 12
+    assert in_pool == in_threads
+
+
+def test_pool_uses_the_rules_of_the_scraper(mock_amazon, detail_page, pool, tmp_path):
+    with open(default_rules_path, encoding='utf-8') as f:
+        spec = json.load(f)
+    spec['listing']['fields']['title'][0]['prefix'] = 'Title: '
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(spec), encoding='utf-8')
+    server = mock_amazon(products_per_page=3, pages=2, detail_sample=detail_page())
+
+    in_pool = crawl(server, parse_pool=pool, rules=str(path))
+
+    assert len(in_pool) == 6
+    assert all(product['title'].startswith('Title: ') for product in in_pool)
+    assert in_pool == crawl(server, rules=str(path))
+
+
+def test_rule_hits_of_the_workers_reach_the_scraper(mock_amazon, detail_page, pool):
+    server = mock_amazon(products_per_page=4, pages=3, detail_sample=detail_page())
+    in_threads = Scraper('toaster', api_url=server.url)
+    in_threads.search('toaster')
+    in_pool = Scraper('toaster', api_url=server.url, parse_pool=pool)
+    in_pool.make_soup = None
+    in_pool.search('toaster')
+
+    hits = in_pool.rules.stats()
+    assert hits['title:title-span'] == 12
+    assert hits['brand:po-brand'] == 12
+    assert hits == in_threads.rules.stats()
+
+
+def test_spec_is_sent_once_per_worker(detail_page, pool, monkeypatch):
+    with open(default_rules_path, encoding='utf-8') as f:
+        spec = json.load(f)
+    spec['detail']['brand'] = ['byline', 'po-brand']
+    rules = RuleSet(spec)
+    sent = []
+    submit = pool.executor.submit
+
+    def recording_submit(function, *args):
+        sent.append(args[-1][1] is not None)
+        return submit(function, *args)
+
+    monkeypatch.setattr(pool.executor, 'submit', recording_submit)
+    for _ in range(30):
+        assert pool.details(detail_page(), rules=rules)['brand'] == 'Visit the Acme Store'
+
+    # every page went with the version, the spec only again after a worker asked for it. The page sent
+    # with the spec may go to another worker than the one asking, so a worker can ask more than once
+    assert sent.count(False) == 30
+    assert pool.workers >= 2 and sent.count(True) < 10
+    assert rules.stats() == {'brand:byline': 30, 'description:about-this-item': 30}
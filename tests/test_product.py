@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+
+import pytest
+
+from amazon_scraper.product import Product, ProductBatch, product_fields
+
+
+def make_batch():
+    return ProductBatch([
+        Product(url='/dp/B0001', asin='B0001', title='Lamp', brand='Acme', description='Bright\nWarm',
+                price=19.99, rating_stars='4.5', review_count=120, bestseller=True),
+        # no price, rating or review count
+        Product(url='/dp/B0002', asin='B0002', title='Chair', prime=True),
+    ])
+
+
+def test_missing_values_come_back_as_none():
+    batch = make_batch()
+
+    assert batch.price[1] != batch.price[1]
+    assert batch.review_count[1] == -1
+    product = batch[1]
+    assert (product.price, product.rating_stars, product.review_count) == (None, None, None)
+    assert (product.bestseller, product.prime) == (False, True)
+    # numbers read from the page as strings come back as numbers
+    assert (batch[0].price, batch[0].rating_stars, batch[0].review_count) == (19.99, 4.5, 120)
+
+
+def test_to_csv(workdir):
+    make_batch().to_csv('products.csv')
+
+    with open('products.csv', encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+
+    assert rows[0] == list(product_fields)
+    assert rows[1] == ['/dp/B0001', 'B0001', 'Lamp', 'Acme', 'Bright\nWarm', '19.99', '', '4.5', '120', 'True', 'False']
+    # missing values are empty cells
+    assert rows[2][5:] == ['', '', '', '', 'False', 'True']
+
+
+@pytest.mark.parametrize('ndjson', [False, True])
+def test_json_round_trip(workdir, ndjson):
+    batch = make_batch()
+    batch.to_json('products.json')
+    if ndjson:
+        with open('products.json', encoding='utf-8') as f:
+            records = json.load(f)
+        with open('products.json', mode='w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+
+    loaded = ProductBatch.read_json('products.json')
+
+    assert list(loaded.rows()) == list(batch.rows())
+    assert loaded[1].price is None and loaded[1].review_count is None
+
+
+def test_to_arrow():
+    pyarrow = pytest.importorskip('pyarrow')
+
+    table = make_batch().to_arrow()
+
+    assert table.column_names == list(product_fields)
+    assert table.schema.field('review_count').type == pyarrow.int64()
+    assert table.to_pylist() == [dict(zip(product_fields, row)) for row in make_batch().rows()]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.ratelimit import RateLimiter
+
+
+def fast_limiter():
+    return RateLimiter(rate=100.0, base_delay=0.01, max_delay=0.05)
+
+
+def test_throttled_pages_are_retried(mock_amazon, detail_page):
+    server = mock_amazon(products_per_page=5, pages=3, error_rate=0.3, seed=7, detail_sample=detail_page())
+    scraper = Scraper('toaster', api_url=server.url, rate_limiter=fast_limiter())
+    # a 503 drawn for the same url every time would give it up
+    scraper.max_retries = 20
+    scraper.search('toaster')
+
+    assert server.error_count > 0
+    assert len(scraper.product_obj_list) == 15
+    assert all(product.brand == 'Acme' for product in scraper.product_obj_list)
+    assert scraper.metrics.count('pages_blocked') == server.error_count
+    assert scraper.rate_limiter.stats()['blocks'] == server.error_count
+
+
+def test_throttled_page_is_given_up_after_max_retries(mock_amazon):
+    server = mock_amazon(error_rate=1.0)
+    scraper = Scraper('toaster', api_url=server.url, rate_limiter=fast_limiter())
+
+    assert scraper.get_page_content(scraper.prepare_url('toaster')) is None
+    assert server.error_count == scraper.max_retries
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from bs4 import BeautifulSoup
+
+from amazon_scraper.scraper import Scraper
+from amazon_scraper.rules import RuleSet
+
+from mock_server import read_sample
+
+
+def test_every_scraper_counts_its_own_rule_hits():
+    page = '<html><body>' + read_sample('product_list.html') + '</body></html>'
+    first, second = Scraper('toaster'), Scraper('kettle')
+    assert first.rules is not second.rules
+
+    first.get_listing_info(first.get_product_tags(page)[0])
+
+    assert first.rules.stats()['title:title-span'] == 1
+    assert second.rules.stats() == {}
+
+
+def test_rules_stop_at_the_last_preferred_field():
+    spec = {'listing': {'fields': {
+        'title': [{'name': 'span', 'tag': 'span'}],
+        'price': [{'name': 'offscreen', 'tag': 'span', 'class': 'a-offscreen', 'type': 'price'}],
+    }}}
+    rules = RuleSet(spec)
+    product = BeautifulSoup('<div>text<span>Toaster</span><span class="a-offscreen">$1,299.00</span>'
+                            '<b>never walked</b></div>', 'html.parser').div
+
+    assert rules.extract(product) == {'title': 'Toaster', 'price': 1299.0}
+    assert rules.stats() == {'title:span': 1, 'price:offscreen': 1}
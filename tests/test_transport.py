@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+import requests
+
+from amazon_scraper.transport import Endpoint, TransportPool
+
+
+class FakeResponse():
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+
+class FakeEndpoint(Endpoint):
+    """Answers with the given status codes in turn, an exception in the list is raised instead
+    """
+
+    def __init__(self, name, outcomes=(), **kwargs):
+        super().__init__(name, **kwargs)
+        self.outcomes = list(outcomes)
+
+    def send(self, url, headers=None):
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+def test_endpoint_must_implement_send():
+    with pytest.raises(TypeError):
+        Endpoint('abstract')
+
+
+def test_healthiest_endpoint_is_picked():
+    fast, slow = FakeEndpoint('fast', max_concurrency=2), FakeEndpoint('slow', max_concurrency=2)
+    pool = TransportPool([slow, fast])
+    pool.release(pool.acquire(), True, 0.5)
+    pool.release(pool.acquire(), True, 0.05)
+    assert (slow.latency, fast.latency) == (0.5, 0.05)
+
+    assert pool.acquire() is fast
+    # the load of the fast endpoint doesn't outweigh its latency
+    assert pool.acquire() is fast
+    # fast is at its concurrency limit
+    assert pool.acquire() is slow
+
+
+def test_failing_endpoint_is_ejected_and_readmitted():
+    flaky, steady = FakeEndpoint('flaky', [503, 503, 503, 503]), FakeEndpoint('steady')
+    pool = TransportPool([flaky, steady], eject_after=2, eject_for=0.05)
+    # endpoints without a measured latency are tried first, flaky first as it is listed first
+    assert not pool.get('https://www.amazon.com/s?k=lamp').ok
+    steady.latency = 1.0
+    assert not pool.get('https://www.amazon.com/s?k=lamp').ok
+
+    assert pool.stats()['flaky']['ejected']
+    assert pool.get('https://www.amazon.com/s?k=lamp').endpoint is steady
+
+    time.sleep(0.06)
+    # back with a clean slate, unmeasured so tried first again, the next ejection is twice as long
+    assert pool.get('https://www.amazon.com/s?k=lamp').endpoint is flaky
+    assert flaky.latency is not None and not pool.stats()['flaky']['ejected']
+    pool.get('https://www.amazon.com/s?k=lamp')
+    assert flaky.ejections == 2
+    assert flaky.ejected_until - time.monotonic() > 0.05
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.ConnectionError('refused'), ValueError('bad body')])
+def test_slot_is_released_whatever_the_request_raised(error):
+    endpoint = FakeEndpoint('only', max_concurrency=1)
+    pool = TransportPool([endpoint])
+
+    def read(response):
+        raise error
+
+    with pytest.raises(type(error)):
+        pool.get('https://www.amazon.com/s?k=lamp', read=read)
+
+    assert endpoint.in_flight == 0
+    assert endpoint.failures == 1
+    # the only slot is free again
+    response = pool.get('https://www.amazon.com/s?k=lamp')
+    assert response.endpoint is endpoint and endpoint.in_flight == 0